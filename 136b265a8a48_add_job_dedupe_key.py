@@ -0,0 +1,28 @@
+"""Add job.dedupe_key, so a job queued twice for the same work runs once
+
+Revision ID: 136b265a8a48
+Revises: df4d95036345
+Create Date: 2026-10-18 21:05:41.208817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '136b265a8a48'
+down_revision = 'df4d95036345'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dedupe_key', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_job_dedupe_key'), ['dedupe_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_job_dedupe_key'))
+        batch_op.drop_column('dedupe_key')
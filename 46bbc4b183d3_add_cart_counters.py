@@ -0,0 +1,36 @@
+"""Add cart.item_count and cart.subtotal
+
+Revision ID: 46bbc4b183d3
+Revises: c06804d9ef3a
+Create Date: 2026-10-18 16:02:11.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '46bbc4b183d3'
+down_revision = 'c06804d9ef3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('item_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('subtotal', sa.Float(), nullable=False, server_default='0'))
+
+    # Backfill from the existing items
+    op.execute(
+        "UPDATE cart SET "
+        "item_count = (SELECT COALESCE(SUM(quantity), 0) FROM cart_item WHERE cart_item.cart_id = cart.id), "
+        "subtotal = (SELECT COALESCE(SUM(cart_item.quantity * game.price), 0) FROM cart_item "
+        "JOIN game ON game.id = cart_item.game_id WHERE cart_item.cart_id = cart.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.drop_column('subtotal')
+        batch_op.drop_column('item_count')
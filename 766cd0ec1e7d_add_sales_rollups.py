@@ -0,0 +1,44 @@
+"""Add sales_daily and sales_daily_game rollups
+
+Fill them with `flask admin rebuild-sales-rollups` after upgrading.
+
+Revision ID: 766cd0ec1e7d
+Revises: 2af559b74dc0
+Create Date: 2026-10-18 17:35:09.614372
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '766cd0ec1e7d'
+down_revision = '2af559b74dc0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('sales_daily_game',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('game_type', sa.String(length=64), nullable=True),
+    sa.Column('region', sa.String(length=64), nullable=True),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], ),
+    sa.PrimaryKeyConstraint('day', 'game_id')
+    )
+
+
+def downgrade():
+    op.drop_table('sales_daily_game')
+    op.drop_table('sales_daily')
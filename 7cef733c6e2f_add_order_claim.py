@@ -0,0 +1,30 @@
+"""Add order claim columns for batch fulfillment
+
+Revision ID: 7cef733c6e2f
+Revises: 90cd601128b2
+Create Date: 2026-10-18 12:31:44.019562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7cef733c6e2f'
+down_revision = '90cd601128b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claim_token', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_order_claim_token'), ['claim_token'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_claim_token'))
+        batch_op.drop_column('claimed_at')
+        batch_op.drop_column('claim_token')
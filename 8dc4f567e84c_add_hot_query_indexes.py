@@ -0,0 +1,60 @@
+"""Add indexes for the hot order, cart and payment lookups; make cart_item(cart_id, game_id) unique
+
+Revision ID: 8dc4f567e84c
+Revises: 766cd0ec1e7d
+Create Date: 2026-10-18 18:02:51.270846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8dc4f567e84c'
+down_revision = '766cd0ec1e7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Merge duplicate cart lines into the oldest one before the unique constraint goes on
+    op.execute(
+        "UPDATE cart_item SET quantity = (SELECT SUM(other.quantity) FROM cart_item other "
+        "WHERE other.cart_id = cart_item.cart_id AND other.game_id = cart_item.game_id) "
+        "WHERE id IN (SELECT MIN(id) FROM cart_item GROUP BY cart_id, game_id HAVING COUNT(*) > 1)"
+    )
+    op.execute("DELETE FROM cart_item WHERE id NOT IN (SELECT MIN(id) FROM cart_item GROUP BY cart_id, game_id)")
+
+    with op.batch_alter_table('cart_item', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_cart_item_cart_id_game_id', ['cart_id', 'game_id'])
+
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_cart_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.create_index('ix_order_user_id_created_at', ['user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_order_status_id', ['status', 'id'], unique=False)
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_item_order_id'), ['order_id'], unique=False)
+
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payment_order_id'), ['order_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_payment_order_id'))
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_item_order_id'))
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_status_id')
+        batch_op.drop_index('ix_order_user_id_created_at')
+
+    with op.batch_alter_table('cart', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cart_user_id'))
+
+    with op.batch_alter_table('cart_item', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cart_item_cart_id_game_id', type_='unique')
@@ -0,0 +1,45 @@
+"""Add job queue
+
+Revision ID: 90cd601128b2
+Revises: afec0f522437
+Create Date: 2026-10-18 11:48:05.271936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '90cd601128b2'
+down_revision = 'afec0f522437'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=64), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('max_attempts', sa.Integer(), nullable=True),
+    sa.Column('run_at', sa.DateTime(), nullable=True),
+    sa.Column('locked_by', sa.String(length=128), nullable=True),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index('ix_job_status_run_at', ['status', 'run_at'], unique=False)
+        batch_op.create_index('ix_job_status_locked_until', ['status', 'locked_until'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_status_locked_until')
+        batch_op.drop_index('ix_job_status_run_at')
+
+    op.drop_table('job')
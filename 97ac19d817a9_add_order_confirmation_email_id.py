@@ -0,0 +1,31 @@
+"""Add order.confirmation_email_id
+
+Revision ID: 97ac19d817a9
+Revises: 7cef733c6e2f
+Create Date: 2026-10-18 13:20:09.552817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '97ac19d817a9'
+down_revision = '7cef733c6e2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('confirmation_email_id', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_order_confirmation_email_id'), ['confirmation_email_id'], unique=False)
+
+    # Orders fulfilled before this revision were already mailed inline; don't fold them into new emails
+    op.execute("UPDATE \"order\" SET confirmation_email_id = 'legacy' WHERE status IN ('completed', 'processing')")
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_confirmation_email_id'))
+        batch_op.drop_column('confirmation_email_id')
@@ -0,0 +1,160 @@
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from sqlalchemy.orm import contains_eager, joinedload
+from models import db, User, Game, Order, OrderItem
+from catalog import CatalogCache
+from pagination import CachedPagination, parse_limit
+
+ADMIN_PAGE_SIZE = 50
+# Counting stops here: past it the listings show "more than" instead of scanning every row
+ADMIN_COUNT_CAP = 10000
+
+# sort name -> (column, descending); the id is always appended as the tie-breaker
+ADMIN_ORDER_SORTS = {
+    "newest": (Order.created_at, True),
+    "oldest": (Order.created_at, False),
+    "total_desc": (Order.total_amount, True),
+    "total_asc": (Order.total_amount, False),
+}
+ADMIN_USER_SORTS = {
+    "newest": (User.created_at, True),
+    "username": (User.username, False),
+    "email": (User.email, False),
+}
+ADMIN_GAME_SORTS = {
+    "newest": (Game.created_at, True),
+    "name": (Game.name, False),
+    "price_asc": (Game.price, False),
+    "price_desc": (Game.price, True),
+    "stock_asc": (Game.stock, False),
+}
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+class AdminListingService:
+    """Paginated, sortable and filterable listings of the admin panel.
+
+    Every page is a fixed handful of queries however large the table: a
+    count, the page itself with its related rows eager-loaded, and for
+    orders one grouped item count over the ids on the page.
+    """
+
+    @staticmethod
+    def parse_paging(args, sorts):
+        """(page, per_page, sort) from a request's query args"""
+        page = max(args.get("page", 1, type=int) or 1, 1)
+        per_page = parse_limit(args.get("per_page"), default=ADMIN_PAGE_SIZE)
+        sort = args.get("sort", "newest")
+        return page, per_page, sort if sort in sorts else "newest"
+
+    @staticmethod
+    def capped_count(query, cap=ADMIN_COUNT_CAP):
+        """COUNT(*) of `query` that stops after cap + 1 rows, so it costs the same on 500k rows as on 10k"""
+        limited = query.order_by(None).limit(cap + 1).subquery()
+        return db.session.query(func.count()).select_from(limited).scalar()
+
+    @staticmethod
+    def _paginate(query, sorts, sort, page, per_page, total, tie_breaker, cap=ADMIN_COUNT_CAP):
+        """Page of `query`; `total` is its capped_count() with the same `cap`.
+
+        Past the cap the real total is unknown, so pages there are
+        not clamped: each fetches one extra row to tell whether a next page
+        exists, and the total grows to cover the rows reached so far.
+        """
+        column, descending = sorts[sort]
+        ordering = [column.desc(), tie_breaker.desc()] if descending else [column.asc(), tie_breaker.asc()]
+        query = query.order_by(*ordering)
+        if total <= cap:
+            page = min(page, max((total + per_page - 1) // per_page, 1)) # Offsets stay within the counted rows
+            items = query.offset((page - 1) * per_page).limit(per_page).all()
+            return CachedPagination(page=page, per_page=per_page, error_out=False, items=items, total=total)
+        offset = (page - 1) * per_page
+        items = query.offset(offset).limit(per_page + 1).all()
+        total = max(total, offset + len(items))
+        return CachedPagination(page=page, per_page=per_page, error_out=False, items=items[:per_page], total=total)
+
+    @staticmethod
+    def parse_order_filters(args):
+        filters = {}
+        status = (args.get("status") or "").strip()
+        if status:
+            filters["status"] = status
+        for field in ("date_from", "date_to"):
+            if _parse_date(args.get(field)):
+                filters[field] = args[field]
+        return filters
+
+    @staticmethod
+    def filter_orders(query, filters):
+        """Apply parse_order_filters() output to a query or select() over Order"""
+        if "status" in filters:
+            query = query.filter(Order.status == filters["status"])
+        if "date_from" in filters:
+            query = query.filter(Order.created_at >= _parse_date(filters["date_from"]))
+        if "date_to" in filters: # Inclusive: the whole of the last day
+            query = query.filter(Order.created_at < _parse_date(filters["date_to"]) + timedelta(days=1))
+        return query
+
+    @staticmethod
+    def list_orders(filters, sort="newest", page=1, per_page=ADMIN_PAGE_SIZE):
+        """Page of orders with their customer and payment loaded, plus {order_id: items count}"""
+        query = AdminListingService.filter_orders(db.session.query(Order).join(Order.customer), filters)
+        total = AdminListingService.capped_count(query)
+        pagination = AdminListingService._paginate(
+            query.options(contains_eager(Order.customer), joinedload(Order.payment)),
+            ADMIN_ORDER_SORTS, sort, page, per_page, total, Order.id)
+        order_ids = [order.id for order in pagination.items]
+        items_counts = dict(
+            db.session.query(OrderItem.order_id, func.count(OrderItem.id))
+            .filter(OrderItem.order_id.in_(order_ids))
+            .group_by(OrderItem.order_id)
+        ) if order_ids else {}
+        return pagination, items_counts
+
+    @staticmethod
+    def parse_user_filters(args):
+        filters = {}
+        search = (args.get("q") or "").strip()
+        if search:
+            filters["q"] = search
+        if args.get("is_admin") in ("0", "1"):
+            filters["is_admin"] = args["is_admin"]
+        return filters
+
+    @staticmethod
+    def list_users(filters, sort="newest", page=1, per_page=ADMIN_PAGE_SIZE):
+        query = db.session.query(User)
+        if "q" in filters:
+            pattern = "%" + filters["q"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            query = query.filter(or_(User.username.ilike(pattern, escape="\\"), User.email.ilike(pattern, escape="\\")))
+        if "is_admin" in filters:
+            query = query.filter(User.is_admin.is_(filters["is_admin"] == "1"))
+        total = AdminListingService.capped_count(query)
+        return AdminListingService._paginate(query, ADMIN_USER_SORTS, sort, page, per_page, total, User.id)
+
+    @staticmethod
+    def parse_game_filters(args):
+        filters = {}
+        game_type = (args.get("game_type") or "").strip()
+        if game_type:
+            filters["game_type"] = game_type
+        if args.get("is_active") in ("0", "1"):
+            filters["is_active"] = args["is_active"]
+        return filters
+
+    @staticmethod
+    def list_games(filters, sort="newest", page=1, per_page=ADMIN_PAGE_SIZE):
+        """Page of games, active or not; the count is kept in the catalog cache until the next game change"""
+        query = db.session.query(Game)
+        if "game_type" in filters:
+            query = query.filter(Game.game_type == filters["game_type"])
+        if "is_active" in filters:
+            query = query.filter(Game.is_active.is_(filters["is_active"] == "1"))
+        total = CatalogCache.get_or_build(json.dumps(["admin_count", filters], sort_keys=True),
+                                          lambda: query.order_by(None).count())
+        return AdminListingService._paginate(query, ADMIN_GAME_SORTS, sort, page, per_page, total, Game.id)
@@ -0,0 +1,44 @@
+"""Add stock_reservation
+
+Revision ID: afec0f522437
+Revises: fccd36d03c8d
+Create Date: 2026-10-18 11:02:17.884310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'afec0f522437'
+down_revision = 'fccd36d03c8d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_reservation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], ),
+    sa.ForeignKeyConstraint(['order_id'], ['order.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_reservation', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stock_reservation_game_id'), ['game_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_reservation_order_id'), ['order_id'], unique=False)
+        batch_op.create_index('ix_stock_reservation_status_expires_at', ['status', 'expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stock_reservation', schema=None) as batch_op:
+        batch_op.drop_index('ix_stock_reservation_status_expires_at')
+        batch_op.drop_index(batch_op.f('ix_stock_reservation_order_id'))
+        batch_op.drop_index(batch_op.f('ix_stock_reservation_game_id'))
+
+    op.drop_table('stock_reservation')
@@ -1,54 +1,91 @@
 from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
-from models import db, Game, Cart, CartItem, Order, OrderItem, Payment
+from models import db, Game, Cart, CartItem, Order, OrderItem
+from cart_service import CartService
+from inventory import InventoryService, InsufficientStock
+from catalog import CatalogService, CatalogCache, GAME_SORTS, DEFAULT_GAME_SORT
+from search import GameSearchIndex
+from http_cache import make_etag, is_not_modified, not_modified, add_validators
+from order_service import OrderService
+from pagination import InvalidCursor, parse_limit
+from db_routing import replica_reads
+from idempotency import idempotent, commit_with_response
 
 api_bp = Blueprint("api", __name__)
 
 # --- Game API Endpoints ---
 
 @api_bp.route("/games", methods=["GET"])
+@replica_reads
 def get_games():
-    """Get a list of active games"""
+    """Get a page of active games.
+
+    Query args: game_type, category, region, min_price, max_price, sort
+    (newest, price_asc, price_desc, name), limit and cursor.
+    """
     try:
-        # Add filtering/pagination later if needed
-        games = Game.query.filter_by(is_active=True).all()
-        games_data = [
-            {
-                "id": game.id,
-                "name": game.name,
-                "price": game.price,
-                "image_url": game.image_url,
-                "category": game.category,
-                "game_type": game.game_type,
-            }
-            for game in games
-        ]
-        return jsonify({"success": True, "data": games_data})
+        filters = CatalogService.parse_filters(request.args)
+        sort = request.args.get("sort", DEFAULT_GAME_SORT)
+        if sort not in GAME_SORTS:
+            return jsonify({"success": False, "message": "طريقة الترتيب غير مدعومة."}), 400
+        # Any catalog change bumps the version, so it validates every listing
+        etag = make_etag("games", CatalogCache.version(), request.query_string.decode("utf-8"))
+        if is_not_modified(etag):
+            return not_modified(etag)
+
+        games_data, next_cursor = CatalogService.get_games_page(
+            filters, sort=sort, cursor=request.args.get("cursor"),
+            limit=parse_limit(request.args.get("limit")))
+        response = jsonify({
+            "success": True,
+            "data": games_data,
+            "next_cursor": next_cursor,
+            "total": CatalogService.count_active_games(filters)
+        })
+        return add_validators(response, etag)
+    except InvalidCursor:
+        return jsonify({"success": False, "message": "مؤشر الصفحة غير صالح."}), 400
     except Exception as e:
         # Log the error in a real application
         print(f"Error fetching games: {e}")
         return jsonify({"success": False, "message": "حدث خطأ أثناء جلب الألعاب."}), 500
 
+@api_bp.route("/games/search", methods=["GET"])
+@replica_reads
+def search_games_api():
+    """Full-text search over active games (query arg: q, limit, offset)"""
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"success": False, "message": "يرجى إدخال كلمة البحث."}), 400
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        games = GameSearchIndex.search(query, limit=limit, offset=offset)
+        return jsonify({"success": True, "data": [CatalogService.serialize_summary(g) for g in games]})
+    except Exception as e:
+        print(f"Error searching games: {e}")
+        return jsonify({"success": False, "message": "حدث خطأ أثناء البحث."}), 500
+
 @api_bp.route("/games/<int:id>", methods=["GET"])
+@replica_reads
 def get_game_detail(id):
     """Get details for a specific game"""
     try:
-        game = Game.query.get_or_404(id)
-        if not game.is_active:
+        # Cheap version lookup first: every write to the game, stock included, moves updated_at
+        state = CatalogService.game_state(id)
+        if state is None:
+            return jsonify({"success": False, "message": "اللعبة غير متوفرة."}), 404
+        etag = make_etag("game", id, state.updated_at)
+        if is_not_modified(etag, state.updated_at):
+            return not_modified(etag, state.updated_at)
+
+        game = CatalogService.get_game(id, state)
+        if not game or not game["is_active"]:
              return jsonify({"success": False, "message": "اللعبة غير متوفرة."}), 404
-             
-        game_data = {
-            "id": game.id,
-            "name": game.name,
-            "description": game.description,
-            "price": game.price,
-            "image_url": game.image_url,
-            "category": game.category,
-            "game_type": game.game_type,
-            "region": game.region,
-            "stock": game.stock, # Consider if stock should be public
-        }
-        return jsonify({"success": True, "data": game_data})
+        last_modified = state.updated_at
+
+        game_data = {key: value for key, value in game.items() if key != "is_active"}
+        return add_validators(jsonify({"success": True, "data": game_data}), etag, last_modified)
     except Exception as e:
         print(f"Error fetching game detail: {e}")
         return jsonify({"success": False, "message": "حدث خطأ أثناء جلب تفاصيل اللعبة."}), 500
@@ -60,44 +97,40 @@ def get_game_detail(id):
 def view_cart_api():
     """Get the current user's cart contents"""
     try:
-        cart = current_user.cart
-        if not cart:
+        # Items, games and totals come back from one joined query
+        summary = CartService.get_cart_summary(current_user.id)
+        if summary is None:
             # Create cart if it doesn't exist (should have been created on registration)
             cart = Cart(customer=current_user)
             db.session.add(cart)
             db.session.commit()
-            
-        cart_items = CartItem.query.filter_by(cart_id=cart.id).all()
-        items_data = []
-        total = 0
-        for item in cart_items:
-            game = item.game
-            item_total = item.quantity * game.price
-            items_data.append({
-                "item_id": item.id,
-                "game_id": game.id,
-                "name": game.name,
-                "price": game.price,
-                "quantity": item.quantity,
-                "image_url": game.image_url,
-                "item_total": round(item_total, 2),
-                "game_account_id": item.game_account_id
-            })
-            total += item_total
-            
+            summary = {"items": [], "total": 0}
+
         return jsonify({
-            "success": True, 
+            "success": True,
             "data": {
-                "items": items_data, 
-                "total": round(total, 2)
+                "items": summary["items"],
+                "total": summary["total"]
             }
         })
     except Exception as e:
         print(f"Error fetching cart: {e}")
         return jsonify({"success": False, "message": "حدث خطأ أثناء جلب سلة التسوق."}), 500
 
+@api_bp.route("/cart/count", methods=["GET"])
+@login_required
+def cart_count_api():
+    """Number of items and subtotal of the current user's cart, for the navbar badge"""
+    try:
+        item_count, subtotal = CartService.get_counters(current_user.id)
+        return jsonify({"success": True, "data": {"item_count": item_count, "subtotal": subtotal}})
+    except Exception as e:
+        print(f"Error fetching cart count: {e}")
+        return jsonify({"success": False, "message": "حدث خطأ أثناء جلب عدد منتجات السلة."}), 500
+
 @api_bp.route("/cart/add", methods=["POST"])
 @login_required
+@idempotent
 def add_to_cart_api():
     """Add an item to the cart"""
     data = request.get_json()
@@ -127,20 +160,10 @@ def add_to_cart_api():
             # Need to flush to get cart.id before adding item
             db.session.flush()
 
-        # Check if item already exists in cart
-        existing_item = CartItem.query.filter_by(cart_id=cart.id, game_id=game_id).first()
-
-        if existing_item:
-            existing_item.quantity += quantity
-            # Update game_account_id if provided in the new request
-            if game_account_id:
-                 existing_item.game_account_id = game_account_id
-        else:
-            new_item = CartItem(cart_id=cart.id, game_id=game_id, quantity=quantity, game_account_id=game_account_id)
-            db.session.add(new_item)
+        CartService.add_item(cart.id, game_id, quantity, game_account_id or None)
+        CartService.adjust_counters(cart.id, quantity, quantity * game.price)
         
-        db.session.commit()
-        return jsonify({"success": True, "message": "تمت إضافة المنتج إلى السلة بنجاح."})
+        return commit_with_response(jsonify({"success": True, "message": "تمت إضافة المنتج إلى السلة بنجاح."}))
 
     except ValueError:
          return jsonify({"success": False, "message": "معرف اللعبة أو الكمية غير صالح."}), 400
@@ -176,6 +199,7 @@ def update_cart_item_api(item_id):
         # if game.stock < quantity:
         #     return jsonify({"success": False, "message": "الكمية المطلوبة غير متوفرة في المخزون."}), 400
 
+        CartService.adjust_counters(cart.id, quantity - item.quantity, (quantity - item.quantity) * item.game.price)
         item.quantity = quantity
         db.session.commit()
         return jsonify({"success": True, "message": "تم تحديث كمية المنتج بنجاح."})
@@ -200,6 +224,7 @@ def remove_from_cart_api(item_id):
         if not item:
             return jsonify({"success": False, "message": "لم يتم العثور على المنتج في السلة."}), 404
 
+        CartService.adjust_counters(cart.id, -item.quantity, -item.quantity * item.game.price)
         db.session.delete(item)
         db.session.commit()
         return jsonify({"success": True, "message": "تمت إزالة المنتج من السلة بنجاح."})
@@ -217,6 +242,7 @@ def clear_cart_api():
         cart = current_user.cart
         if cart:
             CartItem.query.filter_by(cart_id=cart.id).delete()
+            CartService.reset_counters(cart.id)
             db.session.commit()
         return jsonify({"success": True, "message": "تم إفراغ سلة التسوق بنجاح."})
     except Exception as e:
@@ -227,33 +253,40 @@ def clear_cart_api():
 # --- Order API Endpoints ---
 
 @api_bp.route("/orders", methods=["GET"])
+@replica_reads
 @login_required
 def get_orders_api():
-    """Get the current user's order history"""
+    """Get one page of the current user's order history (newest first)"""
     try:
-        orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-        orders_data = []
-        for order in orders:
-            items_count = OrderItem.query.filter_by(order_id=order.id).count()
-            orders_data.append({
-                "id": order.id,
-                "status": order.status,
-                "total_amount": order.total_amount,
-                "created_at": order.created_at.isoformat(),
-                "items_count": items_count
-            })
-        return jsonify({"success": True, "data": orders_data})
+        limit = parse_limit(request.args.get("limit"))
+        rows, next_cursor = OrderService.get_order_history_page(
+            current_user.id, cursor=request.args.get("cursor"), limit=limit)
+        orders_data = [OrderService.serialize_summary(order, items_count) for order, items_count in rows]
+        return jsonify({"success": True, "data": orders_data, "next_cursor": next_cursor})
+    except InvalidCursor:
+        return jsonify({"success": False, "message": "مؤشر الصفحة غير صالح."}), 400
     except Exception as e:
         print(f"Error fetching orders: {e}")
         return jsonify({"success": False, "message": "حدث خطأ أثناء جلب سجل الطلبات."}), 500
 
 @api_bp.route("/orders/<int:id>", methods=["GET"])
+@replica_reads
 @login_required
 def get_order_detail_api(id):
     """Get details for a specific order"""
     try:
-        order = Order.query.filter_by(id=id, user_id=current_user.id).first_or_404()
-        items = OrderItem.query.filter_by(order_id=order.id).all()
+        # Cheap version lookup first: an unchanged order is answered with a 304
+        version = db.session.query(Order.updated_at).filter_by(id=id, user_id=current_user.id).first()
+        if version is None:
+            return jsonify({"success": False, "message": "لم يتم العثور على الطلب."}), 404
+        etag = make_etag("order", id, version.updated_at)
+        if is_not_modified(etag, version.updated_at):
+            return not_modified(etag, version.updated_at, private=True)
+
+        detail = OrderService.get_detail(id, current_user.id)
+        if detail is None:
+            return jsonify({"success": False, "message": "لم يتم العثور على الطلب."}), 404
+        order, items, codes = detail
         items_data = [
             {
                 "item_id": item.id,
@@ -262,7 +295,8 @@ def get_order_detail_api(id):
                 "price": item.price,
                 "quantity": item.quantity,
                 "status": item.status,
-                "code": item.code, # Be careful about exposing codes directly
+                "code": codes[item.id][0] if codes[item.id] else None, # Be careful about exposing codes directly
+                "codes": codes[item.id],
                 "game_account_id": item.game_account_id,
                 "image_url": item.game.image_url
             }
@@ -284,13 +318,14 @@ def get_order_detail_api(id):
             "items": items_data,
             "payment": payment_data
         }
-        return jsonify({"success": True, "data": order_data})
+        return add_validators(jsonify({"success": True, "data": order_data}), etag, version.updated_at, private=True)
     except Exception as e:
         print(f"Error fetching order detail: {e}")
         return jsonify({"success": False, "message": "حدث خطأ أثناء جلب تفاصيل الطلب."}), 500
 
 @api_bp.route("/checkout", methods=["POST"])
 @login_required
+@idempotent
 def checkout_api():
     """Process checkout and create an order"""
     data = request.get_json()
@@ -298,68 +333,18 @@ def checkout_api():
         return jsonify({"success": False, "message": "طريقة الدفع مطلوبة."}), 400
 
     try:
-        cart = current_user.cart
-        if not cart or not cart.items.first(): # Check if cart exists and is not empty
+        try:
+            new_order = OrderService.create_from_cart(current_user.id, data["payment_method"])
+        except InsufficientStock as e:
+            db.session.rollback()
+            game_id = e.game_id or InventoryService.find_shortage(CartService.get_quantities(current_user.id))
+            game = db.session.get(Game, game_id) if game_id else None
+            name = game.name if game else game_id
+            return jsonify({"success": False, "message": f"الكمية المطلوبة للعبة '{name}' غير متوفرة."}), 400
+        if new_order is None:
             return jsonify({"success": False, "message": "سلة التسوق فارغة."}), 400
 
-        # Calculate total amount from cart items
-        total_amount = 0
-        cart_items = CartItem.query.filter_by(cart_id=cart.id).all()
-        if not cart_items:
-             return jsonify({"success": False, "message": "سلة التسوق فارغة."}), 400
-             
-        for item in cart_items:
-            # Check stock before creating order
-            # if item.game.stock < item.quantity:
-            #     return jsonify({"success": False, "message": f"الكمية المطلوبة للعبة '{item.game.name}' غير متوفرة."}), 400
-            total_amount += item.quantity * item.game.price
-        
-        total_amount = round(total_amount, 2)
-
-        # Create the order
-        new_order = Order(user_id=current_user.id, total_amount=total_amount, status="pending")
-        db.session.add(new_order)
-        db.session.flush() # Get the order ID before creating items
-
-        # Move items from cart to order items
-        for item in cart_items:
-            order_item = OrderItem(
-                order_id=new_order.id,
-                game_id=item.game_id,
-                quantity=item.quantity,
-                price=item.game.price, # Store price at time of order
-                game_account_id=item.game_account_id,
-                status="pending"
-            )
-            db.session.add(order_item)
-            # Optional: Decrease stock count here
-            # item.game.stock -= item.quantity
-
-        # Create payment record (placeholder - real integration needed)
-        payment = Payment(
-            order_id=new_order.id,
-            payment_method=data["payment_method"],
-            amount=total_amount,
-            status="pending" # Status will be updated by payment gateway callback/webhook
-        )
-        db.session.add(payment)
-
-        # Clear the cart
-        CartItem.query.filter_by(cart_id=cart.id).delete()
-
-        db.session.commit()
-        
-        # Placeholder: In a real app, redirect to payment gateway or process payment here
-        # For now, we simulate successful payment processing and fulfillment
-        payment.status = "completed"
-        payment.transaction_id = f"FAKE_TRANS_{new_order.id}"
-        db.session.commit()
-        
-        # Trigger fulfillment (optional, could be a background task)
-        from shipping import GameShippingService # Import here to avoid circular dependency
-        GameShippingService.fulfill_order(new_order.id)
-
-        return jsonify({"success": True, "message": "تم إنشاء الطلب بنجاح.", "order_id": new_order.id})
+        return commit_with_response(jsonify({"success": True, "message": "تم إنشاء الطلب بنجاح.", "order_id": new_order.id}))
 
     except Exception as e:
         db.session.rollback()
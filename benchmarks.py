@@ -0,0 +1,781 @@
+"""Load and throughput benchmarks.
+
+Each benchmark prints one summary line. Database benchmarks run against a
+throwaway file-backed SQLite database in WAL mode so that several worker
+processes can share it; the mail benchmark needs aiosmtpd.
+
+    python benchmarks.py reservations --workers 8 --stock 2000
+    python benchmarks.py mail --messages 2000
+    python benchmarks.py codes --count 1000000
+    python benchmarks.py logins --duration 10
+    python benchmarks.py checkout --sizes 1 10 100
+    python benchmarks.py seed sqlite:////tmp/shop.db --games 100000 --users 1000000 --orders 5000000
+    python benchmarks.py load --database-url sqlite:////tmp/shop.db --clients 16 --save-baseline baseline.json
+    python benchmarks.py load --database-url sqlite:////tmp/shop.db --clients 16 --baseline baseline.json
+
+The seed and load benchmarks go together: seed fills a database with a
+reproducible synthetic shop, and load drives the app over HTTP with
+concurrent customers, reporting p50/p95/p99 and throughput per endpoint and
+failing when it falls behind a stored baseline report by more than --tolerance.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from config import Config
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    SECRET_KEY = "benchmark"
+    SHARED_CACHE_PATH = None
+    # Writers queue on SQLite's single write lock instead of failing fast
+    SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"timeout": 60}}
+    SQL_ACCOUNTING_LOG = False # The Server-Timing header still reports each request's queries
+
+def _config_for(db_path):
+    return type("Config", (BenchmarkConfig,), {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_path})
+
+def _prepare_database(db_path, setup):
+    """Create the schema in a fresh database file, switch it to WAL and run setup()"""
+    from app import create_app, db
+    app = create_app(_config_for(db_path))
+    with app.app_context():
+        db.create_all()
+        result = setup()
+        db.session.commit()
+        db.engine.dispose()
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.close()
+    return result
+
+# --- Hot SKU reservations ---
+
+def _reserve_worker(db_path, game_id, attempts, start_at):
+    """Reserve one unit `attempts` times, one transaction each; returns the number of holds won"""
+    from app import create_app, db
+    from inventory import InventoryService, InsufficientStock
+    app = create_app(_config_for(db_path))
+    won = 0
+    with app.app_context():
+        while time.time() < start_at: # Line the workers up so they contend from the first attempt
+            time.sleep(0.001)
+        for _ in range(attempts):
+            try:
+                InventoryService.reserve(None, {game_id: 1})
+                db.session.commit()
+                won += 1
+            except InsufficientStock:
+                db.session.rollback()
+        db.engine.dispose()
+    return won
+
+def hot_sku_reservations(db_path, workers=8, stock=1000, attempts=None):
+    """Let `workers` processes race to hold units of a single game.
+
+    Demand defaults to twice the stock, so the run also proves that losing
+    attempts are refused rather than oversold. Returns a summary dict.
+    """
+    from models import db, Game, StockReservation
+    attempts = attempts or (2 * stock) // workers + 1
+
+    def setup():
+        game = Game(name="Hot SKU", price=1.0, game_type="bench", stock=stock, is_active=True)
+        db.session.add(game)
+        db.session.flush()
+        return game.id
+
+    game_id = _prepare_database(db_path, setup)
+    ctx = multiprocessing.get_context("fork")
+    start_at = time.time() + 0.5
+    with ctx.Pool(workers) as pool:
+        results = pool.starmap(_reserve_worker, [(db_path, game_id, attempts, start_at)] * workers)
+    elapsed = time.time() - start_at
+
+    connection = sqlite3.connect(db_path)
+    final_stock = connection.execute("SELECT stock FROM game WHERE id = ?", (game_id,)).fetchone()[0]
+    held = connection.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_reservation WHERE game_id = ?",
+                              (game_id,)).fetchone()[0]
+    connection.close()
+    return {
+        "workers": workers,
+        "attempts": attempts * workers,
+        "initial_stock": stock,
+        "reserved": sum(results),
+        "held": held,
+        "final_stock": final_stock,
+        "oversold": max(0, held - stock),
+        "elapsed": elapsed,
+        "attempts_per_second": attempts * workers / elapsed if elapsed > 0 else 0.0,
+    }
+
+def _run_reservations(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        result = hot_sku_reservations(os.path.join(tmpdir, "bench.db"), args.workers, args.stock)
+    print(f"reservations: {result['workers']} workers, {result['attempts']} attempts on one SKU "
+          f"(stock {result['initial_stock']}) -> {result['reserved']} held, final stock {result['final_stock']}, "
+          f"oversold {result['oversold']}, {result['attempts_per_second']:.0f} attempts/s")
+
+# --- Email delivery ---
+
+def _bench_message(i):
+    from email.message import EmailMessage
+    message = EmailMessage()
+    message["From"] = "noreply@gameshipping.com"
+    message["To"] = f"customer{i}@example.com"
+    message["Subject"] = f"تأكيد الطلب وشحن الأكواد - الطلب #{i}"
+    message.set_content(f"#{i}")
+    message.add_alternative(f"<h1>#{i}</h1><code>PUBG-0000-{i:04d}</code>", subtype="html")
+    return message
+
+def mail_throughput(messages=2000, pool_size=2, batch_size=50):
+    """Messages per second through the pooled Mailer vs a new SMTP connection per message.
+
+    Needs aiosmtpd for the local stand-in server.
+    """
+    import smtplib
+    import socket
+    from aiosmtpd.controller import Controller
+    from mailer import Mailer
+
+    class Sink:
+        async def handle_DATA(self, server, session, envelope):
+            return "250 OK"
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    controller = Controller(Sink(), hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        batch = [_bench_message(i) for i in range(messages)]
+
+        baseline_count = max(1, messages // 10)
+        start = time.perf_counter()
+        for message in batch[:baseline_count]:
+            with smtplib.SMTP("127.0.0.1", port) as connection:
+                connection.send_message(message)
+        baseline = baseline_count / (time.perf_counter() - start)
+
+        mailer = Mailer({"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": port, "MAIL_POOL_SIZE": pool_size,
+                         "MAIL_BATCH_SIZE": batch_size, "MAIL_QUEUE_SIZE": 2 * batch_size})
+        start = time.perf_counter()
+        futures = [mailer.submit(message) for message in batch] # Blocks whenever the outbox is full
+        failures = sum(future.result() is not None for future in futures)
+        pooled = messages / (time.perf_counter() - start)
+        mailer.close()
+    finally:
+        controller.stop()
+    return {"messages": messages, "failures": failures, "per_connection_per_second": baseline,
+            "pooled_per_second": pooled}
+
+def _run_mail(args):
+    result = mail_throughput(args.messages, args.pool_size, args.batch_size)
+    print(f"mail: {result['messages']} messages, {result['failures']} failures -> "
+          f"{result['pooled_per_second']:.0f} msg/s pooled vs "
+          f"{result['per_connection_per_second']:.0f} msg/s with a connection per message")
+
+# --- Digital codes ---
+
+def code_generation(count=1_000_000, batch_size=10_000):
+    """Time issuing `count` codes in batches and check that none repeats"""
+    import secrets
+    from codes import CodeGenerator
+    next_value = [0]
+
+    def lease(prefix, size): # Local counter in place of code_sequence, to time generation alone
+        start, next_value[0] = next_value[0], next_value[0] + size
+        return start
+
+    generator = CodeGenerator(secrets.token_bytes(32), lease=lease, block_size=batch_size)
+    seen = set()
+    start = time.perf_counter()
+    for issued in range(0, count, batch_size):
+        seen.update(generator.generate("PUBG", min(batch_size, count - issued)))
+    elapsed = time.perf_counter() - start
+    return {"codes": count, "unique": len(seen), "elapsed": elapsed, "per_second": count / elapsed}
+
+def _run_codes(args):
+    result = code_generation(args.count, args.batch_size)
+    print(f"codes: {result['codes']} generated, {result['codes'] - result['unique']} duplicates, "
+          f"{result['elapsed']:.2f}s ({result['per_second']:.0f} codes/s)")
+
+# --- Logins under catalog load ---
+
+def login_under_catalog_load(db_path, hash_workers=1, max_pending=4, duration=5.0, login_clients=8,
+                             catalog_clients=4, users=16):
+    """Login and catalog throughput of one threaded worker while both kinds of traffic run at once.
+
+    The app is served by a threaded WSGI server (like a gunicorn gthread
+    worker); `hash_workers=0` hashes inline in the request threads.
+    """
+    import http.client
+    import threading
+    from urllib.parse import urlencode
+    from werkzeug.serving import make_server
+    from models import db, User, Game
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) # No access log line per request
+
+    def setup():
+        for i in range(users):
+            user = User(username=f"bench{i}", email=f"bench{i}@example.com")
+            user.set_password("password")
+            db.session.add(user)
+        db.session.add_all([Game(name=f"Game {i}", description="Benchmark game", price=1.0, game_type="bench",
+                                 stock=10, is_active=True)
+                            for i in range(40)])
+
+    _prepare_database(db_path, setup)
+    from app import create_app
+    config = type("Config", (_config_for(db_path),), {
+        "WTF_CSRF_ENABLED": False, "HASH_POOL_WORKERS": hash_workers, "HASH_MAX_PENDING": max_pending})
+    server = make_server("127.0.0.1", 0, create_app(config), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    results = {"logins": 0, "busy": 0, "catalog": 0, "catalog_latencies": []}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def request(method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+        connection.request(method, path, body=body, headers=headers)
+        status = connection.getresponse().status
+        connection.close()
+        return status
+
+    def login_client(i):
+        body = urlencode({"email": f"bench{i % users}@example.com", "password": "password"})
+        while time.time() < deadline:
+            status = request("POST", "/auth/login", body)
+            with lock:
+                results["logins" if status == 302 else "busy"] += 1
+
+    def catalog_client():
+        while time.time() < deadline:
+            start = time.perf_counter()
+            request("GET", "/games")
+            with lock:
+                results["catalog"] += 1
+                results["catalog_latencies"].append(time.perf_counter() - start)
+
+    clients = [threading.Thread(target=login_client, args=(i,)) for i in range(login_clients)] + \
+              [threading.Thread(target=catalog_client) for _ in range(catalog_clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    server.shutdown()
+
+    latencies = sorted(results["catalog_latencies"]) or [0.0]
+    return {
+        "hash_workers": hash_workers,
+        "logins_per_second": results["logins"] / duration,
+        "busy": results["busy"],
+        "catalog_per_second": results["catalog"] / duration,
+        "catalog_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+def _run_logins(args):
+    for hash_workers in (0, args.hash_workers): # Inline baseline, then the process pool
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result = login_under_catalog_load(os.path.join(tmpdir, "bench.db"), hash_workers, args.max_pending,
+                                              args.duration, args.login_clients, args.catalog_clients)
+        mode = f"hashing pool of {hash_workers}" if hash_workers else "inline hashing"
+        print(f"logins ({mode}): {result['logins_per_second']:.1f} logins/s, {result['busy']} turned away busy; "
+              f"catalog {result['catalog_per_second']:.1f} req/s, p95 {result['catalog_p95_ms']:.0f} ms")
+
+# --- Checkout ---
+
+def checkout_latency(db_path, sizes=(1, 10, 100), repeats=20):
+    """Median and p95 latency of POST /api/checkout for carts of each size, in milliseconds"""
+    import statistics
+    from sqlalchemy import insert
+    from models import db, User, Game, Cart, CartItem
+
+    max_size = max(sizes)
+
+    def setup():
+        user = User(username="shopper", email="shopper@example.com")
+        user.set_password("password")
+        db.session.add_all([user, Cart(customer=user)])
+        db.session.add_all([Game(name=f"Game {i}", description="Benchmark game", price=1.0 + i % 7, game_type="bench",
+                                 stock=10 ** 9, is_active=True) for i in range(max_size)])
+
+    _prepare_database(db_path, setup)
+    from app import create_app
+    app = create_app(type("Config", (_config_for(db_path),), {"WTF_CSRF_ENABLED": False}))
+    client = app.test_client()
+    client.post("/auth/login", data={"email": "shopper@example.com", "password": "password"})
+    results = {}
+    with app.app_context():
+        cart_id = db.session.query(Cart.id).scalar()
+        game_ids = [game_id for (game_id,) in db.session.query(Game.id).order_by(Game.id)]
+    for size in sizes:
+        timings = []
+        for _ in range(repeats):
+            with app.app_context():
+                db.session.execute(insert(CartItem), [{"cart_id": cart_id, "game_id": game_id, "quantity": 1}
+                                                      for game_id in game_ids[:size]])
+                db.session.commit()
+            start = time.perf_counter()
+            response = client.post("/api/checkout", json={"payment_method": "card"})
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"Checkout failed: {response.get_json()}")
+        timings.sort()
+        results[size] = {"median_ms": statistics.median(timings), "p95_ms": timings[int(len(timings) * 0.95) - 1]}
+    with app.app_context():
+        db.engine.dispose()
+    return results
+
+def _run_checkout(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = checkout_latency(os.path.join(tmpdir, "bench.db"), args.sizes, args.repeats)
+    for size, result in results.items():
+        print(f"checkout: {size} items -> median {result['median_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms")
+
+# --- Synthetic dataset ---
+
+SEED_PASSWORD = "password"
+# game_type -> product name stem
+SEED_GAME_TYPES = {
+    "pubg": "شدات ببجي موبايل",
+    "free_fire": "جواهر فري فاير",
+    "fortnite": "فيباكس فورتنايت",
+    "cod_mobile": "نقاط كول أوف ديوتي",
+    "roblox": "روبوكس",
+    "google_play": "بطاقة جوجل بلاي",
+    "itunes": "بطاقة آيتونز",
+    "psn": "بطاقة بلايستيشن",
+}
+SEED_CATEGORIES = ("عملة", "بطاقة", "اشتراك", "حزمة")
+SEED_REGIONS = ("global", "MENA", "EU", "NA", "ASIA")
+SEED_PAYMENT_METHODS = ("credit_card", "paypal", "stc_pay", "apple_pay")
+# (status, share of orders); item and payment statuses follow the order's
+SEED_ORDER_STATUSES = (("completed", 0.85), ("pending", 0.08), ("processing", 0.02), ("cancelled", 0.05))
+
+def _bench_app(database_url, **overrides):
+    from app import create_app
+    return create_app(type("Config", (BenchmarkConfig,), dict(
+        {"SQLALCHEMY_DATABASE_URI": database_url, "WTF_CSRF_ENABLED": False}, **overrides)))
+
+def seed_dataset(database_url, games=100_000, users=1_000_000, orders=5_000_000, seed=1, batch_size=20_000,
+                 days=365, progress=None):
+    """Fill an empty database with a reproducible synthetic shop through Core bulk inserts.
+
+    The same arguments always give the same rows. Ids are assigned here, so
+    orders, items and payments go in as plain executemany INSERTs, one
+    transaction per `batch_size` orders, without reading anything back.
+    Order ids follow their creation time, customers are spread uniformly and
+    games by a skewed popularity (a few best sellers, a long tail); every
+    user has an empty cart and the password SEED_PASSWORD. The sales rollups,
+    the search index and the planner statistics are rebuilt at the end.
+    Returns the row counts.
+    """
+    import random
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert, text
+    from models import db, User, Game, Cart, Order, OrderItem, Payment
+    from rollups import SalesRollup
+    from search import GameSearchIndex
+    from hashing import get_password_hasher
+
+    rng = random.Random(seed)
+    report = progress or (lambda message: None)
+    app = _bench_app(database_url)
+    counts = {"games": games, "users": users, "orders": orders, "items": 0, "payments": orders}
+    with app.app_context():
+        db.create_all()
+        if db.session.query(Game.id).first() is not None or db.session.query(User.id).first() is not None:
+            raise RuntimeError("seed_dataset needs an empty database")
+        if db.engine.dialect.name == "sqlite":
+            db.session.execute(text("PRAGMA journal_mode=WAL"))
+            db.session.execute(text("PRAGMA synchronous=OFF")) # Seeding is redone from scratch if it dies
+        end = datetime(2026, 1, 1)
+        start = end - timedelta(days=days)
+        span = (end - start).total_seconds()
+
+        def insert_batches(model, total, make_row):
+            for first in range(1, total + 1, batch_size):
+                db.session.execute(insert(model.__table__), [make_row(i) for i in range(first, min(first + batch_size, total + 1))])
+                db.session.commit()
+                report(f"{model.__tablename__}: {min(first + batch_size - 1, total)}/{total}")
+
+        game_types = list(SEED_GAME_TYPES)
+        prices = {}
+
+        def game_row(i):
+            game_type = game_types[i % len(game_types)]
+            prices[i] = round(rng.choice((0.99, 1.99, 4.99, 9.99, 19.99, 49.99, 99.99)) * rng.uniform(0.9, 1.1), 2)
+            return {
+                "id": i, "sku": f"SKU-{i:07d}", "name": f"{SEED_GAME_TYPES[game_type]} {rng.choice((60, 325, 660, 1800, 3850, 8100))} #{i}",
+                "description": f"شحن فوري لـ {SEED_GAME_TYPES[game_type]}", "price": prices[i],
+                "category": rng.choice(SEED_CATEGORIES), "game_type": game_type, "region": rng.choice(SEED_REGIONS),
+                "stock": 10 ** 9, # Load tests never run out of stock
+                "is_active": rng.random() < 0.97, "uses_code_vault": False,
+                "created_at": start + timedelta(seconds=rng.random() * span), "updated_at": end,
+            }
+
+        insert_batches(Game, games, game_row)
+
+        password_hash = get_password_hasher().hash(SEED_PASSWORD) # One hash for all: hashing 1M passwords takes hours
+        insert_batches(User, users, lambda i: {
+            "id": i, "username": f"user{i}", "email": f"user{i}@example.com", "password_hash": password_hash,
+            "is_admin": False, "created_at": start + timedelta(seconds=span * (i - 1) / users)})
+        insert_batches(Cart, users, lambda i: {"id": i, "user_id": i, "item_count": 0, "subtotal": 0.0})
+
+        statuses = [status for status, _ in SEED_ORDER_STATUSES]
+        weights = [share for _, share in SEED_ORDER_STATUSES]
+        item_id = 0
+        for first in range(1, orders + 1, batch_size):
+            order_rows, item_rows, payment_rows = [], [], []
+            for order_id in range(first, min(first + batch_size, orders + 1)):
+                created_at = start + timedelta(seconds=span * (order_id - 1) / orders + rng.random() * 60)
+                status = rng.choices(statuses, weights)[0]
+                total = 0.0
+                for _ in range(rng.choices((1, 2, 3, 4), (60, 25, 10, 5))[0]):
+                    item_id += 1
+                    game_id = int(games * rng.random() ** 3) + 1 # Skewed towards the low ids: the best sellers
+                    quantity = rng.choices((1, 2, 5), (80, 15, 5))[0]
+                    total += quantity * prices[game_id]
+                    item_rows.append({
+                        "id": item_id, "order_id": order_id, "game_id": game_id, "quantity": quantity,
+                        "price": prices[game_id],
+                        "status": "fulfilled" if status == "completed" else "pending",
+                        "code": f"SEED-{item_id:010d}" if status == "completed" else None})
+                total = round(total, 2)
+                order_rows.append({"id": order_id, "user_id": rng.randint(1, users), "status": status,
+                                   "total_amount": total, "created_at": created_at, "updated_at": created_at})
+                payment_rows.append({
+                    "id": order_id, "order_id": order_id, "payment_method": rng.choice(SEED_PAYMENT_METHODS),
+                    "amount": total, "created_at": created_at,
+                    "status": {"completed": "completed", "cancelled": "failed"}.get(status, "pending"),
+                    "transaction_id": f"SEED-TX-{order_id}" if status == "completed" else None})
+            db.session.execute(insert(Order.__table__), order_rows)
+            db.session.execute(insert(OrderItem.__table__), item_rows)
+            db.session.execute(insert(Payment.__table__), payment_rows)
+            db.session.commit()
+            report(f"order: {order_rows[-1]['id']}/{orders}")
+        counts["items"] = item_id
+
+        report("rebuilding sales rollups")
+        SalesRollup.rebuild()
+        db.session.commit()
+        report("rebuilding search index")
+        GameSearchIndex.rebuild()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        db.engine.dispose()
+    return counts
+
+def _run_seed(args):
+    start = time.perf_counter()
+    counts = seed_dataset(args.database_url, args.games, args.users, args.orders, args.seed, args.batch_size,
+                          progress=print if args.verbose else None)
+    elapsed = time.perf_counter() - start
+    rows = sum(counts.values())
+    print(f"seed: {counts['games']} games, {counts['users']} users, {counts['orders']} orders, "
+          f"{counts['items']} items in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+
+# --- Load test ---
+
+def _percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(len(values) * q + 0.999999) - 1))]
+
+class _ShopClient:
+    """One simulated customer: a keep-alive HTTP connection carrying the session cookie"""
+
+    def __init__(self, host, port, record):
+        import http.client
+        self.connection = http.client.HTTPConnection(host, port, timeout=120)
+        self.cookies = {}
+        self.record = record
+
+    def request(self, method, path, endpoint, body=None, form=False):
+        import json
+        from http.cookies import SimpleCookie
+        from urllib.parse import urlencode
+        headers = {"Cookie": "; ".join(f"{k}={v}" for k, v in self.cookies.items())} if self.cookies else {}
+        if body is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded" if form else "application/json"
+            body = urlencode(body) if form else json.dumps(body)
+        start = time.perf_counter()
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - start
+        for header in response.headers.get_all("Set-Cookie") or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if endpoint:
+            self.record(endpoint, response.status, elapsed, response.headers.get("Server-Timing"))
+        return response.status, data
+
+    def json(self, method, path, endpoint, body=None):
+        import json
+        status, data = self.request(method, path, endpoint, body)
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    def login(self, email):
+        import re
+        _, page = self.request("GET", "/auth/login", None)
+        token = re.search(rb'name="csrf_token"[^>]*value="([^"]+)"', page) # Only when the server checks CSRF
+        form = {"email": email, "password": SEED_PASSWORD}
+        if token:
+            form["csrf_token"] = token.group(1).decode()
+        status, _ = self.request("POST", "/auth/login", None, form, form=True) # Not part of the measured flow
+        return status == 302
+
+def _shopping_flow(client, rng):
+    """browse -> add to cart -> checkout -> order history, as one customer visit"""
+    from urllib.parse import quote
+    sort = rng.choice(("newest", "newest", "price_asc", "name"))
+    _, page = client.json("GET", f"/api/games?limit=20&sort={sort}", "GET /api/games")
+    games = (page or {}).get("data") or []
+    if page and page.get("next_cursor") and rng.random() < 0.5:
+        _, more = client.json("GET", f"/api/games?limit=20&sort={sort}&cursor={page['next_cursor']}",
+                              "GET /api/games?cursor")
+        games += (more or {}).get("data") or []
+    if rng.random() < 0.3:
+        client.json("GET", "/api/games/search?q=" + quote(rng.choice(("ببجي", "فري فاير", "روبوكس", "بطاقة"))),
+                    "GET /api/games/search")
+    if not games:
+        return
+    for game in rng.sample(games, min(len(games), rng.choice((1, 1, 2, 3)))):
+        client.json("GET", f"/api/games/{game['id']}", "GET /api/games/<id>")
+        client.json("POST", "/api/cart/add", "POST /api/cart/add", {"game_id": game["id"], "quantity": 1})
+    client.json("GET", "/api/cart", "GET /api/cart")
+    status, result = client.json("POST", "/api/checkout", "POST /api/checkout", {"payment_method": "credit_card"})
+    _, history = client.json("GET", "/api/orders", "GET /api/orders")
+    if status == 200 and result and result.get("order_id"):
+        client.json("GET", f"/api/orders/{result['order_id']}", "GET /api/orders/<id>")
+    elif history and history.get("data"):
+        client.json("GET", f"/api/orders/{history['data'][0]['id']}", "GET /api/orders/<id>")
+
+def load_test(database_url=None, url=None, clients=16, duration=30.0, warmup=5.0, users=None, seed=1):
+    """Drive the shop over HTTP with `clients` concurrent customers running _shopping_flow.
+
+    Without `url` the app is served on `database_url` by a threaded WSGI
+    server in this process (like a gunicorn gthread worker); with it, an
+    already running deployment is driven instead and `users` must give the
+    number of seeded users. Each client logs in as a different seeded user
+    picked from `seed`. Requests made during the first `warmup` seconds are
+    not counted. Returns the report: per endpoint, requests, errors, p50,
+    p95 and p99 latency, throughput and, from the Server-Timing header, the
+    mean database time and query count.
+    """
+    import random
+    import re
+    import threading
+    from urllib.parse import urlsplit
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = None
+    if url is None:
+        from werkzeug.serving import make_server
+        from models import db, User
+        app = _bench_app(database_url)
+        with app.app_context():
+            users = users or db.session.query(db.func.max(User.id)).scalar() or 0
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = "127.0.0.1", server.server_port
+    else:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    if not users:
+        raise ValueError("load_test needs seeded users")
+
+    samples = {} # endpoint -> [(status, seconds, db ms, queries)]
+    lock = threading.Lock()
+    started = time.time()
+    measure_from, deadline = started + warmup, started + warmup + duration
+    timing = re.compile(r'db;dur=([0-9.]+);desc="(\d+) queries"')
+
+    def record(endpoint, status, elapsed, server_timing):
+        if time.time() < measure_from:
+            return
+        match = timing.search(server_timing or "")
+        sample = (status, elapsed, float(match.group(1)) if match else None, int(match.group(2)) if match else None)
+        with lock:
+            samples.setdefault(endpoint, []).append(sample)
+
+    failures = []
+
+    def customer(i, user_id):
+        rng = random.Random(seed * 1_000_003 + i)
+        client = _ShopClient(host, port, record)
+        try:
+            if not client.login(f"user{user_id}@example.com"):
+                raise RuntimeError(f"Login failed for user{user_id}")
+            while time.time() < deadline:
+                _shopping_flow(client, rng)
+        except Exception as e: # A dead client would silently lower the load
+            failures.append(e)
+        finally:
+            client.connection.close()
+
+    picker = random.Random(seed)
+    threads = [threading.Thread(target=customer, args=(i, user_id))
+               for i, user_id in enumerate(picker.sample(range(1, users + 1), clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if server is not None:
+        server.shutdown()
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {clients} clients failed") from failures[0]
+
+    measured = max(min(time.time(), deadline) - measure_from, 1e-9)
+    endpoints = {}
+    for endpoint, rows in sorted(samples.items()):
+        latencies = sorted(seconds * 1000 for _, seconds, _, _ in rows)
+        db_times = [db_ms for _, _, db_ms, _ in rows if db_ms is not None]
+        queries = [count for _, _, _, count in rows if count is not None]
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "errors": sum(status >= 500 or status in (400, 401, 403, 409) for status, _, _, _ in rows),
+            "p50_ms": round(_percentile(latencies, 0.50), 2),
+            "p95_ms": round(_percentile(latencies, 0.95), 2),
+            "p99_ms": round(_percentile(latencies, 0.99), 2),
+            "throughput": round(len(rows) / measured, 2),
+            "db_ms": round(sum(db_times) / len(db_times), 2) if db_times else None,
+            "queries": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return {"clients": clients, "duration": duration, "seed": seed, "endpoints": endpoints,
+            "throughput": round(sum(len(rows) for rows in samples.values()) / measured, 2)}
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    """Regressions of `report` against a stored baseline report, as messages (none means it passed).
+
+    An endpoint regresses when its p95 or p99 grew, or its throughput fell,
+    by more than `tolerance`, when it started failing, or when it runs more
+    queries than before. The p99 is only compared over 100 requests or more;
+    below that it is little more than the slowest request.
+    """
+    regressions = [f"baseline ran {baseline[key]} {key}, this run {report[key]}"
+                   for key in ("clients", "duration") if baseline[key] != report[key]]
+    for endpoint, before in baseline["endpoints"].items():
+        after = report["endpoints"].get(endpoint)
+        if after is None:
+            regressions.append(f"{endpoint}: not exercised")
+            continue
+        percentiles = ("p95_ms", "p99_ms") if min(before["requests"], after["requests"]) >= 100 else ("p95_ms",)
+        for key in percentiles:
+            if after[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {key} {before[key]:.1f} -> {after[key]:.1f}")
+        if after["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: throughput {before['throughput']:.1f} -> {after['throughput']:.1f} req/s")
+        if after["errors"] and after["errors"] / after["requests"] > before["errors"] / max(before["requests"], 1):
+            regressions.append(f"{endpoint}: {after['errors']} errors in {after['requests']} requests")
+        if before.get("queries") is not None and (after.get("queries") or 0) > before["queries"] + 0.5:
+            regressions.append(f"{endpoint}: {before['queries']:.1f} -> {after['queries']:.1f} queries per request")
+    return regressions
+
+def _run_load(args):
+    import json
+    import sys
+    if args.url is None and args.database_url is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database_url = "sqlite:///" + os.path.join(tmpdir, "bench.db")
+            seed_dataset(database_url, args.games, args.users, args.orders, args.seed)
+            report = load_test(database_url, None, args.clients, args.duration, args.warmup, None, args.seed)
+    else:
+        report = load_test(args.database_url, args.url, args.clients, args.duration, args.warmup,
+                           args.users if args.url else None, args.seed)
+    for endpoint, result in report["endpoints"].items():
+        queries = f", {result['queries']:.1f} queries" if result["queries"] is not None else ""
+        print(f"load: {endpoint:<24} {result['requests']:>6} req ({result['errors']} errors), "
+              f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+              f"{result['throughput']:.1f} req/s{queries}")
+    print(f"load: {report['clients']} clients -> {report['throughput']:.1f} req/s overall")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(report, baseline_file, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare_to_baseline(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"load: no regression against {args.baseline}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shamostore benchmarks")
+    subcommands = parser.add_subparsers(dest="benchmark", required=True)
+
+    reservations = subcommands.add_parser("reservations", help="concurrent stock holds on one hot SKU")
+    reservations.add_argument("--workers", type=int, default=8)
+    reservations.add_argument("--stock", type=int, default=2000)
+    reservations.set_defaults(run=_run_reservations)
+
+    mail = subcommands.add_parser("mail", help="email delivery throughput against a local aiosmtpd server")
+    mail.add_argument("--messages", type=int, default=2000)
+    mail.add_argument("--pool-size", type=int, default=2)
+    mail.add_argument("--batch-size", type=int, default=50)
+    mail.set_defaults(run=_run_mail)
+
+    codes = subcommands.add_parser("codes", help="bulk digital code generation")
+    codes.add_argument("--count", type=int, default=1_000_000)
+    codes.add_argument("--batch-size", type=int, default=10_000)
+    codes.set_defaults(run=_run_codes)
+
+    logins = subcommands.add_parser("logins", help="login throughput while catalog traffic runs at the same time")
+    logins.add_argument("--duration", type=float, default=10.0)
+    logins.add_argument("--hash-workers", type=int, default=1)
+    logins.add_argument("--max-pending", type=int, default=4)
+    logins.add_argument("--login-clients", type=int, default=8)
+    logins.add_argument("--catalog-clients", type=int, default=4)
+    logins.set_defaults(run=_run_logins)
+
+    checkout = subcommands.add_parser("checkout", help="POST /api/checkout latency by cart size")
+    checkout.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100])
+    checkout.add_argument("--repeats", type=int, default=20)
+    checkout.set_defaults(run=_run_checkout)
+
+    seed = subcommands.add_parser("seed", help="bulk-load a reproducible synthetic dataset into an empty database")
+    seed.add_argument("database_url")
+    seed.add_argument("--games", type=int, default=100_000)
+    seed.add_argument("--users", type=int, default=1_000_000)
+    seed.add_argument("--orders", type=int, default=5_000_000)
+    seed.add_argument("--seed", type=int, default=1)
+    seed.add_argument("--batch-size", type=int, default=20_000)
+    seed.add_argument("--verbose", action="store_true")
+    seed.set_defaults(run=_run_seed)
+
+    load = subcommands.add_parser("load", help="concurrent browse, cart, checkout and history flows over HTTP")
+    target = load.add_mutually_exclusive_group()
+    target.add_argument("--database-url", help="seeded database to serve from this process")
+    target.add_argument("--url", help="running deployment to drive instead, e.g. http://127.0.0.1:5000")
+    load.add_argument("--clients", type=int, default=16)
+    load.add_argument("--duration", type=float, default=30.0)
+    load.add_argument("--warmup", type=float, default=5.0)
+    load.add_argument("--seed", type=int, default=1)
+    # Dataset seeded into a throwaway database when no target is given; --users is also
+    # the number of seeded users of a --url deployment
+    load.add_argument("--games", type=int, default=1000)
+    load.add_argument("--users", type=int, default=10_000)
+    load.add_argument("--orders", type=int, default=50_000)
+    load.add_argument("--baseline", help="stored report to compare against; exits 1 on a regression")
+    load.add_argument("--save-baseline", help="write this run's report here")
+    load.add_argument("--tolerance", type=float, default=0.2)
+    load.set_defaults(run=_run_load)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Add vault_code and game.uses_code_vault
+
+Revision ID: c06804d9ef3a
+Revises: d7454ecedfb1
+Create Date: 2026-10-18 15:12:40.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c06804d9ef3a'
+down_revision = 'd7454ecedfb1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('game', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('uses_code_vault', sa.Boolean(), nullable=True, server_default=sa.false()))
+
+    op.create_table('vault_code',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=256), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=False),
+    sa.Column('order_item_id', sa.Integer(), nullable=True),
+    sa.Column('source', sa.String(length=128), nullable=True),
+    sa.Column('imported_at', sa.DateTime(), nullable=True),
+    sa.Column('allocated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], ),
+    sa.ForeignKeyConstraint(['order_item_id'], ['order_item.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('game_id', 'code', name='uq_vault_code_game_id_code')
+    )
+    with op.batch_alter_table('vault_code', schema=None) as batch_op:
+        batch_op.create_index('ix_vault_code_game_id_status_id', ['game_id', 'status', 'id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_vault_code_order_item_id'), ['order_item_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('vault_code', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_vault_code_order_item_id'))
+        batch_op.drop_index('ix_vault_code_game_id_status_id')
+
+    op.drop_table('vault_code')
+    with op.batch_alter_table('game', schema=None) as batch_op:
+        batch_op.drop_column('uses_code_vault')
@@ -0,0 +1,155 @@
+from sqlalchemy import update, select, insert, func, or_
+from models import db, Cart, CartItem, Game
+
+class CartService:
+    """Service for reading and updating shopping carts"""
+
+    @staticmethod
+    def get_cart_summary(user_id):
+        """Load a user's cart, its items and totals with a single joined query.
+
+        Returns None when the user has no cart yet.
+        """
+        rows = (
+            db.session.query(
+                Cart.id.label("cart_id"),
+                CartItem.id.label("item_id"),
+                CartItem.quantity,
+                CartItem.game_account_id,
+                Game.id.label("game_id"),
+                Game.name,
+                Game.price,
+                Game.image_url,
+            )
+            .outerjoin(CartItem, CartItem.cart_id == Cart.id)
+            .outerjoin(Game, Game.id == CartItem.game_id)
+            .filter(Cart.user_id == user_id)
+            .order_by(CartItem.id)
+            .all()
+        )
+        if not rows:
+            return None
+
+        items_data = []
+        total = 0
+        item_count = 0
+        for row in rows:
+            if row.item_id is None: # Empty cart yields a single row with no item
+                continue
+            item_total = row.quantity * row.price
+            items_data.append({
+                "item_id": row.item_id,
+                "game_id": row.game_id,
+                "name": row.name,
+                "price": row.price,
+                "quantity": row.quantity,
+                "image_url": row.image_url,
+                "item_total": round(item_total, 2),
+                "game_account_id": row.game_account_id
+            })
+            total += item_total
+            item_count += row.quantity
+
+        return {
+            "cart_id": rows[0].cart_id,
+            "items": items_data,
+            "item_count": item_count,
+            "total": round(total, 2)
+        }
+
+    @staticmethod
+    def get_counters(user_id):
+        """(item_count, subtotal) of a user's cart from its counter columns, (0, 0.0) without a cart"""
+        row = db.session.query(Cart.item_count, Cart.subtotal).filter(Cart.user_id == user_id).first()
+        return (row.item_count, round(row.subtotal, 2)) if row else (0, 0.0)
+
+    @staticmethod
+    def get_quantities(user_id):
+        """{game_id: quantity} of a user's cart"""
+        return dict(
+            db.session.query(CartItem.game_id, func.sum(CartItem.quantity))
+            .join(Cart, Cart.id == CartItem.cart_id)
+            .filter(Cart.user_id == user_id)
+            .group_by(CartItem.game_id)
+        )
+
+    @staticmethod
+    def add_item(cart_id, game_id, quantity, game_account_id=None):
+        """Add `quantity` of a game to a cart, onto its existing line if there is one; the caller commits.
+
+        One upsert against the unique (cart_id, game_id) index, so two concurrent
+        adds of the same game end up on one line with both quantities.
+        """
+        dialect = db.engine.dialect.name
+        if dialect not in ("postgresql", "sqlite"):
+            item = CartItem.query.filter_by(cart_id=cart_id, game_id=game_id).first()
+            if item is None:
+                db.session.execute(insert(CartItem).values(
+                    cart_id=cart_id, game_id=game_id, quantity=quantity, game_account_id=game_account_id))
+                return
+            db.session.execute(
+                update(CartItem)
+                .where(CartItem.id == item.id)
+                .values(quantity=CartItem.quantity + quantity,
+                        game_account_id=func.coalesce(game_account_id, CartItem.game_account_id))
+                .execution_options(synchronize_session=False))
+            return
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(CartItem).values(
+            cart_id=cart_id, game_id=game_id, quantity=quantity, game_account_id=game_account_id)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=["cart_id", "game_id"],
+            set_={"quantity": CartItem.__table__.c.quantity + statement.excluded.quantity,
+                  # Keep the stored account ID unless the new request brings one
+                  "game_account_id": func.coalesce(statement.excluded.game_account_id,
+                                                   CartItem.__table__.c.game_account_id)}))
+
+    @staticmethod
+    def adjust_counters(cart_id, quantity, amount):
+        """Add `quantity` items and `amount` to a cart's counters in the caller's transaction.
+
+        Done in SQL rather than on the loaded Cart so concurrent requests for
+        the same cart cannot overwrite each other's changes.
+        """
+        db.session.execute(
+            update(Cart)
+            .where(Cart.id == cart_id)
+            .values(item_count=Cart.item_count + quantity, subtotal=Cart.subtotal + amount)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def reset_counters(cart_id):
+        db.session.execute(
+            update(Cart).where(Cart.id == cart_id).values(item_count=0, subtotal=0.0)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def rebuild_counters(cart_ids=None, game_id=None, game_ids=None):
+        """Recompute counters from the cart items where they disagree; returns the number of carts fixed.
+
+        Limited to `cart_ids`, or to the carts holding `game_id` or any of
+        `game_ids` (after their prices changed), if given.
+        """
+        item_count = (select(func.coalesce(func.sum(CartItem.quantity), 0))
+                      .where(CartItem.cart_id == Cart.id).scalar_subquery())
+        subtotal = (select(func.coalesce(func.sum(CartItem.quantity * Game.price), 0.0))
+                    .join(Game, Game.id == CartItem.game_id)
+                    .where(CartItem.cart_id == Cart.id).scalar_subquery())
+        statement = update(Cart).where(or_(
+            Cart.item_count.is_(None), Cart.subtotal.is_(None),
+            Cart.item_count != item_count, func.abs(Cart.subtotal - subtotal) > 0.005,
+        ))
+        if cart_ids is not None:
+            statement = statement.where(Cart.id.in_(cart_ids))
+        if game_id is not None:
+            statement = statement.where(Cart.id.in_(select(CartItem.cart_id).where(CartItem.game_id == game_id)))
+        if game_ids is not None:
+            statement = statement.where(Cart.id.in_(select(CartItem.cart_id).where(CartItem.game_id.in_(game_ids))))
+        result = db.session.execute(
+            statement.values(item_count=item_count, subtotal=subtotal).execution_options(synchronize_session=False))
+        return result.rowcount
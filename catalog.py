@@ -0,0 +1,182 @@
+import hashlib
+import json
+import math
+from models import db, Game
+from pagination import apply_keyset, finish_page, CachedPagination, DEFAULT_PAGE_SIZE
+from shared_cache import get_shared_cache
+
+# sort name -> (column, descending); Game.id is always appended as the tie-breaker
+GAME_SORTS = {
+    "newest": (Game.created_at, True),
+    "price_asc": (Game.price, False),
+    "price_desc": (Game.price, True),
+    "name": (Game.name, False),
+}
+DEFAULT_GAME_SORT = "newest"
+GAME_FILTER_FIELDS = ("game_type", "category", "region")
+CATALOG_NAMESPACE = "catalog"
+# Longest text filter kept: the filtered columns are String(64), so longer values match nothing
+MAX_FILTER_LENGTH = 64
+# Keys longer than this are stored by their digest
+MAX_KEY_LENGTH = 200
+
+class CatalogCache:
+    """Cross-worker snapshot of catalog reads, invalidated by a version counter.
+
+    Every admin write to games must call bump() after committing.
+    """
+
+    @staticmethod
+    def version():
+        return get_shared_cache().get_version(CATALOG_NAMESPACE)
+
+    @staticmethod
+    def bump():
+        return get_shared_cache().bump_version(CATALOG_NAMESPACE)
+
+    @staticmethod
+    def get_or_build(key, builder):
+        return get_shared_cache().get_or_build(CATALOG_NAMESPACE, key, builder)
+
+def _cache_key(*parts):
+    key = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    if len(key) > MAX_KEY_LENGTH: # Cursors and filters come from the query string
+        key = "sha1:" + hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return key
+
+class CatalogService:
+    """Service for browsing the active game catalog"""
+
+    @staticmethod
+    def parse_filters(args):
+        """Pick the supported catalog filters out of a request's query args.
+
+        Values are normalised so that equivalent requests share one cache
+        entry: prices are rounded to cents, and values that cannot match
+        (non-finite prices, text longer than its column) are dropped.
+        """
+        filters = {}
+        for field in GAME_FILTER_FIELDS:
+            value = (args.get(field) or "").strip()
+            if value and len(value) <= MAX_FILTER_LENGTH:
+                filters[field] = value
+        for field in ("min_price", "max_price"):
+            value = args.get(field, type=float)
+            if value is not None and math.isfinite(value):
+                filters[field] = round(value, 2)
+        return filters
+
+    @staticmethod
+    def filtered_query(filters):
+        """Query for active games matching the given filters"""
+        query = Game.query.filter(Game.is_active.is_(True))
+        for field in GAME_FILTER_FIELDS:
+            if field in filters:
+                query = query.filter(getattr(Game, field) == filters[field])
+        if "min_price" in filters:
+            query = query.filter(Game.price >= filters["min_price"])
+        if "max_price" in filters:
+            query = query.filter(Game.price <= filters["max_price"])
+        return query
+
+    @staticmethod
+    def get_games_page(filters=None, sort=DEFAULT_GAME_SORT, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """Return one keyset page of active games: ([game dict, ...], next_cursor)"""
+        filters = filters or {}
+        column, descending = GAME_SORTS.get(sort, GAME_SORTS[DEFAULT_GAME_SORT])
+
+        def build():
+            query = apply_keyset(
+                CatalogService.filtered_query(filters),
+                [column, Game.id],
+                cursor=cursor,
+                limit=limit,
+                descending=descending,
+            )
+            games, next_cursor = finish_page(
+                query.all(), limit, key=lambda game: (getattr(game, column.key), game.id))
+            return {"data": [CatalogService.serialize_summary(g) for g in games], "next_cursor": next_cursor}
+
+        page = CatalogCache.get_or_build(_cache_key("api_page", filters, sort, cursor, limit), build)
+        return page["data"], page["next_cursor"]
+
+    @staticmethod
+    def count_active_games(filters=None):
+        """Number of active games matching `filters`.
+
+        COUNT(*) over a large catalog is a full index scan, so the figure is
+        kept in the catalog cache until the next catalog change.
+        """
+        filters = filters or {}
+        return CatalogCache.get_or_build(
+            _cache_key("count", filters),
+            lambda: CatalogService.filtered_query(filters).order_by(None).count())
+
+    @staticmethod
+    def get_featured_games(limit=8):
+        """Games shown on the home page"""
+        return CatalogCache.get_or_build(
+            _cache_key("featured", limit),
+            lambda: [CatalogService.serialize_detail(g)
+                     for g in Game.query.filter_by(is_active=True).order_by(Game.id).limit(limit).all()])
+
+    @staticmethod
+    def get_games_listing(page, per_page=12):
+        """Offset pagination for the main.games page, served from the catalog cache"""
+        items = CatalogCache.get_or_build(
+            _cache_key("listing", page, per_page),
+            lambda: [CatalogService.serialize_detail(g)
+                     for g in Game.query.filter_by(is_active=True).order_by(Game.id)
+                     .offset((max(page, 1) - 1) * per_page).limit(per_page).all()])
+        return CachedPagination(page=max(page, 1), per_page=per_page, error_out=False,
+                                items=items, total=CatalogService.count_active_games())
+
+    @staticmethod
+    def game_state(id):
+        """Live (stock, updated_at) row of one game, or None if it does not exist"""
+        return db.session.query(Game.stock, Game.updated_at).filter_by(id=id).first()
+
+    @staticmethod
+    def get_game(id, state=None):
+        """Detail dict for one game (active or not), or None.
+
+        The descriptive fields come from the catalog cache. Stock and
+        updated_at change on checkout, fulfillment and vault imports, none of
+        which bump the catalog version, so they are read live; `state` is a
+        game_state() row the caller already looked up.
+        """
+        state = state or CatalogService.game_state(id)
+        if state is None:
+            return None
+        def build():
+            game = db.session.get(Game, id)
+            return CatalogService.serialize_detail(game) if game else None
+        game = CatalogCache.get_or_build(_cache_key("game", id), build)
+        if game is None:
+            return None
+        return dict(game, stock=state.stock,
+                    updated_at=state.updated_at.isoformat() if state.updated_at else None)
+
+    @staticmethod
+    def serialize_summary(game):
+        """Game fields shown in catalog listings"""
+        return {
+            "id": game.id,
+            "name": game.name,
+            "price": game.price,
+            "image_url": game.image_url,
+            "category": game.category,
+            "game_type": game.game_type,
+            "region": game.region,
+        }
+
+    @staticmethod
+    def serialize_detail(game):
+        """Public game fields that only admin edits change; get_game() adds the live stock"""
+        data = CatalogService.serialize_summary(game)
+        data.update({
+            "description": game.description,
+            "is_active": game.is_active,
+            "updated_at": game.updated_at.isoformat() if game.updated_at else None,
+        })
+        return data
@@ -0,0 +1,329 @@
+import csv
+import json
+import math
+import time
+from datetime import datetime
+from sqlalchemy import select, insert, update, bindparam, func
+from models import db, Game, StockReservation
+from cart_service import CartService
+from catalog import CatalogCache
+from search import GameSearchIndex
+
+# Feed column -> (parser, max length of text values); empty cells leave the game's value alone
+FEED_FIELDS = {
+    "sku": (str, 64),
+    "name": (str, 128),
+    "description": (str, None),
+    "price": (float, None),
+    "image_url": (str, 256),
+    "category": (str, 64),
+    "game_type": (str, 64),
+    "region": (str, 64),
+    "stock": (int, None),
+    "is_active": (bool, None),
+}
+FEED_KEYS = ("sku", "id")
+# A feed row with a new SKU creates the game, so it needs what the admin form requires
+NEW_GAME_FIELDS = ("name", "price", "game_type")
+# Changes to these re-index the game for search
+SEARCH_FIELDS = ("name", "description", "category", "game_type", "is_active")
+FEED_FORMATS = ("csv", "json")
+_TRUE, _FALSE = {"1", "true", "yes", "y", "on"}, {"0", "false", "no", "n", "off"}
+
+class FeedRowError(ValueError):
+    """A feed row that cannot be applied; `line` is its 1-based row number in the feed"""
+    def __init__(self, line, message):
+        super().__init__(f"row {line}: {message}")
+        self.line = line
+
+def read_feed_csv(stream, delimiter=","):
+    """Yield a dict per CSV row, keyed by the lower-cased header"""
+    reader = csv.reader(stream, delimiter=delimiter)
+    header = [cell.strip().lower() for cell in next(reader, [])]
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            yield dict(zip(header, row))
+
+def read_feed_json(stream, chunk_size=65536):
+    """Yield the objects of a JSON array, or of JSON lines, without loading the whole feed"""
+    decoder = json.JSONDecoder()
+    buffer, position, done = "", 0, False
+    while True:
+        # Skip the separators between objects: whitespace, the array's brackets and commas
+        while position < len(buffer) and buffer[position] in " \t\r\n[],":
+            position += 1
+        if position == len(buffer):
+            if done:
+                return
+            buffer, position = stream.read(chunk_size), 0
+            done = not buffer
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = stream.read(chunk_size)
+            if not chunk: # Nothing more to complete the object with
+                raise
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if not isinstance(item, dict):
+            raise ValueError("Feed items must be JSON objects")
+        yield item
+        position = end
+        if position > chunk_size: # Keep the buffer bounded by what is still unread
+            buffer, position = buffer[position:], 0
+
+def read_feed(stream, fmt="csv"):
+    if fmt not in FEED_FORMATS:
+        raise ValueError(f"Unknown feed format {fmt!r}")
+    return read_feed_csv(stream) if fmt == "csv" else read_feed_json(stream)
+
+def _parse_value(field, value):
+    parser, max_length = FEED_FIELDS[field]
+    if isinstance(value, str):
+        value = value.strip()
+        if value == "":
+            return None
+    if parser is bool:
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text not in _TRUE | _FALSE:
+            raise ValueError(f"{field} must be true or false")
+        return text in _TRUE
+    if parser in (int, float):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be a number") from None
+    if parser is int:
+        if not math.isfinite(number) or number != int(number) or number < 0:
+            raise ValueError(f"{field} must be a whole number of at least 0")
+        return int(number)
+    if parser is float:
+        number = round(number, 2)
+        if not math.isfinite(number) or number < 0:
+            raise ValueError(f"{field} must be a number of at least 0")
+        return number
+    value = str(value)
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+def parse_feed_row(row, key, line):
+    """(key value, {field: value}) of the fields a feed row sets; raises FeedRowError"""
+    row = {str(name).strip().lower(): value for name, value in row.items() if name is not None}
+    raw_key = row.get(key)
+    key_value = raw_key.strip() if isinstance(raw_key, str) else raw_key
+    if key_value in (None, ""):
+        raise FeedRowError(line, f"no {key}")
+    values = {}
+    try:
+        if key == "id":
+            key_value = int(key_value)
+        for field in FEED_FIELDS:
+            if field != key and row.get(field) is not None:
+                value = _parse_value(field, row[field])
+                if value is not None:
+                    values[field] = value
+        if key == "sku":
+            key_value = _parse_value("sku", key_value)
+    except (TypeError, ValueError) as e:
+        raise FeedRowError(line, str(e)) from e
+    return key_value, values
+
+class CatalogImport:
+    """Applies supplier price and stock feeds to the catalog.
+
+    The feed is read and applied `batch_size` rows at a time: each batch
+    reads the current values of its games with one query, keeps only the
+    fields that differ, and writes them with one executemany UPDATE per set
+    of changed columns and one upsert for new SKUs, then commits. Memory
+    stays bounded by the batch whatever the size of the feed. Caches are
+    invalidated once at the end: one catalog version bump and one search
+    index pass over the games whose indexed fields changed, even when the
+    import stops on an error after some batches were committed.
+
+    A feed's stock is the supplier's quantity on hand. Game.stock is what
+    is left after checkout holds, so the held quantity is taken off it, and
+    the write only lands if the stock is still what the batch read (see
+    _set_stock). Code-vault games ignore feed stock: theirs counts codes.
+    """
+
+    @staticmethod
+    def _held():
+        return (select(func.coalesce(func.sum(StockReservation.quantity), 0))
+                .where(StockReservation.game_id == Game.id, StockReservation.status == "held")
+                .scalar_subquery().label("held"))
+
+    @staticmethod
+    def _current(key, keys):
+        column = Game.sku if key == "sku" else Game.id
+        columns = [Game.id, Game.uses_code_vault, CatalogImport._held()] + [getattr(Game, field) for field in FEED_FIELDS]
+        return {row._mapping[column.key]: row._mapping
+                for row in db.session.execute(select(*columns).where(column.in_(keys)))}
+
+    @staticmethod
+    def _set_stock(on_hand, seen, now, attempts=3):
+        """Set the stock of {game_id: quantity on hand} to that quantity less the game's holds.
+
+        `seen` is {game_id: (stock, held)} as the batch read them. Each
+        UPDATE is conditional on the stock still being the one read, so a
+        checkout that holds or a fulfillment that takes stock in between is
+        never overwritten: the games whose UPDATE missed are read again and
+        retried. Returns the number of games still conflicting after
+        `attempts`, which keep their stock.
+        """
+        game = Game.__table__
+        statement = (update(game)
+                     .where(game.c.id == bindparam("_game_id"), game.c.stock == bindparam("_seen"))
+                     .values(stock=bindparam("stock"), updated_at=now))
+        for _ in range(attempts):
+            rows = [{"_game_id": game_id, "_seen": stock, "stock": max(on_hand[game_id] - held, 0)}
+                    for game_id, (stock, held) in seen.items() if max(on_hand[game_id] - held, 0) != stock]
+            if not rows:
+                return 0
+            result = db.session.execute(statement, rows)
+            if db.engine.dialect.supports_sane_multi_rowcount and result.rowcount == len(rows):
+                return 0
+            game_ids = [row["_game_id"] for row in rows]
+            seen = {row.id: (row.stock, row.held) for row in db.session.execute(
+                select(Game.id, Game.stock, CatalogImport._held()).where(Game.id.in_(game_ids)))}
+        return sum(1 for game_id, (stock, held) in seen.items() if max(on_hand[game_id] - held, 0) != stock)
+
+    @staticmethod
+    def _upsert_new_games(rows):
+        """Insert games for new SKUs.
+
+        A SKU another import created since _current() read the batch is
+        updated instead, with the fields the row sets (and the new-game
+        defaults for stock and is_active when it sets neither).
+        """
+        dialect = db.engine.dialect.name
+        if dialect not in ("postgresql", "sqlite"):
+            db.session.execute(insert(Game.__table__), rows)
+            return
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(Game.__table__)
+        set_ = {field: func.coalesce(statement.excluded[field], Game.__table__.c[field])
+                for field in FEED_FIELDS if field != "sku"}
+        set_["updated_at"] = statement.excluded.updated_at
+        db.session.execute(statement.on_conflict_do_update(index_elements=["sku"], set_=set_), rows)
+
+    @staticmethod
+    def _apply(batch, key, totals, changed):
+        # The last row of a key wins, as if the rows were applied one by one
+        latest = {}
+        for key_value, values in batch:
+            latest.setdefault(key_value, {}).update(values)
+        totals["duplicates"] += len(batch) - len(latest)
+        current = CatalogImport._current(key, list(latest))
+        now = datetime.utcnow()
+        updates, new_games, on_hand, seen = {}, [], {}, {}
+        for key_value, values in latest.items():
+            game = current.get(key_value)
+            if game is None:
+                missing = [field for field in NEW_GAME_FIELDS if field not in values]
+                if key == "id" or missing:
+                    totals["unknown"] += 1
+                    continue
+                new_games.append(dict({field: values.get(field) for field in FEED_FIELDS}, sku=key_value,
+                                      stock=values.get("stock", 0), is_active=values.get("is_active", True),
+                                      uses_code_vault=False, created_at=now, updated_at=now))
+                continue
+            if "stock" in values and game["uses_code_vault"]:
+                values = {field: value for field, value in values.items() if field != "stock"}
+                totals["vault_stock"] += 1
+            diff = {field: value for field, value in values.items() if field != "stock" and game[field] != value}
+            if "stock" in values and max(values["stock"] - game["held"], 0) != game["stock"]:
+                on_hand[game["id"]] = values["stock"]
+                seen[game["id"]] = (game["stock"], game["held"])
+            elif not diff:
+                totals["unchanged"] += 1
+                continue
+            totals["updated"] += 1
+            if diff:
+                updates.setdefault(tuple(sorted(diff)), []).append(dict(diff, _game_id=game["id"]))
+            if "price" in diff:
+                changed["prices"].add(game["id"])
+            if any(field in diff for field in SEARCH_FIELDS):
+                changed["search"].add(game["id"])
+
+        for fields, rows in updates.items():
+            db.session.execute(
+                update(Game.__table__).where(Game.__table__.c.id == bindparam("_game_id"))
+                .values(dict({field: bindparam(field) for field in fields}, updated_at=now)),
+                rows)
+        if on_hand:
+            totals["conflicts"] += CatalogImport._set_stock(on_hand, seen, now)
+        if new_games:
+            CatalogImport._upsert_new_games(new_games)
+            changed["new_skus"].update(game["sku"] for game in new_games)
+            totals["created"] += len(new_games)
+        if changed["prices"]:
+            # Cart subtotals follow the new prices, as after an admin edit
+            CartService.rebuild_counters(game_ids=sorted(changed["prices"]))
+            changed["prices"].clear()
+        db.session.commit()
+        totals["batches"] += 1
+        if updates or on_hand or new_games:
+            changed["any"] = True
+
+    @staticmethod
+    def run(rows, key="sku", batch_size=1000, max_errors=20):
+        """Apply feed rows (dicts, e.g. from read_feed()) in batches of `batch_size`, one commit each.
+
+        Yields the running totals after every batch; the last one also has
+        the elapsed seconds. Rows that cannot be parsed are counted as
+        invalid and the first `max_errors` of them listed; rows for games
+        that do not exist (and cannot be created) are counted as unknown,
+        rows repeating a key within a batch as duplicates, stock for
+        code-vault games as vault_stock, and stock that kept changing under
+        the import as conflicts.
+        """
+        if key not in FEED_KEYS:
+            raise ValueError(f"Unknown feed key {key!r}")
+        started = time.perf_counter()
+        totals = {"batches": 0, "read": 0, "created": 0, "updated": 0, "unchanged": 0, "unknown": 0,
+                  "duplicates": 0, "invalid": 0, "vault_stock": 0, "conflicts": 0, "errors": []}
+        changed = {"prices": set(), "search": set(), "new_skus": set(), "any": False}
+        batch = []
+        try:
+            for line, row in enumerate(rows, start=1):
+                totals["read"] += 1
+                try:
+                    batch.append(parse_feed_row(row, key, line))
+                except FeedRowError as e:
+                    totals["invalid"] += 1
+                    if len(totals["errors"]) < max_errors:
+                        totals["errors"].append(str(e))
+                    continue
+                if len(batch) >= batch_size:
+                    CatalogImport._apply(batch, key, totals, changed)
+                    batch = []
+                    yield dict(totals, errors=list(totals["errors"]))
+            if batch:
+                CatalogImport._apply(batch, key, totals, changed)
+        finally:
+            db.session.rollback() # A batch that failed half-way
+            CatalogImport._invalidate(changed)
+        totals["elapsed"] = round(time.perf_counter() - started, 3)
+        yield totals
+
+    @staticmethod
+    def _invalidate(changed, batch_size=1000):
+        if not changed["any"]:
+            return
+        CatalogCache.bump()
+        game_ids = set(changed["search"])
+        new_skus = sorted(changed["new_skus"])
+        for start in range(0, len(new_skus), batch_size):
+            game_ids.update(db.session.scalars(select(Game.id).where(Game.sku.in_(new_skus[start:start + batch_size]))))
+        game_ids = sorted(game_ids)
+        for start in range(0, len(game_ids), batch_size):
+            GameSearchIndex.index_games(
+                db.session.query(Game.id, Game.name, Game.description, Game.category, Game.game_type, Game.is_active)
+                .filter(Game.id.in_(game_ids[start:start + batch_size])).all())
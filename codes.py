@@ -0,0 +1,150 @@
+import base64
+import hashlib
+import os
+import secrets
+import threading
+from flask import current_app, has_app_context
+from sqlalchemy import update, insert, select
+from sqlalchemy.exc import IntegrityError
+
+CODE_BITS = 80 # 16 base32 characters
+HALF_BITS = CODE_BITS // 2
+FEISTEL_ROUNDS = 4 # Luby-Rackoff: 4 rounds of a PRF give a strong pseudorandom permutation
+# Crockford's base32: no I, L, O or U, so codes survive being read out or retyped
+_B32_TO_CROCKFORD = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", b"0123456789ABCDEFGHJKMNPQRSTVWXYZ")
+
+class FeistelPermutation:
+    """Keyed bijection on 80-bit integers: a balanced Feistel network with a keyed BLAKE2b round function.
+
+    Distinct inputs always give distinct outputs, and without the key the
+    outputs of consecutive inputs cannot be told apart from random.
+    """
+
+    def __init__(self, key, rounds=FEISTEL_ROUNDS):
+        self._rounds = [hashlib.blake2b(key=key, digest_size=HALF_BITS // 8, person=b"shamo-round-%d" % i)
+                        for i in range(rounds)]
+
+    def permute_many(self, values):
+        half_bytes = HALF_BITS // 8
+        mask = (1 << HALF_BITS) - 1
+        lefts = [value >> HALF_BITS for value in values]
+        rights = [value & mask for value in values]
+        from_bytes = int.from_bytes
+        for round_hash in self._rounds:
+            copy = round_hash.copy # Cloning the keyed state skips re-keying BLAKE2b per value
+
+            def f(right):
+                h = copy()
+                h.update(right.to_bytes(half_bytes, "big"))
+                return from_bytes(h.digest(), "big")
+
+            lefts, rights = rights, [left ^ f(right) for left, right in zip(lefts, rights)]
+        return [(left << HALF_BITS) | right for left, right in zip(lefts, rights)]
+
+    def permute(self, value):
+        return self.permute_many([value])[0]
+
+def code_prefix(game_type):
+    return game_type.upper()[:4] if game_type else "CODE"
+
+def format_codes(prefix, values):
+    """Render 80-bit values as PREFIX-XXXX-XXXX-XXXX-XXXX, base32-encoding the whole batch at once"""
+    encoded = base64.b32encode(b"".join(value.to_bytes(CODE_BITS // 8, "big") for value in values))
+    encoded = encoded.translate(_B32_TO_CROCKFORD).decode("ascii")
+    codes = []
+    for start in range(0, len(encoded), 16):
+        part = encoded[start:start + 16]
+        codes.append(f"{prefix}-{part[:4]}-{part[4:8]}-{part[8:12]}-{part[12:]}")
+    return codes
+
+def lease_block(prefix, size):
+    """Reserve the next `size` counter values of `prefix` in code_sequence; returns the first one.
+
+    Runs on its own connection and commits at once, so a block is never
+    handed out twice even if the caller's transaction rolls back.
+    """
+    from models import db, CodeSequence
+    for _ in range(3):
+        try:
+            with db.engine.connect() as connection, connection.begin():
+                result = connection.execute(
+                    update(CodeSequence)
+                    .where(CodeSequence.prefix == prefix)
+                    .values(next_value=CodeSequence.next_value + size))
+                if result.rowcount == 0:
+                    connection.execute(insert(CodeSequence).values(prefix=prefix, next_value=size))
+                    return 0
+                end = connection.execute(
+                    select(CodeSequence.next_value).where(CodeSequence.prefix == prefix)).scalar_one()
+                return end - size
+        except IntegrityError: # Another worker created the sequence first
+            continue
+    raise RuntimeError(f"Could not lease a code block for prefix {prefix}")
+
+def _lease_random_block(prefix, size):
+    # No database to coordinate with: start at a random point of the 80-bit space
+    return secrets.randbits(CODE_BITS - 1)
+
+class CodeGenerator:
+    """Issues unique digital codes from per-prefix counters run through a keyed permutation.
+
+    Each process leases blocks of counter values from the code_sequence
+    table, so issuing a code needs no database round trip, and two codes can
+    only be equal if their counters were, which the leases rule out.
+    """
+
+    def __init__(self, key, lease=lease_block, block_size=10000):
+        self.permutation = FeistelPermutation(key)
+        self.lease = lease
+        self.block_size = block_size
+        self._blocks = {} # prefix -> [next, end)
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def reserve(self, prefix, count):
+        """Make sure `count` counters are available locally, leasing a block now if needed.
+
+        Call this before the caller's transaction takes write locks: the lease
+        commits on its own connection.
+        """
+        with self._lock:
+            self._reserve(prefix, count)
+
+    def _reserve(self, prefix, count):
+        start, end = self._blocks.get(prefix, (0, 0))
+        if end - start < count:
+            size = max(self.block_size, count)
+            # A fresh block replaces what is left of the old one; the remainder is simply skipped
+            start = self.lease(prefix, size)
+            self._blocks[prefix] = (start, start + size)
+
+    def generate(self, prefix, count=1):
+        with self._lock:
+            self._reserve(prefix, count)
+            start, end = self._blocks[prefix]
+            self._blocks[prefix] = (start + count, end)
+        return format_codes(prefix, self.permutation.permute_many(range(start, start + count)))
+
+def _derive_key(secret):
+    return hashlib.blake2b(secret.encode("utf-8"), digest_size=32, person=b"shamo-codes").digest()
+
+_fallback_generator = None
+
+def get_code_generator():
+    """The code generator of this process.
+
+    Outside an application context (scripts, unit tests) codes come from a
+    process-local key and randomly placed counters instead of leased blocks.
+    """
+    global _fallback_generator
+    if not has_app_context():
+        if _fallback_generator is None or _fallback_generator.pid != os.getpid():
+            _fallback_generator = CodeGenerator(secrets.token_bytes(32), lease=_lease_random_block)
+        return _fallback_generator
+    generator = current_app.extensions.get("code_generator")
+    # A forked child must not keep issuing from the parent's leased block
+    if generator is None or generator.pid != os.getpid():
+        secret = current_app.config.get("CODE_SECRET_KEY") or current_app.config["SECRET_KEY"]
+        generator = current_app.extensions["code_generator"] = CodeGenerator(
+            _derive_key(secret), block_size=current_app.config.get("CODE_BLOCK_SIZE", 10000))
+    return generator
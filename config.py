@@ -9,6 +9,11 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or \
         "sqlite:///" + os.path.join(basedir, "instance", "game_shop.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Comma-separated read replica URLs for read-only views, and seconds a client that
+    # wrote keeps reading the primary so it sees its own writes
+    SQLALCHEMY_REPLICA_URIS = [url.strip() for url in (os.environ.get("DATABASE_REPLICA_URLS") or "").split(",")
+                               if url.strip()]
+    DB_STICKY_SECONDS = int(os.environ.get("DB_STICKY_SECONDS") or 10)
     
     # Mail server configuration (example using environment variables)
     MAIL_SERVER = os.environ.get("MAIL_SERVER")
@@ -17,3 +22,79 @@ class Config:
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER") or "noreply@gameshipping.com"
+    # SMTP connections kept open per worker, outbox size before senders push back,
+    # messages sent per connection checkout, and seconds to wait for outbox space
+    MAIL_POOL_SIZE = int(os.environ.get("MAIL_POOL_SIZE") or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE") or 1000)
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE") or 50)
+    MAIL_SUBMIT_TIMEOUT = int(os.environ.get("MAIL_SUBMIT_TIMEOUT") or 10)
+    # Orders a customer places within this many seconds share one confirmation email
+    MAIL_COALESCE_WINDOW = int(os.environ.get("MAIL_COALESCE_WINDOW") or 60)
+
+    # SQLite file holding the catalog cache shared by all workers on this host, most
+    # entries it keeps, and seconds after which an entry is pruned even if unchanged
+    SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH") or \
+        os.path.join(basedir, "instance", "shared_cache.db")
+    SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("SHARED_CACHE_MAX_ENTRIES") or 50000)
+    SHARED_CACHE_TTL = int(os.environ.get("SHARED_CACHE_TTL") or 3600)
+
+    # Seconds a checkout holds stock for its order before the sweeper returns it
+    STOCK_HOLD_TTL = int(os.environ.get("STOCK_HOLD_TTL") or 900)
+
+    # Background job queue: seconds a claimed job stays invisible to other workers,
+    # attempts before a job is parked as failed, and the base of the retry backoff.
+    # The visibility timeout must outlast FULFILLMENT_CLAIM_TIMEOUT (checked below): a
+    # fulfill_order job redelivered while its order is still claimed only fails again
+    JOB_VISIBILITY_TIMEOUT = int(os.environ.get("JOB_VISIBILITY_TIMEOUT") or 900)
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS") or 5)
+    JOB_RETRY_BACKOFF = int(os.environ.get("JOB_RETRY_BACKOFF") or 30)
+
+    # Batch fulfillment: orders per chunk/transaction, seconds before an abandoned
+    # claim can be taken over, and the most orders one HTTP request may process
+    FULFILLMENT_CHUNK_SIZE = int(os.environ.get("FULFILLMENT_CHUNK_SIZE") or 200)
+    FULFILLMENT_CLAIM_TIMEOUT = int(os.environ.get("FULFILLMENT_CLAIM_TIMEOUT") or 600)
+    FULFILLMENT_HTTP_LIMIT = int(os.environ.get("FULFILLMENT_HTTP_LIMIT") or 1000)
+    if JOB_VISIBILITY_TIMEOUT <= FULFILLMENT_CLAIM_TIMEOUT:
+        raise ValueError("JOB_VISIBILITY_TIMEOUT must be longer than FULFILLMENT_CLAIM_TIMEOUT")
+
+    # Digital codes: secret keying the code permutation (defaults to one derived from
+    # SECRET_KEY; must be the same on every worker and never change), counter values leased per block,
+    # and the most codes one /shipping/generate_code call may issue
+    CODE_SECRET_KEY = os.environ.get("CODE_SECRET_KEY")
+    CODE_BLOCK_SIZE = int(os.environ.get("CODE_BLOCK_SIZE") or 10000)
+    CODE_BULK_MAX = int(os.environ.get("CODE_BULK_MAX") or 10000)
+
+    # Supplier code vault: codes per import transaction, and the available-code count
+    # below which an alert goes to VAULT_ALERT_EMAIL (or every admin when unset)
+    VAULT_IMPORT_BATCH_SIZE = int(os.environ.get("VAULT_IMPORT_BATCH_SIZE") or 5000)
+    VAULT_LOW_STOCK_THRESHOLD = int(os.environ.get("VAULT_LOW_STOCK_THRESHOLD") or 100)
+    VAULT_ALERT_EMAIL = os.environ.get("VAULT_ALERT_EMAIL")
+
+    # Password hashing: werkzeug KDF method and cost (stored hashes made with other
+    # parameters are upgraded at the next login), hashing processes per worker, hashes
+    # running or queued per worker, and seconds a request waits for a slot before a 503
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD") or "scrypt:32768:8:1"
+    HASH_POOL_WORKERS = int(os.environ.get("HASH_POOL_WORKERS") or 1)
+    HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING") or 4)
+    HASH_ADMISSION_TIMEOUT = float(os.environ.get("HASH_ADMISSION_TIMEOUT") or 2.0)
+    # Logged-in users cached per worker for flask_login: most users kept, and seconds
+    # before an entry is re-read (admin and password changes invalidate it at once)
+    IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE") or 10000)
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL") or 60)
+    # Idempotency-Key replays: seconds a stored response is replayed, seconds a request
+    # may hold a key before a retry takes it over, and seconds a concurrent duplicate
+    # waits for the first request before getting a 409
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL") or 86400)
+    IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT") or 60)
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get("IDEMPOTENCY_WAIT_TIMEOUT") or 10.0)
+    # Order exports: rows fetched per server-side cursor round trip (and written per chunk)
+    EXPORT_YIELD_PER = int(os.environ.get("EXPORT_YIELD_PER") or 2000)
+    # Supplier catalog feeds: rows diffed, applied and committed together
+    CATALOG_IMPORT_BATCH_SIZE = int(os.environ.get("CATALOG_IMPORT_BATCH_SIZE") or 1000)
+    # Per-request SQL accounting: Server-Timing header and one JSON log line per request
+    # (when unset, both are on only in debug and testing, as they expose query counts and
+    # timings), and the most times one statement shape may run in a request before it
+    # raises (an N+1 detector; unset in production, set by the tests)
+    SQL_ACCOUNTING_ENABLED = (os.environ["SQL_ACCOUNTING_ENABLED"] == "1") if os.environ.get("SQL_ACCOUNTING_ENABLED") else None
+    SQL_ACCOUNTING_LOG = (os.environ["SQL_ACCOUNTING_LOG"] == "1") if os.environ.get("SQL_ACCOUNTING_LOG") else None
+    SQL_REPEAT_LIMIT = int(os.environ["SQL_REPEAT_LIMIT"]) if os.environ.get("SQL_REPEAT_LIMIT") else None
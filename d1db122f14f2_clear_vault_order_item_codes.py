@@ -0,0 +1,30 @@
+"""Clear order_item.code on items delivered from the code vault; their codes live in vault_code
+
+Revision ID: d1db122f14f2
+Revises: 136b265a8a48
+Create Date: 2026-10-18 21:48:12.630174
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1db122f14f2'
+down_revision = '136b265a8a48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE order_item SET code = NULL "
+        "WHERE code IS NOT NULL AND id IN (SELECT order_item_id FROM vault_code WHERE order_item_id IS NOT NULL)")
+
+
+def downgrade():
+    # Back to the first vault code of each item, as vault deliveries set it before this revision
+    op.execute(
+        "UPDATE order_item SET code = (SELECT vault_code.code FROM vault_code "
+        "WHERE vault_code.order_item_id = order_item.id ORDER BY vault_code.id LIMIT 1) "
+        "WHERE code IS NULL AND id IN (SELECT order_item_id FROM vault_code WHERE order_item_id IS NOT NULL)")
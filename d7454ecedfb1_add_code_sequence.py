@@ -0,0 +1,33 @@
+"""Add code_sequence and a unique index on order_item.code
+
+Revision ID: d7454ecedfb1
+Revises: 97ac19d817a9
+Create Date: 2026-10-18 14:05:51.337120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7454ecedfb1'
+down_revision = '97ac19d817a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('code_sequence',
+    sa.Column('prefix', sa.String(length=16), nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('prefix')
+    )
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_item_code'), ['code'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_item_code'))
+
+    op.drop_table('code_sequence')
@@ -0,0 +1,137 @@
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request, session as flask_session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+STICKY_SESSION_KEY = "_db_primary_until"
+
+def init_read_replicas(app):
+    """Create the engines of SQLALCHEMY_REPLICA_URIS; without any, every query stays on the primary"""
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    app.extensions["read_replicas"] = [create_engine(url, **options)
+                                       for url in app.config.get("SQLALCHEMY_REPLICA_URIS") or []]
+
+def replica_reads(view):
+    """Let the SELECTs of a read-only GET view run on a read replica.
+
+    The view still reads the primary if it writes anything itself, or if the
+    same client wrote within the last DB_STICKY_SECONDS (read-your-writes).
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        if request.method in ("GET", "HEAD"):
+            g.db_replica_reads = True
+        return view(*args, **kwargs)
+    return decorated_function
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside this block, even in a replica_reads view"""
+    if not has_request_context():
+        yield
+        return
+    g.db_primary_depth = g.get("db_primary_depth", 0) + 1
+    try:
+        yield
+    finally:
+        g.db_primary_depth -= 1
+
+def _replica():
+    if not has_request_context() or not g.get("db_replica_reads") or g.get("db_primary_depth") or g.get("db_wrote"):
+        return None
+    replicas = current_app.extensions.get("read_replicas")
+    if not replicas or flask_session.get(STICKY_SESSION_KEY, 0) > time.time():
+        return None
+    if "db_replica" not in g:
+        g.db_replica = random.choice(replicas) # One replica per request, so its reads are consistent
+    return g.db_replica
+
+def _mark_write():
+    if has_request_context() and not g.get("db_wrote"):
+        g.db_wrote = True
+        if current_app.extensions.get("read_replicas"):
+            flask_session[STICKY_SESSION_KEY] = time.time() + current_app.config.get("DB_STICKY_SECONDS", 10)
+
+@event.listens_for(Session, "do_orm_execute")
+def _route_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+        return None
+    if not orm_execute_state.is_select:
+        return None
+    if getattr(orm_execute_state.statement, "_for_update_arg", None) is not None:
+        return None # Row locks only mean something on the primary
+    replica = _replica()
+    if replica is None:
+        return None
+    return orm_execute_state.invoke_statement(bind_arguments={"bind": replica})
+
+@event.listens_for(Session, "after_flush")
+def _stick_to_primary(session, flush_context):
+    _mark_write()
+
+class ReplicationLagSimulator:
+    """Stand-in for streaming replication between two SQLite files.
+
+    sync() copies the primary onto the replica at once; run() keeps copying,
+    applying each snapshot only `lag` seconds after it was taken, so the
+    replica always trails the primary like a lagging real replica would.
+    """
+
+    def __init__(self, primary_path, replica_path, lag=1.0, interval=0.25):
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.lag = lag
+        self.interval = interval
+
+    @classmethod
+    def from_config(cls, config, lag=1.0, interval=0.25):
+        primary = make_url(config["SQLALCHEMY_DATABASE_URI"])
+        replicas = config.get("SQLALCHEMY_REPLICA_URIS") or []
+        if primary.get_backend_name() != "sqlite" or not replicas:
+            raise ValueError("The replication simulator needs a SQLite primary and a SQLite replica")
+        return cls(primary.database, make_url(replicas[0]).database, lag, interval)
+
+    def snapshot(self):
+        source = sqlite3.connect(self.primary_path, timeout=30)
+        copy = sqlite3.connect(":memory:", check_same_thread=False)
+        try:
+            source.backup(copy)
+        finally:
+            source.close()
+        return copy
+
+    def apply(self, snapshot):
+        target = sqlite3.connect(self.replica_path, timeout=30)
+        try:
+            snapshot.backup(target)
+        finally:
+            target.close()
+            snapshot.close()
+
+    def sync(self):
+        self.apply(self.snapshot())
+
+    def run(self, stop=None):
+        """Replicate until `stop` (a threading.Event) is set"""
+        stop = stop or threading.Event()
+        pending = deque() # (taken_at, snapshot), oldest first
+        while not stop.is_set():
+            pending.append((time.monotonic(), self.snapshot()))
+            latest = None
+            while pending and time.monotonic() - pending[0][0] >= self.lag:
+                if latest is not None:
+                    latest.close() # Superseded by a newer snapshot that is also due
+                latest = pending.popleft()[1]
+            if latest is not None:
+                self.apply(latest)
+            stop.wait(self.interval)
+        for _, snapshot in pending:
+            snapshot.close()
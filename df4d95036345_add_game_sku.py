@@ -0,0 +1,28 @@
+"""Add game.sku, the supplier SKU catalog feeds are keyed by
+
+Revision ID: df4d95036345
+Revises: 8dc4f567e84c
+Create Date: 2026-10-18 19:20:07.514302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df4d95036345'
+down_revision = '8dc4f567e84c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('game', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sku', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_game_sku'), ['sku'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('game', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_game_sku'))
+        batch_op.drop_column('sku')
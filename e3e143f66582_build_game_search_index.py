@@ -0,0 +1,87 @@
+"""Build the FTS5 game search index (SQLite only)
+
+Revision ID: e3e143f66582
+Revises: d1db122f14f2
+Create Date: 2026-10-18 23:05:41.218730
+
+"""
+import re
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3e143f66582'
+down_revision = 'd1db122f14f2'
+branch_labels = None
+depends_on = None
+
+# search.normalize_arabic as of this revision, so the index matches what search queried
+# with then; later changes to it are applied by `flask admin rebuild-search-index`
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+_TATWEEL = "\u0640"
+_ARABIC_LETTER_MAP = str.maketrans({
+    "\u0623": "\u0627", # أ -> ا
+    "\u0625": "\u0627", # إ -> ا
+    "\u0622": "\u0627", # آ -> ا
+    "\u0671": "\u0627", # ٱ -> ا
+    "\u0649": "\u064A", # ى -> ي
+    "\u06CC": "\u064A", # ی (Persian yeh) -> ي
+    "\u0626": "\u064A", # ئ -> ي
+    "\u0624": "\u0648", # ؤ -> و
+    "\u0629": "\u0647", # ة -> ه
+    "\u06A9": "\u0643", # ک (keheh) -> ك
+})
+# Arabic-Indic and extended Arabic-Indic digits -> ASCII
+_DIGIT_MAP = str.maketrans("\u0660\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669"
+                           "\u06F0\u06F1\u06F2\u06F3\u06F4\u06F5\u06F6\u06F7\u06F8\u06F9",
+                           "01234567890123456789")
+# A switch between Arabic and Latin/digit runs inside one token, e.g. "pubgشدات" or "شدات60"
+_SCRIPT_BOUNDARY = re.compile(r"(?<=[\u0600-\u06FF])(?=[A-Za-z0-9])|(?<=[A-Za-z0-9])(?=[\u0600-\u06FF])")
+
+def _normalize(value):
+    """Strip diacritics and tatweel, unify letter variants and digits, case-fold and split mixed tokens"""
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKC", value)
+    value = _ARABIC_DIACRITICS.sub("", value).replace(_TATWEEL, "")
+    value = value.translate(_ARABIC_LETTER_MAP).translate(_DIGIT_MAP)
+    value = _SCRIPT_BOUNDARY.sub(" ", value)
+    return value.casefold()
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite":
+        return # Other databases search with LIKE
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS game_search USING fts5("
+        "name, description, category, game_type, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    op.execute("DELETE FROM game_search")
+    insert = sa.text(
+        "INSERT INTO game_search (rowid, name, description, category, game_type) "
+        "VALUES (:rowid, :name, :description, :category, :game_type)")
+    last_id = 0
+    while True:
+        games = bind.execute(sa.text(
+            "SELECT id, name, description, category, game_type FROM game "
+            "WHERE is_active AND id > :last_id ORDER BY id LIMIT 1000"), {"last_id": last_id}).all()
+        if not games:
+            break
+        bind.execute(insert, [{
+            "rowid": game.id,
+            "name": _normalize(game.name),
+            "description": _normalize(game.description),
+            "category": _normalize(game.category),
+            "game_type": _normalize((game.game_type or "").replace("_", " ")),
+        } for game in games])
+        last_id = games[-1].id
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TABLE IF EXISTS game_search")
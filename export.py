@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from models import db, User, Game, Order, OrderItem, Payment
+from admin_service import AdminListingService
+
+# Header name -> column; one row per order item (orders without items get one row with empty item fields)
+ORDER_EXPORT_COLUMNS = {
+    "order_id": Order.id,
+    "order_created_at": Order.created_at,
+    "order_status": Order.status,
+    "total_amount": Order.total_amount,
+    "customer_id": User.id,
+    "customer_username": User.username,
+    "customer_email": User.email,
+    "item_id": OrderItem.id,
+    "game_id": OrderItem.game_id,
+    "game_name": Game.name,
+    "quantity": OrderItem.quantity,
+    "price": OrderItem.price,
+    "item_status": OrderItem.status,
+    "game_account_id": OrderItem.game_account_id,
+    "payment_method": Payment.payment_method,
+    "payment_status": Payment.status,
+    "payment_amount": Payment.amount,
+    "transaction_id": Payment.transaction_id,
+}
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class OrderExport:
+    """Streams orders with their items and payments as CSV or NDJSON.
+
+    Rows are read through a server-side cursor `yield_per` at a time and
+    written out one batch per chunk, so memory stays flat whatever the
+    number of orders; nothing is ever collected into a list.
+    """
+
+    @staticmethod
+    def statement(filters=None):
+        statement = (
+            select(*ORDER_EXPORT_COLUMNS.values())
+            .select_from(Order)
+            .join(User, User.id == Order.user_id)
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .outerjoin(Game, Game.id == OrderItem.game_id)
+            .outerjoin(Payment, Payment.order_id == Order.id)
+        )
+        return AdminListingService.filter_orders(statement, filters or {}).order_by(Order.id, OrderItem.id)
+
+    @staticmethod
+    def batches(filters=None, yield_per=2000):
+        """Lists of at most `yield_per` rows, read from one server-side cursor"""
+        result = db.session.execute(OrderExport.statement(filters).execution_options(yield_per=yield_per))
+        try:
+            yield from result.partitions()
+        finally:
+            result.close()
+
+    @staticmethod
+    def csv_chunks(batches):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write("\ufeff") # BOM, so spreadsheet programs read the Arabic text as UTF-8
+        writer.writerow(ORDER_EXPORT_COLUMNS)
+        for rows in batches:
+            writer.writerows([_value(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue() # Header of an empty export
+
+    @staticmethod
+    def ndjson_chunks(batches):
+        names = list(ORDER_EXPORT_COLUMNS)
+        for rows in batches:
+            yield "".join(json.dumps(dict(zip(names, map(_value, row))), ensure_ascii=False) + "\n" for row in rows)
+
+    @staticmethod
+    def gzip_chunks(chunks):
+        """gzip a stream of text chunks as it goes"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31: gzip header and trailer
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode("utf-8"))
+            if data:
+                yield data
+        yield compressor.flush()
+
+    @staticmethod
+    def stream(filters=None, fmt="csv", compress=False, yield_per=2000):
+        """Chunks of the export: text, or bytes when `compress` is set"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}")
+        batches = OrderExport.batches(filters, yield_per)
+        chunks = OrderExport.csv_chunks(batches) if fmt == "csv" else OrderExport.ndjson_chunks(batches)
+        return OrderExport.gzip_chunks(chunks) if compress else chunks
+
+    @staticmethod
+    def filename(fmt="csv", compress=False):
+        return f"orders-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}" + (".gz" if compress else "")
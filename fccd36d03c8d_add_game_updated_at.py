@@ -0,0 +1,29 @@
+"""Add game.updated_at
+
+Revision ID: fccd36d03c8d
+Revises: e7313beaf2fc
+Create Date: 2026-10-18 10:12:41.503126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fccd36d03c8d'
+down_revision = 'e7313beaf2fc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('game', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Existing rows have not changed since they were created
+    op.execute('UPDATE game SET updated_at = created_at')
+
+
+def downgrade():
+    with op.batch_alter_table('game', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
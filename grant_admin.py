@@ -1,5 +1,6 @@
 from app import create_app, db
 from models import User
+from identity import invalidate_identity
 
 app = create_app()
 
@@ -10,6 +11,8 @@ with app.app_context():
         if not admin_user.is_admin:
             admin_user.is_admin = True
             db.session.commit()
+            # Running workers may hold this user in their identity cache; make them all reload it
+            invalidate_identity(admin_user.id)
             print(f"Admin permissions granted for user: {admin_user.email}")
         else:
             print(f"User {admin_user.email} already has admin permissions.")
@@ -1,6 +1,8 @@
 # إعدادات Gunicorn
 bind = "0.0.0.0:5000"
 workers = 3
+# خيوط لكل عامل: ينتظر تسجيل الدخول انتهاء تجزئة كلمة المرور دون أن يحجز العامل بأكمله
+threads = 4
 timeout = 120
 accesslog = "-"
 errorlog = "-"
@@ -0,0 +1,111 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot frees up within the admission timeout"""
+
+def normalize_method(method):
+    """Spell out werkzeug's defaults so 'scrypt' and 'scrypt:32768:8:1' compare equal"""
+    name, *params = method.split(":")
+    if name == "scrypt":
+        defaults = [str(2 ** 15), "8", "1"]
+    elif name == "pbkdf2":
+        defaults = ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ":".join([name] + params + defaults[len(params):])
+
+_executors = {} # workers -> ProcessPoolExecutor, per process
+_executors_lock = threading.Lock()
+
+def _executor(workers):
+    with _executors_lock:
+        executor, pid = _executors.get(workers, (None, None))
+        if executor is None or pid != os.getpid(): # A forked child cannot use its parent's pool
+            # forkserver: pool processes start clean instead of forking a worker full of threads and sockets
+            executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+            _executors[workers] = (executor, os.getpid())
+        return executor
+
+def _discard_executor(workers, executor):
+    with _executors_lock:
+        if _executors.get(workers, (None,))[0] is executor:
+            del _executors[workers]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+class PasswordHasher:
+    """Runs werkzeug's password KDF outside the request thread, with admission control.
+
+    Hashes are computed in a small process pool shared by the threads of a
+    worker, so a burst of logins cannot occupy every CPU the catalog needs.
+    At most `max_pending` hashes may be running or queued per worker; a
+    request that cannot get a slot within `admission_timeout` seconds gets
+    HashingBusy instead of waiting behind the burst. With `workers=0` hashes
+    run inline, still behind the same admission limit.
+    """
+
+    def __init__(self, method="scrypt", workers=1, max_pending=4, admission_timeout=2.0):
+        self.method = method
+        self.workers = workers
+        self.admission_timeout = admission_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.admission_timeout):
+            raise HashingBusy(f"Password hashing is saturated ({self.admission_timeout}s admission timeout)")
+        try:
+            if not self.workers:
+                return func(*args)
+            for attempt in range(2): # A pool process killed (e.g. by the OOM killer) is replaced once
+                executor = _executor(self.workers)
+                try:
+                    return executor.submit(func, *args).result()
+                except BrokenProcessPool:
+                    _discard_executor(self.workers, executor)
+            # Pool processes cannot start here (e.g. __main__ read from stdin): still answer, inline
+            print("Password hashing pool unavailable, hashing inline")
+            return func(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with other KDF parameters than the configured ones"""
+        if not password_hash or "$" not in password_hash:
+            return True
+        return normalize_method(password_hash.split("$", 1)[0]) != normalize_method(self.method)
+
+_inline_hasher = None
+
+def get_password_hasher():
+    """The password hasher of this app.
+
+    Outside an application context (scripts, unit tests) passwords are hashed
+    inline with werkzeug's defaults.
+    """
+    global _inline_hasher
+    if not has_app_context():
+        if _inline_hasher is None:
+            _inline_hasher = PasswordHasher(workers=0)
+        return _inline_hasher
+    hasher = current_app.extensions.get("password_hasher")
+    if hasher is None:
+        config = current_app.config
+        hasher = current_app.extensions["password_hasher"] = PasswordHasher(
+            method=config.get("PASSWORD_HASH_METHOD", "scrypt"),
+            workers=config.get("HASH_POOL_WORKERS", 1),
+            max_pending=config.get("HASH_MAX_PENDING", 4),
+            admission_timeout=config.get("HASH_ADMISSION_TIMEOUT", 2.0))
+    return hasher
@@ -0,0 +1,42 @@
+import hashlib
+from datetime import timezone
+from flask import request, make_response
+
+def make_etag(*parts):
+    """Strong ETag value built from the version fields that identify a representation"""
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _as_utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None: # Columns store naive UTC datetimes
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+def is_not_modified(etag, last_modified=None):
+    """Evaluate If-None-Match / If-Modified-Since for the current request.
+
+    If-None-Match takes precedence, as in RFC 9110; If-Modified-Since is only
+    consulted when the client sent no entity tags.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return _as_utc(last_modified) <= request.if_modified_since
+    return False
+
+def add_validators(response, etag, last_modified=None, private=False):
+    """Attach ETag/Last-Modified and make clients revalidate before reuse"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    return response
+
+def not_modified(etag, last_modified=None, private=False):
+    """Empty 304 response carrying the same validators"""
+    response = make_response("", 304)
+    return add_validators(response, etag, last_modified, private=private)
@@ -0,0 +1,174 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, g, jsonify, request
+from flask_login import current_user
+from sqlalchemy import insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from models import db, IdempotencyKey
+from sql_accounting import deliberate_repeats
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+def request_fingerprint():
+    """SHA-256 of the request's method, path and body"""
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.get_data()):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _lookup(user_id, key):
+    return db.session.query(
+        IdempotencyKey.id, IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.response_status,
+        IdempotencyKey.response_body, IdempotencyKey.content_type, IdempotencyKey.expires_at
+    ).filter(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key).first()
+
+def _claim(user_id, key, fingerprint):
+    """Insert an in-progress row for the key; returns its id, or None if the key is taken"""
+    try:
+        claim_id = db.session.execute(
+            insert(IdempotencyKey).values(
+                user_id=user_id, key=key, fingerprint=fingerprint, status="in_progress",
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=current_app.config.get("IDEMPOTENCY_LOCK_TIMEOUT", 60)))
+            .returning(IdempotencyKey.id)
+        ).scalar_one()
+        db.session.commit()
+        return claim_id
+    except IntegrityError:
+        db.session.rollback()
+        return None
+
+def _replay(row):
+    response = current_app.response_class(row.response_body, status=row.response_status, content_type=row.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+def _in_progress():
+    response = jsonify({"success": False, "message": "طلب بنفس مفتاح التكرار قيد المعالجة."})
+    response.headers["Retry-After"] = "1"
+    return response, 409
+
+def _complete(claim_id, response):
+    """Record the response on the claim, in the current transaction; False if the claim is no longer ours"""
+    result = db.session.execute(
+        update(IdempotencyKey)
+        # A retry that took over an expired claim deleted it and inserted its own
+        .where(IdempotencyKey.id == claim_id, IdempotencyKey.status == "in_progress")
+        .values(status="completed", response_status=response.status_code,
+                response_body=response.get_data(as_text=True), content_type=response.content_type,
+                expires_at=datetime.utcnow() + timedelta(seconds=current_app.config.get("IDEMPOTENCY_KEY_TTL", 86400)))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def _store(claim_id, response):
+    """Keep the response of a view that changed nothing; 5xx responses free the key instead so a retry redoes the work"""
+    if response.status_code >= 500:
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == claim_id))
+    else:
+        _complete(claim_id, response)
+    db.session.commit()
+
+def commit_with_response(response):
+    """Commit an idempotent view's changes together with the response its retries replay.
+
+    Idempotent views make their final commit through this instead of
+    db.session.commit(), so a crash can never leave the changes committed
+    without the response (or the other way round). The changes are only
+    committed if this request still holds its claim: when the claim
+    expired and a retry took the key over, they are rolled back and the
+    client gets a 409, so the work is never done twice.
+    """
+    response = current_app.make_response(response)
+    claim_id = g.get("idempotency_claim")
+    if claim_id is not None and not _complete(claim_id, response):
+        db.session.rollback()
+        g.pop("idempotency_claim") # Another request's key now: neither store nor free it
+        return _in_progress()
+    db.session.commit() # If this fails the claim stays with the decorator, which frees it
+    g.pop("idempotency_claim", None)
+    return response
+
+def idempotent(view):
+    """Run a mutating API view at most once per Idempotency-Key of the logged-in user.
+
+    The first request claims the key in idempotency_key before running the
+    view and stores its response afterwards; a retry with the same key and
+    body replays that response at the cost of one lookup. A duplicate that
+    arrives while the first request is still running waits up to
+    IDEMPOTENCY_WAIT_TIMEOUT seconds for its response, then gets a 409. Reusing
+    a key for a different request is a 422. Requests without the header, or
+    without a logged-in user, run as usual. Goes below @login_required.
+
+    A view that changes data must commit with commit_with_response(); the
+    response of a view that returns without doing so (a validation error)
+    is stored afterwards.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not current_user.is_authenticated:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"success": False, "message": "مفتاح التكرار طويل جداً."}), 400
+
+        user_id = current_user.id
+        fingerprint = request_fingerprint()
+        deadline = time.monotonic() + current_app.config.get("IDEMPOTENCY_WAIT_TIMEOUT", 10.0)
+        delay = 0.01
+        with deliberate_repeats(): # A duplicate re-reads its key until the first request is done
+            while True:
+                row = _lookup(user_id, key)
+                if row is None:
+                    claim_id = _claim(user_id, key, fingerprint)
+                    if claim_id is not None:
+                        break
+                    continue # Lost the race for the key: read the winner's row
+                if row.fingerprint != fingerprint:
+                    return jsonify({"success": False, "message": "مفتاح التكرار مستخدم لطلب مختلف."}), 422
+                if row.expires_at < datetime.utcnow():
+                    # Replay TTL over, or the first request died holding the key: start afresh
+                    db.session.execute(delete(IdempotencyKey).where(
+                        IdempotencyKey.id == row.id, IdempotencyKey.expires_at == row.expires_at))
+                    db.session.commit()
+                    continue
+                if row.status == "completed":
+                    return _replay(row)
+                if time.monotonic() >= deadline:
+                    return _in_progress()
+                time.sleep(delay)
+                delay = min(delay * 2, 0.2)
+
+        g.idempotency_claim = claim_id
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == claim_id))
+            db.session.commit()
+            raise
+        finally:
+            stored = "idempotency_claim" not in g # commit_with_response() took it
+            g.pop("idempotency_claim", None)
+        if not stored:
+            _store(claim_id, response)
+        return response
+    return decorated_function
+
+def purge_expired_keys(now=None, batch_size=5000):
+    """Delete keys past their TTL (or abandoned claims) in batches, one commit each; returns the number deleted"""
+    now = now or datetime.utcnow()
+    purged = 0
+    while True:
+        expired = db.session.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at < now).order_by(IdempotencyKey.id).limit(batch_size).subquery()
+        result = db.session.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.id.in_(db.session.query(expired.c.id)))
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            return purged
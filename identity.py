@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import db, User
+from shared_cache import get_shared_cache
+from db_routing import primary_reads
+
+IDENTITY_NAMESPACE = "identity"
+# Changing these must reach every worker before the next request trusts the cached row
+_SENSITIVE_ATTRIBUTES = ("is_admin", "password_hash")
+
+class IdentityCache:
+    """Per-worker TTL/LRU cache of the User rows flask_login reloads on every request.
+
+    Entries are the user's column values, turned back into a session-bound
+    User with merge(load=False), so a cache hit costs no query. Entries
+    expire after `ttl` seconds and are dropped in every worker as soon as
+    their user's shared version (or the one for all users) is bumped, which
+    invalidate_identity() does.
+    """
+
+    def __init__(self, size=10000, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict() # user_id -> (expires_at, version, column values)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, entry_version, values = entry
+            if entry_version != version or expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return values
+
+    def put(self, user_id, version, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, version, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+def get_identity_cache():
+    cache = current_app.extensions.get("identity_cache")
+    if cache is None:
+        cache = current_app.extensions.setdefault("identity_cache", IdentityCache(
+            current_app.config.get("IDENTITY_CACHE_SIZE", 10000), current_app.config.get("IDENTITY_CACHE_TTL", 60)))
+    return cache
+
+def _user_namespace(user_id):
+    return f"{IDENTITY_NAMESPACE}:{user_id}"
+
+def invalidate_identity(user_id=None):
+    """Drop a user's cached identity (everyone's with None) here and, through the shared version, in every worker"""
+    get_identity_cache().discard(user_id)
+    get_shared_cache().bump_version(IDENTITY_NAMESPACE if user_id is None else _user_namespace(user_id))
+
+def load_user(user_id):
+    """flask_login user_loader served from the identity cache"""
+    user_id = int(user_id)
+    cache = get_identity_cache()
+    # One user's change only drops that user's entries, in every worker
+    version = tuple(get_shared_cache().get_versions([IDENTITY_NAMESPACE, _user_namespace(user_id)]))
+    values = cache.get(user_id, version)
+    if values is None:
+        with primary_reads(): # A lagging replica could miss a user who just registered
+            user = db.session.get(User, user_id)
+        if user is not None:
+            cache.put(user_id, version, {column.key: getattr(user, column.key)
+                                         for column in inspect(User).column_attrs})
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    state = inspect(target)
+    if state.deleted or state.was_deleted or any(
+            state.attrs[name].history.has_changes() for name in _SENSITIVE_ATTRIBUTES):
+        state.session.info.setdefault("changed_identities", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_identities(session):
+    # After commit, so no worker can re-cache the old row under the new version
+    for user_id in session.info.pop("changed_identities", ()):
+        invalidate_identity(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_identities(session):
+    session.info.pop("changed_identities", None)
@@ -0,0 +1,167 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, insert, bindparam, exists
+from models import db, Game, StockReservation, Payment
+
+class InsufficientStock(Exception):
+    """Raised when a game does not have enough stock left for a hold or decrement.
+
+    game_id is None when a batch failed as a whole; find_shortage() names the
+    game once the caller has rolled back.
+    """
+    def __init__(self, game_id, quantity):
+        super().__init__(f"Insufficient stock for game {game_id} (required: {quantity})")
+        self.game_id = game_id
+        self.quantity = quantity
+
+class InventoryService:
+    """Atomic stock holds and decrements.
+
+    Every stock change is a single conditional UPDATE (stock >= :qty), so
+    concurrent checkouts can never oversell and never hold the Game row
+    across a read-modify-write in Python. None of these methods commit: the
+    caller owns the transaction.
+    """
+
+    @staticmethod
+    def take(game_id, quantity):
+        """Decrement stock if enough is left; returns True on success"""
+        result = db.session.execute(
+            update(Game)
+            .where(Game.id == game_id, Game.stock >= quantity)
+            .values(stock=Game.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    @staticmethod
+    def take_many(quantities):
+        """take() for {game_id: quantity} as one executemany; True only if every game had enough.
+
+        On False some games may already be decremented: the caller must roll back.
+        """
+        items = sorted(quantities.items()) # Fixed lock order, as in reserve()
+        if len(items) < 2 or not db.engine.dialect.supports_sane_multi_rowcount:
+            return all(InventoryService.take(game_id, quantity) for game_id, quantity in items)
+        game = Game.__table__ # Core statement: an ORM UPDATE with a parameter list means update-by-primary-key
+        result = db.session.connection().execute(
+            update(game)
+            .where(game.c.id == bindparam("game_id_"), game.c.stock >= bindparam("quantity_"))
+            .values(stock=game.c.stock - bindparam("quantity_")),
+            [{"game_id_": game_id, "quantity_": quantity} for game_id, quantity in items]
+        )
+        return result.rowcount == len(items)
+
+    @staticmethod
+    def find_shortage(quantities):
+        """First game of {game_id: quantity} whose stock cannot cover its quantity, or None"""
+        stock = dict(db.session.query(Game.id, Game.stock).filter(Game.id.in_(list(quantities))))
+        for game_id, quantity in sorted(quantities.items()):
+            if (stock.get(game_id) or 0) < quantity:
+                return game_id
+        return None
+
+    @staticmethod
+    def restock(game_id, quantity):
+        db.session.execute(
+            update(Game)
+            .where(Game.id == game_id)
+            .values(stock=Game.stock + quantity)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def reserve(order_id, quantities, ttl=None):
+        """Place time-limited holds for {game_id: quantity} on behalf of an order.
+
+        Stock is taken immediately; raises InsufficientStock (leaving the
+        caller to roll back) if any game cannot cover its quantity.
+        """
+        ttl = ttl if ttl is not None else current_app.config.get("STOCK_HOLD_TTL", 900)
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        if len(quantities) == 1:
+            [(game_id, quantity)] = quantities.items()
+            if not InventoryService.take(game_id, quantity):
+                raise InsufficientStock(game_id, quantity)
+        elif not InventoryService.take_many(quantities): # Fixed lock order keeps checkouts from deadlocking
+            raise InsufficientStock(None, sum(quantities.values()))
+        db.session.execute(insert(StockReservation), [
+            {"game_id": game_id, "order_id": order_id, "quantity": quantity,
+             "status": "held", "expires_at": expires_at}
+            for game_id, quantity in sorted(quantities.items())
+        ])
+
+    @staticmethod
+    def consume(order_id):
+        """Convert an order's held reservations into permanent decrements.
+
+        Returns {game_id: quantity} covered by holds. A hold that the sweeper
+        released first is not counted, so the caller falls back to take().
+        """
+        covered = InventoryService.consume_many([order_id])
+        return {game_id: quantity for (_, game_id), quantity in covered.items()}
+
+    @staticmethod
+    def consume_many(order_ids):
+        """consume() for a batch of orders in two statements; returns {(order_id, game_id): quantity}"""
+        held = db.session.query(StockReservation.id, StockReservation.order_id, StockReservation.game_id,
+                                StockReservation.quantity).filter(
+            StockReservation.order_id.in_(order_ids), StockReservation.status == "held").all()
+        if not held:
+            return {}
+        held_ids = [reservation.id for reservation in held]
+        result = db.session.execute(
+            update(StockReservation)
+            .where(StockReservation.id.in_(held_ids), StockReservation.status == "held")
+            .values(status="consumed")
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == len(held_ids):
+            consumed = set(held_ids)
+        else: # The sweeper released some holds in between; only count the ones we converted
+            consumed = {row.id for row in db.session.query(StockReservation.id).filter(
+                StockReservation.id.in_(held_ids), StockReservation.status == "consumed")}
+        covered = defaultdict(int)
+        for reservation in held:
+            if reservation.id in consumed:
+                covered[(reservation.order_id, reservation.game_id)] += reservation.quantity
+        return covered
+
+    @staticmethod
+    def _expirable():
+        """Holds the sweeper may return: those of orders not paid yet.
+
+        A paid order's hold is kept past its expiry until fulfillment consumes
+        it, however long the order waits in the job queue.
+        """
+        return ~exists().where(Payment.order_id == StockReservation.order_id, Payment.status == "completed")
+
+    @staticmethod
+    def release_expired(now=None, batch_size=500):
+        """Return the stock of expired holds of unpaid orders; commits per batch. Returns the number released."""
+        now = now or datetime.utcnow()
+        released = 0
+        last_id = 0
+        while True:
+            expired = db.session.query(StockReservation.id, StockReservation.game_id, StockReservation.quantity).filter(
+                StockReservation.status == "held", StockReservation.expires_at < now,
+                StockReservation.id > last_id, InventoryService._expirable()
+            ).order_by(StockReservation.id).limit(batch_size).all()
+            if not expired:
+                break
+            last_id = expired[-1].id
+            for reservation in expired:
+                # Conditional so a concurrent consume() or payment and the sweeper cannot both win
+                result = db.session.execute(
+                    update(StockReservation)
+                    .where(StockReservation.id == reservation.id, StockReservation.status == "held",
+                           InventoryService._expirable())
+                    .values(status="released")
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    InventoryService.restock(reservation.game_id, reservation.quantity)
+                    released += 1
+            db.session.commit()
+        return released
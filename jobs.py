@@ -0,0 +1,214 @@
+import json
+import os
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert, update, or_, and_
+from models import db, Job
+
+_HANDLERS = {}
+
+class JobQueue:
+    """Durable job queue stored in the job table.
+
+    enqueue() only adds a row to the caller's session, so a job commits (or
+    rolls back) together with the work that produced it. Workers claim jobs
+    with a conditional UPDATE and hold them for a visibility timeout; a job
+    whose worker died is claimable again once the timeout passes.
+    Handlers must therefore be idempotent.
+    """
+
+    @staticmethod
+    def handler(kind, batch=False):
+        """Register the function run for jobs of `kind`.
+
+        It receives the decoded payload, or with `batch` the list of payloads of
+        every job of that kind claimed together, and then returns a list with
+        None (done) or an error message for each of them.
+        """
+        def register(func):
+            _HANDLERS[kind] = (func, batch)
+            return func
+        return register
+
+    @staticmethod
+    def enqueue(kind, payload, delay=0, max_attempts=None, dedupe_key=None):
+        """Queue a job in the current transaction; the caller commits.
+
+        With a `dedupe_key` the job is dropped if one with that key was
+        queued before (whatever its status), and None is returned.
+        """
+        if dedupe_key is not None:
+            JobQueue.enqueue_many(kind, [payload], delay, dedupe_keys=[dedupe_key])
+            return None
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload),
+            status="queued",
+            attempts=0,
+            max_attempts=max_attempts or current_app.config.get("JOB_MAX_ATTEMPTS", 5),
+            run_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        db.session.add(job)
+        return job
+
+    @staticmethod
+    def enqueue_many(kind, payloads, delay=0, dedupe_keys=None):
+        """enqueue() for many jobs of one kind in a single INSERT; the caller commits.
+
+        `dedupe_keys`, one per payload, drop the jobs whose key was queued before.
+        """
+        if not payloads:
+            return
+        now = datetime.utcnow()
+        max_attempts = current_app.config.get("JOB_MAX_ATTEMPTS", 5)
+        rows = [{"kind": kind, "payload": json.dumps(payload), "status": "queued", "attempts": 0,
+                 "max_attempts": max_attempts, "run_at": now + timedelta(seconds=delay), "dedupe_key": key}
+                for payload, key in zip(payloads, dedupe_keys or [None] * len(payloads))]
+        dialect = db.engine.dialect.name
+        if dedupe_keys is None:
+            statement = insert(Job)
+        elif dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            statement = dialect_insert(Job.__table__).on_conflict_do_nothing(index_elements=["dedupe_key"])
+        else:
+            queued = {key for (key,) in db.session.query(Job.dedupe_key).filter(Job.dedupe_key.in_(dedupe_keys))}
+            rows = [row for row in rows if row["dedupe_key"] not in queued]
+            statement = insert(Job)
+        if rows:
+            db.session.execute(statement, rows)
+
+    @staticmethod
+    def worker_id():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def _claimable(now):
+        return or_(
+            and_(Job.status == "queued", Job.run_at <= now),
+            and_(Job.status == "running", Job.locked_until < now), # Worker crashed or stalled
+        )
+
+    @staticmethod
+    def claim(worker_id, limit=10, visibility_timeout=None, now=None):
+        """Claim up to `limit` due jobs for `worker_id`; commits and returns their ids"""
+        now = now or datetime.utcnow()
+        visibility_timeout = visibility_timeout or current_app.config.get("JOB_VISIBILITY_TIMEOUT", 900)
+        candidates = [row.id for row in db.session.query(Job.id).filter(JobQueue._claimable(now))
+                      .order_by(Job.run_at, Job.id).limit(limit)]
+        claimed = []
+        for job_id in candidates:
+            # Only one worker can move a given job out of the claimable state
+            result = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, JobQueue._claimable(now))
+                .values(status="running", locked_by=worker_id,
+                        locked_until=now + timedelta(seconds=visibility_timeout),
+                        attempts=Job.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(job_id)
+        db.session.commit()
+        return claimed
+
+    @staticmethod
+    def complete(job_id, worker_id):
+        """Mark a claimed job done; False if the claim was lost to another worker"""
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "running", Job.locked_by == worker_id)
+            .values(status="done", locked_until=None, last_error=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def fail(job_id, worker_id, error):
+        """Schedule a retry with exponential backoff, or park the job as failed after max_attempts"""
+        job = db.session.get(Job, job_id, populate_existing=True)
+        if job is None or job.status != "running" or job.locked_by != worker_id:
+            db.session.rollback()
+            return False
+        backoff = current_app.config.get("JOB_RETRY_BACKOFF", 30) * 2 ** (job.attempts - 1)
+        final = job.attempts >= job.max_attempts
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "running", Job.locked_by == worker_id)
+            .values(status="failed" if final else "queued", locked_by=None, locked_until=None,
+                    run_at=datetime.utcnow() + timedelta(seconds=backoff), last_error=error)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def run_job(job_id, worker_id):
+        """Run one claimed job and record the outcome; returns True if it succeeded"""
+        job = db.session.get(Job, job_id, populate_existing=True)
+        handler, _ = _HANDLERS.get(job.kind, (None, False))
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job.kind}'")
+            handler(json.loads(job.payload))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Job %s (%s) failed", job_id, job.kind)
+            JobQueue.fail(job_id, worker_id, traceback.format_exc())
+            return False
+        return JobQueue.complete(job_id, worker_id)
+
+    @staticmethod
+    def run_batch(job_ids, worker_id):
+        """Run claimed jobs of one batch handler kind in a single call; returns the number that succeeded"""
+        jobs = db.session.query(Job.id, Job.kind, Job.payload).filter(Job.id.in_(job_ids)).order_by(Job.id).all()
+        handler, _ = _HANDLERS[jobs[0].kind]
+        try:
+            errors = handler([json.loads(job.payload) for job in jobs])
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Jobs %s (%s) failed", job_ids, jobs[0].kind)
+            errors = [traceback.format_exc()] * len(jobs)
+        succeeded = 0
+        for job, error in zip(jobs, errors):
+            if error is None:
+                succeeded += JobQueue.complete(job.id, worker_id)
+            else:
+                JobQueue.fail(job.id, worker_id, error)
+        return succeeded
+
+    @staticmethod
+    def run_claimed(job_ids, worker_id):
+        """Run claimed jobs, handing jobs of batch kinds to their handler together"""
+        batches = {}
+        for job in db.session.query(Job.id, Job.kind).filter(Job.id.in_(job_ids)).order_by(Job.id):
+            if _HANDLERS.get(job.kind, (None, False))[1]:
+                batches.setdefault(job.kind, []).append(job.id)
+            else:
+                JobQueue.run_job(job.id, worker_id)
+        for batch_ids in batches.values():
+            JobQueue.run_batch(batch_ids, worker_id)
+
+    @staticmethod
+    def work(worker_id=None, batch_size=10, poll_interval=1.0, once=False):
+        """Claim and run jobs until interrupted (or until the queue is empty when `once`).
+
+        Returns the number of jobs processed.
+        """
+        worker_id = worker_id or JobQueue.worker_id()
+        processed = 0
+        while True:
+            job_ids = JobQueue.claim(worker_id, limit=batch_size)
+            if job_ids:
+                JobQueue.run_claimed(job_ids, worker_id)
+                processed += len(job_ids)
+            elif once:
+                return processed
+            else:
+                time.sleep(poll_interval)
@@ -0,0 +1,249 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from email.message import EmailMessage
+from email.utils import make_msgid
+from flask import current_app
+
+ORDER_CONFIRMATION_TEMPLATE = "email_order_confirmation.html"
+
+class MailBackpressure(Exception):
+    """Raised when the outbox stays full for longer than the caller is willing to wait"""
+
+class SMTPConnectionPool:
+    """Up to `size` persistent SMTP connections shared by the threads of one worker process.
+
+    Connections are reused across messages; one idle for longer than
+    `max_idle` seconds is checked with NOOP before reuse and replaced if the
+    server has dropped it.
+    """
+
+    def __init__(self, host, port, use_tls=False, username=None, password=None, size=2, timeout=30, max_idle=60):
+        self.host, self.port, self.use_tls = host, port, use_tls
+        self.username, self.password = username, password
+        self.timeout, self.max_idle = timeout, max_idle
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = [] # [(connection, last_used)]
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            connection.starttls()
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        return connection
+
+    def _is_alive(self, connection):
+        try:
+            return connection.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it goes back to the pool unless the block raised an SMTP error"""
+        self._slots.acquire()
+        connection = None
+        try:
+            with self._lock:
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+            if connection is not None and time.monotonic() - last_used > self.max_idle \
+                    and not self._is_alive(connection):
+                self._discard(connection)
+                connection = None
+            if connection is None:
+                connection = self._connect()
+            yield connection
+        except (smtplib.SMTPServerDisconnected, OSError):
+            if connection is not None:
+                self._discard(connection)
+                connection = None
+            raise
+        finally:
+            if connection is not None:
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+            self._slots.release()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            try:
+                connection.quit()
+            except Exception:
+                self._discard(connection)
+
+class Mailer:
+    """Sends EmailMessages over pooled SMTP connections.
+
+    send_many() delivers a batch synchronously on one connection. submit()
+    hands a message to background sender threads through a bounded outbox
+    and returns a Future; when the senders fall behind, submit() blocks and
+    then raises MailBackpressure instead of letting the backlog grow without limit.
+    Without MAIL_SERVER, messages are logged instead of sent.
+    """
+
+    def __init__(self, config):
+        self.batch_size = config.get("MAIL_BATCH_SIZE", 50)
+        self.pool = None
+        if config.get("MAIL_SERVER"):
+            self.pool = SMTPConnectionPool(
+                config["MAIL_SERVER"], config.get("MAIL_PORT", 25),
+                use_tls=config.get("MAIL_USE_TLS", False),
+                username=config.get("MAIL_USERNAME"), password=config.get("MAIL_PASSWORD"),
+                size=config.get("MAIL_POOL_SIZE", 2))
+        self._outbox = queue.Queue(maxsize=config.get("MAIL_QUEUE_SIZE", 1000))
+        self._sender_count = config.get("MAIL_POOL_SIZE", 2)
+        self._senders = []
+        self._start_lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def send_many(self, messages):
+        """Send a batch on one pooled connection; returns a list of None (sent) or the exception per message"""
+        if self.pool is None:
+            for message in messages:
+                print(f"Email (not sent, MAIL_SERVER unset) to {message['To']}: {message['Subject']}")
+            return [None] * len(messages)
+        results = []
+        pending = list(messages)
+        for attempt in range(2): # A dropped connection is retried once on a fresh one
+            try:
+                with self.pool.connection() as connection:
+                    while pending:
+                        try:
+                            connection.send_message(pending[0])
+                            results.append(None)
+                        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                                smtplib.SMTPDataError) as e:
+                            results.append(e) # Rejected message; the connection is still usable
+                        pending.pop(0)
+                break
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                if attempt == 1:
+                    results.extend([e] * len(pending))
+        return results
+
+    def submit(self, message, timeout=None):
+        """Queue a message for the background senders; returns a Future resolving to None or an exception"""
+        self._ensure_senders()
+        future = Future()
+        try:
+            self._outbox.put((message, future), timeout=timeout)
+        except queue.Full:
+            raise MailBackpressure(f"Mail outbox full ({self._outbox.maxsize} messages)")
+        return future
+
+    def _ensure_senders(self):
+        with self._start_lock:
+            if self._senders:
+                return
+            for _ in range(self._sender_count):
+                thread = threading.Thread(target=self._send_loop, daemon=True)
+                thread.start()
+                self._senders.append(thread)
+
+    def _send_loop(self):
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                return
+            batch = [item]
+            # Drain whatever else is waiting, up to one batch, onto the same connection
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._outbox.put(None)
+                    break
+                batch.append(item)
+            try:
+                results = self.send_many([message for message, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        """Stop the sender threads after the outbox drains and close pooled connections"""
+        for _ in self._senders:
+            self._outbox.put(None)
+        for thread in self._senders:
+            thread.join()
+        self._senders = []
+        if self.pool is not None:
+            self.pool.close()
+
+def get_mailer():
+    """The mailer of this worker process, created on first use"""
+    mailer = current_app.extensions.get("mailer")
+    if mailer is None or mailer.pid != os.getpid(): # Sockets and threads do not survive a fork
+        mailer = current_app.extensions["mailer"] = Mailer(current_app.config)
+    return mailer
+
+def _order_confirmation_template():
+    template = current_app.extensions.get("order_confirmation_template")
+    if template is None:
+        # Compiled once per worker instead of per message
+        template = current_app.extensions["order_confirmation_template"] = \
+            current_app.jinja_env.get_template(ORDER_CONFIRMATION_TEMPLATE)
+    return template
+
+def load_order_items(order_ids):
+    """{order_id: [(OrderItem, game name, codes)]} for the given orders.
+
+    `codes` lists every code delivered for the item: its vault codes for games
+    stocked with supplier codes, otherwise the generated code (if any).
+    """
+    from models import db, OrderItem, Game, VaultCode
+    items = {order_id: [] for order_id in order_ids}
+    rows = (db.session.query(OrderItem, Game.name, Game.uses_code_vault).join(Game)
+            .filter(OrderItem.order_id.in_(order_ids)).order_by(OrderItem.order_id, OrderItem.id)).all()
+    vault_codes = {}
+    vault_item_ids = [item.id for item, _, uses_vault in rows if uses_vault]
+    if vault_item_ids:
+        for order_item_id, code in (db.session.query(VaultCode.order_item_id, VaultCode.code)
+                                    .filter(VaultCode.order_item_id.in_(vault_item_ids)).order_by(VaultCode.id)):
+            vault_codes.setdefault(order_item_id, []).append(code)
+    for item, game_name, _ in rows:
+        codes = vault_codes.get(item.id) or ([item.code] if item.code else [])
+        items[item.order_id].append((item, game_name, codes))
+    return items
+
+def build_order_confirmation(user, orders, items=None, message_id=None):
+    """EmailMessage confirming one or more orders of `user`, with their codes.
+
+    `items` is the load_order_items() mapping for the orders; it is loaded if omitted.
+    """
+    items = items if items is not None else load_order_items([order.id for order in orders])
+    message = EmailMessage()
+    if len(orders) == 1:
+        message["Subject"] = f"تأكيد الطلب وشحن الأكواد - الطلب #{orders[0].id}"
+    else:
+        message["Subject"] = f"تأكيد الطلبات وشحن الأكواد - {len(orders)} طلبات"
+    message["From"] = current_app.config.get("MAIL_DEFAULT_SENDER", "noreply@example.com")
+    message["To"] = user.email
+    message["Message-ID"] = message_id or make_msgid(domain="gameshipping.com")
+    lines = []
+    for order in orders:
+        lines.append(f"#{order.id}")
+        for item, game_name, codes in items.get(order.id, []):
+            lines.append(f"- {game_name} x{item.quantity}: {', '.join(codes) or item.game_account_id or ''}")
+    message.set_content("\n".join(lines))
+    message.add_alternative(_order_confirmation_template().render(user=user, orders=orders, items=items),
+                            subtype="html")
+    return message
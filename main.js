@@ -4,15 +4,11 @@ $(document).ready(function() {
     // Function to update the cart count in the navbar
     function updateCartCount() {
         $.ajax({
-            url: "/api/cart", // Use the API endpoint to get cart data
+            url: "/api/cart/count", // Counter kept on the cart row; no need to download the items
             type: "GET",
             success: function(response) {
-                if (response.success && response.data && response.data.items) {
-                    let itemCount = 0;
-                    response.data.items.forEach(item => {
-                        itemCount += item.quantity;
-                    });
-                    $("#cart-count").text(itemCount);
+                if (response.success && response.data) {
+                    $("#cart-count").text(response.data.item_count);
                 } else {
                     $("#cart-count").text(0);
                 }
@@ -1,7 +1,7 @@
 # Remove local db definition, import from app
 # from flask_sqlalchemy import SQLAlchemy 
 from flask_login import UserMixin # Keep UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import get_password_hasher
 from datetime import datetime
 
 # Import the shared db instance from app.py
@@ -25,16 +25,28 @@ class User(UserMixin, db.Model):
     cart = db.relationship("Cart", backref="customer", uselist=False) # One-to-one relationship
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_password_hasher().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_password_hasher().verify(self.password_hash, password)
+
+    def check_password_and_upgrade(self, password):
+        """check_password() that also rehashes a correct password stored with outdated KDF parameters.
+
+        The new hash is only set on the object; the caller commits.
+        """
+        if not self.check_password(password):
+            return False
+        if get_password_hasher().needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def __repr__(self):
         return f"<User {self.username}>"
 
 class Game(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64), unique=True, index=True, nullable=True) # Supplier SKU, the key of catalog feeds
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.Text)
     price = db.Column(db.Float, nullable=False)
@@ -44,7 +56,9 @@ class Game(db.Model):
     region = db.Column(db.String(64)) # e.g., global, NA, EU
     stock = db.Column(db.Integer, default=0)
     is_active = db.Column(db.Boolean, default=True)
+    uses_code_vault = db.Column(db.Boolean, default=False) # Deliver supplier codes from the vault instead of generating them
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     order_items = db.relationship("OrderItem", backref="game", lazy="dynamic")
@@ -60,22 +74,30 @@ class Order(db.Model):
     total_amount = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    claim_token = db.Column(db.String(64), nullable=True, index=True) # Fulfillment run currently working on the order
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    confirmation_email_id = db.Column(db.String(255), nullable=True, index=True) # Message-ID of the confirmation email
     
     # Relationships
     items = db.relationship("OrderItem", backref="order", lazy="dynamic", cascade="all, delete-orphan")
     payment = db.relationship("Payment", backref="order", uselist=False, cascade="all, delete-orphan") # One-to-one
 
+    __table_args__ = (
+        db.Index("ix_order_user_id_created_at", "user_id", "created_at"), # Order history pages
+        db.Index("ix_order_status_id", "status", "id"), # Pending fulfillment keyset scan
+    )
+
     def __repr__(self):
         return f"<Order {self.id}>"
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False, index=True)
     game_id = db.Column(db.Integer, db.ForeignKey("game.id"), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False) # Price at the time of order
     status = db.Column(db.String(64), default="pending") # e.g., pending, fulfilled, failed
-    code = db.Column(db.String(256), nullable=True) # Digital code if applicable
+    code = db.Column(db.String(256), nullable=True, unique=True, index=True) # Digital code if applicable
     game_account_id = db.Column(db.String(128), nullable=True) # Game account ID for direct credit
 
     def __repr__(self):
@@ -83,7 +105,7 @@ class OrderItem(db.Model):
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False, index=True)
     payment_method = db.Column(db.String(64)) # e.g., credit_card, paypal
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(64), default="pending") # e.g., pending, completed, failed
@@ -95,7 +117,10 @@ class Payment(db.Model):
 
 class Cart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    # Denormalized from the items, kept in step by CartService so the navbar count reads one row
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Float, nullable=False, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -113,6 +138,116 @@ class CartItem(db.Model):
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
     game_account_id = db.Column(db.String(128), nullable=True) # Optional game account ID for pre-filling checkout
 
+    __table_args__ = (
+        db.UniqueConstraint("cart_id", "game_id", name="uq_cart_item_cart_id_game_id"), # One line per game
+    )
+
     def __repr__(self):
         return f"<CartItem {self.id} for Cart {self.cart_id}>"
 
+class StockReservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey("game.id"), nullable=False, index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=True, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(32), default="held") # e.g., held, consumed, released
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_stock_reservation_status_expires_at", "status", "expires_at"), # Sweeper lookup
+    )
+
+    def __repr__(self):
+        return f"<StockReservation {self.id} {self.quantity}x Game {self.game_id} ({self.status})>"
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False) # e.g., fulfill_order
+    payload = db.Column(db.Text, nullable=False) # JSON arguments for the handler
+    status = db.Column(db.String(32), default="queued") # e.g., queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow) # Not claimable before this time
+    locked_by = db.Column(db.String(128), nullable=True) # Worker currently holding the job
+    locked_until = db.Column(db.DateTime, nullable=True) # Visibility timeout of the current claim
+    last_error = db.Column(db.Text, nullable=True)
+    dedupe_key = db.Column(db.String(255), nullable=True, unique=True, index=True) # Same key queued again is dropped
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_job_status_run_at", "status", "run_at"), # Claim lookup
+        db.Index("ix_job_status_locked_until", "status", "locked_until"), # Crash recovery lookup
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} ({self.status})>"
+
+class CodeSequence(db.Model):
+    prefix = db.Column(db.String(16), primary_key=True) # Code prefix, e.g., PUBG
+    next_value = db.Column(db.BigInteger, nullable=False, default=0) # First counter value not yet leased
+
+    def __repr__(self):
+        return f"<CodeSequence {self.prefix} at {self.next_value}>"
+
+class VaultCode(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey("game.id"), nullable=False)
+    code = db.Column(db.String(256), nullable=False) # Supplier voucher code
+    status = db.Column(db.String(32), nullable=False, default="available") # e.g., available, allocated
+    order_item_id = db.Column(db.Integer, db.ForeignKey("order_item.id"), nullable=True, index=True)
+    source = db.Column(db.String(128), nullable=True) # Import file the code came from
+    imported_at = db.Column(db.DateTime, default=datetime.utcnow)
+    allocated_at = db.Column(db.DateTime, nullable=True)
+
+    order_item = db.relationship("OrderItem", backref=db.backref("vault_codes", lazy="dynamic", order_by="VaultCode.id"))
+
+    __table_args__ = (
+        db.UniqueConstraint("game_id", "code", name="uq_vault_code_game_id_code"), # Dedupe on import
+        db.Index("ix_vault_code_game_id_status_id", "game_id", "status", "id"), # Allocation scan
+    )
+
+    def __repr__(self):
+        return f"<VaultCode {self.id} for Game {self.game_id} ({self.status})>"
+
+class IdempotencyKey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    key = db.Column(db.String(255), nullable=False) # Client's Idempotency-Key header
+    fingerprint = db.Column(db.String(64), nullable=False) # SHA-256 of method, path and body
+    status = db.Column(db.String(32), nullable=False, default="in_progress") # e.g., in_progress, completed
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    content_type = db.Column(db.String(128), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False) # Lock timeout while in progress, replay TTL once completed
+
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "key", name="uq_idempotency_key_user_id_key"), # One claim per key
+        db.Index("ix_idempotency_key_expires_at", "expires_at"), # Purge scan
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} for User {self.user_id} ({self.status})>"
+
+class SalesDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True) # Day the orders were placed
+    order_count = db.Column(db.Integer, nullable=False, default=0) # Completed orders
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<SalesDaily {self.day}>"
+
+class SalesDailyGame(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey("game.id"), primary_key=True)
+    game_type = db.Column(db.String(64), nullable=True) # Copied from the game, for per-type breakdowns
+    region = db.Column(db.String(64), nullable=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0) # Completed orders containing the game
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<SalesDailyGame {self.day} Game {self.game_id}>"
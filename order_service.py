@@ -0,0 +1,140 @@
+from sqlalchemy import func, insert, delete
+from sqlalchemy.orm import aliased, joinedload
+from models import db, Game, Cart, CartItem, Order, OrderItem, Payment, VaultCode
+from cart_service import CartService
+from inventory import InventoryService
+from jobs import JobQueue
+from pagination import apply_keyset, finish_page, DEFAULT_PAGE_SIZE
+
+class OrderService:
+    """Service for placing and reading customer orders"""
+
+    @staticmethod
+    def create_from_cart(user_id, payment_method):
+        """Turn a user's cart into a paid, pending order; returns the Order, or None if the cart is empty.
+
+        The statement count does not grow with the cart: one query reads the
+        items with their current prices, one executemany inserts the order
+        items and stock is held per game. The payment, the emptied cart and the
+        fulfillment job are written in the same transaction, which the caller
+        commits (or rolls back on InsufficientStock).
+        """
+        rows = (
+            db.session.query(CartItem.cart_id, CartItem.game_id, CartItem.quantity, CartItem.game_account_id, Game.price)
+            .join(Cart, Cart.id == CartItem.cart_id)
+            .join(Game, Game.id == CartItem.game_id)
+            .filter(Cart.user_id == user_id)
+            .order_by(CartItem.id)
+            .all()
+        )
+        if not rows:
+            return None
+        cart_id = rows[0].cart_id
+
+        quantities = {}
+        for row in rows:
+            quantities[row.game_id] = quantities.get(row.game_id, 0) + row.quantity
+        total_amount = round(sum(row.quantity * row.price for row in rows), 2)
+
+        order = Order(user_id=user_id, total_amount=total_amount, status="pending")
+        db.session.add(order)
+        db.session.flush() # Get the order ID before creating items
+
+        db.session.execute(insert(OrderItem), [
+            {"order_id": order.id, "game_id": row.game_id, "quantity": row.quantity,
+             "price": row.price, # Price at the time of order
+             "game_account_id": row.game_account_id, "status": "pending"}
+            for row in rows
+        ])
+        # Hold the stock for this order; fulfillment turns the holds into decrements
+        InventoryService.reserve(order.id, quantities)
+
+        # Placeholder payment until a real gateway confirms it through a callback
+        db.session.add(Payment(order_id=order.id, payment_method=payment_method, amount=total_amount,
+                               status="completed", transaction_id=f"FAKE_TRANS_{order.id}"))
+        db.session.execute(delete(CartItem).where(CartItem.cart_id == cart_id)
+                           .execution_options(synchronize_session=False))
+        CartService.reset_counters(cart_id)
+
+        # Fulfillment (codes, stock, email) runs on a `flask shipping worker`; the job
+        # commits with the order so it can be neither lost nor run for a rolled back order
+        JobQueue.enqueue("fulfill_order", {"order_id": order.id})
+        return order
+
+    @staticmethod
+    def get_order_history_page(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """Return one keyset page of a user's orders, newest first.
+
+        The page of orders and their item counts come from a single statement:
+        the grouped item-count subquery only aggregates the ids on the page,
+        so the cost is fixed however long the history is.
+        Returns ([(order, items_count), ...], next_cursor).
+        """
+        page = apply_keyset(
+            db.session.query(Order).filter(Order.user_id == user_id),
+            [Order.created_at, Order.id],
+            cursor=cursor,
+            limit=limit,
+        ).subquery()
+        page_order = aliased(Order, page)
+
+        counts = (
+            db.session.query(OrderItem.order_id, func.count(OrderItem.id).label("items_count"))
+            .filter(OrderItem.order_id.in_(db.session.query(page.c.id)))
+            .group_by(OrderItem.order_id)
+            .subquery()
+        )
+        rows = (
+            db.session.query(page_order, func.coalesce(counts.c.items_count, 0))
+            .outerjoin(counts, counts.c.order_id == page_order.id)
+            .order_by(page_order.created_at.desc(), page_order.id.desc())
+            .all()
+        )
+        return finish_page(rows, limit, key=lambda row: (row[0].created_at, row[0].id))
+
+    @staticmethod
+    def get_detail(order_id, user_id):
+        """Load one of a user's orders for its detail page in three queries, however many items it has.
+
+        The order comes with its payment, the items with their games, and
+        the vault codes of all the items from one query. The codes listed for
+        an item are its vault codes for games stocked with supplier codes,
+        otherwise its generated code (if any), as in load_order_items().
+        Returns (order, items, {item_id: [code, ...]}), or None if the user has no such order.
+        """
+        order = (
+            db.session.query(Order).options(joinedload(Order.payment))
+            .filter(Order.id == order_id, Order.user_id == user_id)
+            .first()
+        )
+        if order is None:
+            return None
+        items = (
+            db.session.query(OrderItem).options(joinedload(OrderItem.game))
+            .filter(OrderItem.order_id == order.id)
+            .order_by(OrderItem.id)
+            .all()
+        )
+        vault_codes = {}
+        if any(item.game.uses_code_vault for item in items):
+            for item_id, code in (
+                db.session.query(VaultCode.order_item_id, VaultCode.code)
+                .join(OrderItem, OrderItem.id == VaultCode.order_item_id)
+                .filter(OrderItem.order_id == order.id)
+                .order_by(VaultCode.id)
+            ):
+                vault_codes.setdefault(item_id, []).append(code)
+        codes = {item.id: vault_codes.get(item.id, []) if item.game.uses_code_vault
+                 else ([item.code] if item.code else []) for item in items}
+        return order, items, codes
+
+    @staticmethod
+    def serialize_summary(order, items_count):
+        """Order fields shown in the order history list"""
+        return {
+            "id": order.id,
+            "status": order.status,
+            "total_amount": order.total_amount,
+            "created_at": order.created_at.isoformat(),
+            "items_count": items_count
+        }
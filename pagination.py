@@ -0,0 +1,99 @@
+import base64
+import json
+from datetime import datetime
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# What encode_cursor writes for a sort key once _decode_value has restored datetimes
+_CURSOR_VALUE_TYPES = (str, int, float, datetime, type(None))
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+def encode_cursor(values):
+    """Encode the sort-key values of the last row on a page into an opaque token"""
+    payload = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(token, size):
+    """Decode a token produced by encode_cursor, checking it has `size` values"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Cursor does not match the requested sort order")
+    try:
+        values = [_decode_value(v) for v in values]
+    except (ValueError, TypeError, AttributeError, KeyError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    if not all(isinstance(v, _CURSOR_VALUE_TYPES) for v in values):
+        raise InvalidCursor("Cursor values must be scalars")
+    return values
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a user supplied page size to [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+def keyset_condition(columns, values, descending=True):
+    """Build the WHERE clause selecting rows strictly after `values` in (columns) order.
+
+    Expands to (a < x) OR (a = x AND b < y) ... which every backend can serve
+    from a composite index on the same columns.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+def apply_keyset(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=True):
+    """Filter, order and limit `query` for one keyset page.
+
+    One extra row is fetched so finish_page can tell whether a next page exists.
+    """
+    if cursor:
+        values = decode_cursor(cursor, len(columns))
+        query = query.filter(keyset_condition(columns, values, descending))
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    return query.order_by(*ordering).limit(limit + 1)
+
+def finish_page(rows, limit, key):
+    """Trim the look-ahead row and build the cursor for the following page.
+
+    `key` maps a row to the tuple of values for the keyset columns.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(key(rows[-1])) if has_more and rows else None
+    return rows, next_cursor
+
+class CachedPagination(Pagination):
+    """Offset pagination over items and a total that were loaded ahead of time
+    (e.g. from a cache), so rendering a page runs no queries.
+    """
+
+    def _query_items(self):
+        return self._query_args["items"]
+
+    def _query_count(self):
+        return self._query_args["total"]
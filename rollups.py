@@ -0,0 +1,143 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, insert, update, delete
+from models import db, Game, Order, OrderItem, SalesDaily, SalesDailyGame
+
+MEASURES = ("order_count", "units", "revenue")
+
+def _add_to_rollup(model, key_columns, rows):
+    """Add the measures of `rows` to the rollup rows with the same key, creating the missing ones"""
+    if not rows:
+        return
+    dialect = db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(model)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={name: model.__table__.c[name] + statement.excluded[name] for name in MEASURES}), rows)
+        return
+    for row in rows:
+        result = db.session.execute(
+            update(model)
+            .where(*[getattr(model, column) == row[column] for column in key_columns])
+            .values({name: getattr(model, name) + row[name] for name in MEASURES})
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 0:
+            db.session.execute(insert(model).values(**row))
+
+class SalesRollup:
+    """Per-day sales aggregates the admin dashboard reads instead of scanning orders.
+
+    sales_daily holds completed orders, units and revenue per day (the day the
+    order was placed); sales_daily_game breaks the same figures down per game,
+    with the game's type and region copied in for per-type and per-region
+    totals. Fulfillment adds each order once, in the transaction that marks it
+    completed; rebuild() recomputes them from the orders.
+    """
+
+    @staticmethod
+    def record_completed(order_ids):
+        """Add newly completed orders to the rollups; the caller commits"""
+        if not order_ids:
+            return
+        rows = (
+            db.session.query(Order.id, Order.created_at, OrderItem.game_id, Game.game_type, Game.region,
+                             func.sum(OrderItem.quantity), func.sum(OrderItem.quantity * OrderItem.price))
+            .join(OrderItem, OrderItem.order_id == Order.id)
+            .join(Game, Game.id == OrderItem.game_id)
+            .filter(Order.id.in_(list(order_ids)))
+            .group_by(Order.id, Order.created_at, OrderItem.game_id, Game.game_type, Game.region)
+            .all()
+        )
+        daily = defaultdict(lambda: {"orders": set(), "units": 0, "revenue": 0.0})
+        per_game = {}
+        for order_id, created_at, game_id, game_type, region, units, revenue in rows:
+            day = created_at.date()
+            daily[day]["orders"].add(order_id)
+            daily[day]["units"] += units
+            daily[day]["revenue"] += revenue
+            entry = per_game.setdefault((day, game_id), {
+                "day": day, "game_id": game_id, "game_type": game_type, "region": region,
+                "order_count": 0, "units": 0, "revenue": 0.0})
+            entry["order_count"] += 1 # Rows are grouped per order and game
+            entry["units"] += units
+            entry["revenue"] += revenue
+
+        _add_to_rollup(SalesDaily, ["day"], [
+            {"day": day, "order_count": len(totals["orders"]), "units": totals["units"],
+             "revenue": round(totals["revenue"], 2)}
+            for day, totals in sorted(daily.items())])
+        for entry in per_game.values():
+            entry["revenue"] = round(entry["revenue"], 2)
+        _add_to_rollup(SalesDailyGame, ["day", "game_id"], [per_game[key] for key in sorted(per_game)])
+
+    @staticmethod
+    def rebuild(since=None, batch_size=5000):
+        """Recompute the rollups from completed orders (placed on or after `since`, a date); returns the orders counted.
+
+        Runs in the caller's transaction, so readers see the old figures until it commits.
+        """
+        daily, per_game = delete(SalesDaily), delete(SalesDailyGame)
+        orders = db.session.query(Order.id).filter(Order.status == "completed")
+        if since is not None:
+            daily, per_game = daily.where(SalesDaily.day >= since), per_game.where(SalesDailyGame.day >= since)
+            orders = orders.filter(Order.created_at >= datetime.combine(since, datetime.min.time()))
+        db.session.execute(daily)
+        db.session.execute(per_game)
+
+        counted, last_id = 0, 0
+        while True:
+            order_ids = [order_id for (order_id,) in
+                         orders.filter(Order.id > last_id).order_by(Order.id).limit(batch_size)]
+            if not order_ids:
+                return counted
+            SalesRollup.record_completed(order_ids)
+            counted += len(order_ids)
+            last_id = order_ids[-1]
+
+    @staticmethod
+    def dashboard(days=30, today=None, top=10):
+        """Dashboard figures for the last `days` days; reads O(days x games) rollup rows, never the orders"""
+        start = (today or date.today()) - timedelta(days=days - 1)
+        daily = [
+            {"day": row.day.isoformat(), "orders": row.order_count, "units": row.units, "revenue": round(row.revenue, 2)}
+            for row in SalesDaily.query.filter(SalesDaily.day >= start).order_by(SalesDaily.day)
+        ]
+
+        def breakdown(column):
+            return [
+                {"name": name, "units": int(units), "revenue": round(revenue, 2)}
+                for name, units, revenue in db.session.query(
+                    column, func.sum(SalesDailyGame.units), func.sum(SalesDailyGame.revenue))
+                .filter(SalesDailyGame.day >= start)
+                .group_by(column)
+                .order_by(func.sum(SalesDailyGame.revenue).desc())
+            ]
+
+        top_games = [
+            {"game_id": game_id, "name": name, "orders": int(orders), "units": int(units), "revenue": round(revenue, 2)}
+            for game_id, name, orders, units, revenue in db.session.query(
+                SalesDailyGame.game_id, Game.name, func.sum(SalesDailyGame.order_count),
+                func.sum(SalesDailyGame.units), func.sum(SalesDailyGame.revenue))
+            .join(Game, Game.id == SalesDailyGame.game_id)
+            .filter(SalesDailyGame.day >= start)
+            .group_by(SalesDailyGame.game_id, Game.name)
+            .order_by(func.sum(SalesDailyGame.revenue).desc())
+            .limit(top)
+        ]
+        return {
+            "days": days,
+            "daily": daily,
+            "totals": {
+                "orders": sum(row["orders"] for row in daily),
+                "units": sum(row["units"] for row in daily),
+                "revenue": round(sum(row["revenue"] for row in daily), 2),
+            },
+            "by_game_type": breakdown(SalesDailyGame.game_type),
+            "by_region": breakdown(SalesDailyGame.region),
+            "top_games": top_games,
+        }
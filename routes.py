@@ -1,14 +1,43 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+import io
+import json
+import click
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, flash, request, jsonify, abort, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
 from models import User, Game, Order, OrderItem, Payment, Cart, CartItem, db
 from forms import LoginForm, RegistrationForm, GameSearchForm, CheckoutForm, GameForm # Import GameForm
-from app import db # Import db from app
+from order_service import OrderService
+from admin_service import AdminListingService, ADMIN_ORDER_SORTS, ADMIN_USER_SORTS, ADMIN_GAME_SORTS
+from cart_service import CartService
+from catalog import CatalogService, CatalogCache
+from search import GameSearchIndex
+from hashing import HashingBusy
+from identity import load_user
+from db_routing import init_read_replicas, replica_reads, ReplicationLagSimulator
+from sql_accounting import init_sql_accounting, deliberate_repeats
+from idempotency import purge_expired_keys
+from export import OrderExport, EXPORT_FORMATS
+from rollups import SalesRollup
+from catalog_import import CatalogImport, read_feed, FEED_FORMATS, FEED_KEYS
+from app import db, login_manager # Import db from app
 
 # Create blueprints
 main_bp = Blueprint("main", __name__)
 auth_bp = Blueprint("auth", __name__)
 admin_bp = Blueprint("admin", __name__)
 
+@main_bp.record_once
+def _setup_read_replicas(state):
+    init_read_replicas(state.app)
+
+@main_bp.record_once
+def _setup_sql_accounting(state):
+    init_sql_accounting(state.app)
+
+@auth_bp.record_once
+def _use_cached_user_loader(state):
+    # Replaces app.load_user: sessions are resolved from the per-worker identity cache
+    login_manager.user_loader(load_user)
+
 # --- Authentication Routes ---
 
 @auth_bp.route("/register", methods=["GET", "POST"])
@@ -18,7 +47,11 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash("الخادم مشغول حالياً، يرجى المحاولة مرة أخرى بعد لحظات.", "warning")
+            return render_template("register.html", title="إنشاء حساب", form=form), 503, {"Retry-After": "2"}
         db.session.add(user)
         # Create a cart for the new user
         cart = Cart(customer=user)
@@ -35,9 +68,16 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user is None or not user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password_and_upgrade(form.password.data)
+        except HashingBusy:
+            flash("الخادم مشغول حالياً، يرجى المحاولة مرة أخرى بعد لحظات.", "warning")
+            return render_template("login.html", title="تسجيل الدخول", form=form), 503, {"Retry-After": "2"}
+        if not valid:
             flash("بريد إلكتروني أو كلمة مرور غير صالحة", "danger")
             return redirect(url_for("auth.login"))
+        if db.session.is_modified(user): # Password rehashed with the current KDF parameters
+            db.session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get("next")
         flash("تم تسجيل الدخول بنجاح.", "success")
@@ -55,23 +95,41 @@ def logout():
 
 @main_bp.route("/")
 @main_bp.route("/index")
+@replica_reads
 def index():
-    # Placeholder: Fetch some games for the homepage
-    games = Game.query.filter_by(is_active=True).limit(8).all()
+    games = CatalogService.get_featured_games(limit=8)
     return render_template("index.html", title="الصفحة الرئيسية", games=games)
 
 @main_bp.route("/games")
+@replica_reads
 def games():
-    # Placeholder: Fetch all active games
     page = request.args.get("page", 1, type=int)
-    games_pagination = Game.query.filter_by(is_active=True).paginate(page=page, per_page=12, error_out=False)
+    # Page items and the total both come from the shared catalog cache
+    games_pagination = CatalogService.get_games_listing(page, per_page=12)
     games = games_pagination.items
     return render_template("games.html", title="الألعاب", games=games, pagination=games_pagination)
 
+@main_bp.route("/search")
+@replica_reads
+def search():
+    form = GameSearchForm(request.args, meta={"csrf": False})
+    page = request.args.get("page", 1, type=int)
+    per_page = 12
+    games = []
+    if form.validate():
+        # Fetch one extra row to know whether a next page exists
+        games = GameSearchIndex.search(form.query.data, limit=per_page + 1, offset=(max(page, 1) - 1) * per_page)
+    has_next = len(games) > per_page
+    return render_template("search.html", title="بحث", form=form, games=games[:per_page],
+                           page=max(page, 1), has_next=has_next)
+
 @main_bp.route("/game/<int:id>")
+@replica_reads
 def game_detail(id):
-    game = Game.query.get_or_404(id)
-    return render_template("game_detail.html", title=game.name, game=game)
+    game = CatalogService.get_game(id)
+    if game is None:
+        abort(404)
+    return render_template("game_detail.html", title=game["name"], game=game)
 
 @main_bp.route("/cart")
 @login_required
@@ -97,17 +155,24 @@ def order_confirmation():
     return render_template("order_confirmation.html", title="تأكيد الطلب")
 
 @main_bp.route("/orders")
+@replica_reads
 @login_required
 def orders():
-    # Placeholder for user's order history
-    user_orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template("orders.html", title="طلباتي", orders=user_orders)
+    # First page of the order history; later pages are fetched from /api/orders with the cursor
+    rows, next_cursor = OrderService.get_order_history_page(current_user.id)
+    orders_data = [OrderService.serialize_summary(order, items_count) for order, items_count in rows]
+    return render_template("orders.html", title="طلباتي", orders=orders_data, next_cursor=next_cursor)
 
 @main_bp.route("/order/<int:id>")
+@replica_reads
 @login_required
 def order_detail(id):
-    order = Order.query.filter_by(id=id, user_id=current_user.id).first_or_404()
-    return render_template("order_detail.html", title=f"تفاصيل الطلب #{order.id}", order=order)
+    detail = OrderService.get_detail(id, current_user.id)
+    if detail is None:
+        abort(404)
+    order, items, codes = detail
+    return render_template("order_detail.html", title=f"تفاصيل الطلب #{order.id}", order=order, items=items,
+                           codes=codes)
 
 
 # --- Admin Routes (Placeholders for now) ---
@@ -127,10 +192,12 @@ def admin_required(f):
 @admin_bp.route("/")
 @admin_required
 def admin_index():
-    # Placeholder for admin dashboard
-    return render_template("admin/dashboard.html", title="لوحة تحكم المسؤول")
+    """Sales of the last `days` days (30 by default), read from the sales rollups"""
+    days = max(1, min(request.args.get("days", 30, type=int) or 30, 366))
+    return render_template("admin/dashboard.html", title="لوحة تحكم المسؤول", stats=SalesRollup.dashboard(days))
 
 @admin_bp.route("/games", methods=["GET", "POST"])
+@replica_reads
 @admin_required
 def admin_games():
     form = GameForm()
@@ -148,10 +215,15 @@ def admin_games():
         )
         db.session.add(game)
         db.session.commit()
+        CatalogCache.bump()
+        GameSearchIndex.index_games([game])
         flash("تمت إضافة اللعبة بنجاح!", "success")
         return redirect(url_for("admin.admin_games"))
-    games = Game.query.all()
-    return render_template("admin/games.html", title="إدارة الألعاب", games=games, form=form)
+    page, per_page, sort = AdminListingService.parse_paging(request.args, ADMIN_GAME_SORTS)
+    filters = AdminListingService.parse_game_filters(request.args)
+    pagination = AdminListingService.list_games(filters, sort, page, per_page)
+    return render_template("admin/games.html", title="إدارة الألعاب", games=pagination.items, pagination=pagination,
+                           filters=filters, sort=sort, sorts=ADMIN_GAME_SORTS, form=form)
 
 @admin_bp.route("/games/edit/<int:id>", methods=["GET", "POST"])
 @admin_required
@@ -159,8 +231,14 @@ def admin_edit_game(id):
     game = Game.query.get_or_404(id)
     form = GameForm(obj=game)
     if form.validate_on_submit():
+        old_price = game.price
         form.populate_obj(game)
+        if game.price != old_price:
+            db.session.flush()
+            CartService.rebuild_counters(game_id=game.id) # Cart subtotals follow the new price
         db.session.commit()
+        CatalogCache.bump()
+        GameSearchIndex.index_games([game])
         flash("تم تحديث اللعبة بنجاح!", "success")
         return redirect(url_for("admin.admin_games"))
     return render_template("admin/edit_game.html", title="تعديل اللعبة", form=form, game=game)
@@ -171,19 +249,145 @@ def admin_delete_game(id):
     game = Game.query.get_or_404(id)
     db.session.delete(game)
     db.session.commit()
+    CatalogCache.bump()
+    GameSearchIndex.remove_games([id])
     flash("تم حذف اللعبة بنجاح!", "success")
     return redirect(url_for("admin.admin_games"))
 
+def _feed_format(filename):
+    return "json" if filename.lower().endswith((".json", ".ndjson", ".jsonl")) else "csv"
+
+@admin_bp.route("/games/import", methods=["POST"])
+@admin_required
+def admin_import_games():
+    """Apply an uploaded supplier feed (`feed`: CSV, a JSON array or JSON lines) to the catalog.
+
+    Rows are matched to games by `key` (sku or id). The upload is read and
+    applied a batch at a time; the response is the import's report.
+    """
+    upload = request.files.get("feed")
+    if upload is None or not upload.filename:
+        return jsonify({"success": False, "message": "يرجى اختيار ملف التحديث."}), 400
+    fmt = request.form.get("format") or _feed_format(upload.filename)
+    key = request.form.get("key") or "sku"
+    if fmt not in FEED_FORMATS or key not in FEED_KEYS:
+        return jsonify({"success": False, "message": "صيغة الملف أو عمود المطابقة غير مدعوم."}), 400
+    try:
+        # Werkzeug spools large uploads to a temporary file, so the feed is never held in memory
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+        report = None
+        with deliberate_repeats(): # The same few statements run once per batch
+            for report in CatalogImport.run(read_feed(stream, fmt), key=key,
+                                            batch_size=current_app.config.get("CATALOG_IMPORT_BATCH_SIZE", 1000)):
+                pass
+        return jsonify({"success": True, "data": report})
+    except Exception as e:
+        print(f"Error importing catalog feed {upload.filename}: {e}")
+        return jsonify({"success": False, "message": "حدث خطأ أثناء استيراد ملف التحديث."}), 500
+
 @admin_bp.route("/orders")
+@replica_reads
 @admin_required
 def admin_orders():
-    # Placeholder for managing orders
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template("admin/orders.html", title="إدارة الطلبات", orders=orders)
+    page, per_page, sort = AdminListingService.parse_paging(request.args, ADMIN_ORDER_SORTS)
+    filters = AdminListingService.parse_order_filters(request.args)
+    pagination, items_counts = AdminListingService.list_orders(filters, sort, page, per_page)
+    return render_template("admin/orders.html", title="إدارة الطلبات", orders=pagination.items, pagination=pagination,
+                           items_counts=items_counts, filters=filters, sort=sort, sorts=ADMIN_ORDER_SORTS)
+
+@admin_bp.route("/orders/export")
+@replica_reads
+@admin_required
+def admin_export_orders():
+    """Download orders, items and payments as CSV or NDJSON (`format`), gzipped with gzip=1.
+
+    Takes the same status/date_from/date_to filters as the orders listing.
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    compress = request.args.get("gzip") == "1"
+    filters = AdminListingService.parse_order_filters(request.args)
+    chunks = OrderExport.stream(filters, fmt, compress, current_app.config.get("EXPORT_YIELD_PER", 2000))
+    response = Response(stream_with_context(chunks),
+                        mimetype="application/gzip" if compress else EXPORT_FORMATS[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename={OrderExport.filename(fmt, compress)}"
+    return response
 
 @admin_bp.route("/users")
+@replica_reads
 @admin_required
 def admin_users():
-    # Placeholder for managing users
-    users = User.query.all()
-    return render_template("admin/users.html", title="إدارة المستخدمين", users=users)
+    page, per_page, sort = AdminListingService.parse_paging(request.args, ADMIN_USER_SORTS)
+    filters = AdminListingService.parse_user_filters(request.args)
+    pagination = AdminListingService.list_users(filters, sort, page, per_page)
+    return render_template("admin/users.html", title="إدارة المستخدمين", users=pagination.items, pagination=pagination,
+                           filters=filters, sort=sort, sorts=ADMIN_USER_SORTS)
+
+@admin_bp.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuild the full-text game search index."""
+    GameSearchIndex.rebuild()
+    print(f"Indexed {Game.query.count()} games.")
+
+@admin_bp.cli.command("rebuild-cart-counters")
+def rebuild_cart_counters_command():
+    """Check every cart's item_count and subtotal against its items and fix those that drifted."""
+    fixed = CartService.rebuild_counters()
+    db.session.commit()
+    print(f"Rebuilt counters of {fixed} carts.")
+
+@admin_bp.cli.command("import-catalog")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FEED_FORMATS), default=None,
+              help="Feed format; taken from the file extension by default.")
+@click.option("--key", type=click.Choice(FEED_KEYS), default="sku", show_default=True,
+              help="Column matching feed rows to games.")
+@click.option("--batch-size", type=int, default=None, help="Rows applied and committed together.")
+def import_catalog_command(path, fmt, key, batch_size):
+    """Apply a supplier price/stock feed (CSV, JSON array or JSON lines) to the catalog."""
+    batch_size = batch_size or current_app.config.get("CATALOG_IMPORT_BATCH_SIZE", 1000)
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        for progress in CatalogImport.run(read_feed(stream, fmt or _feed_format(path)), key=key, batch_size=batch_size):
+            print(json.dumps(progress, ensure_ascii=False))
+
+@admin_bp.cli.command("purge-idempotency-keys")
+@click.option("--batch-size", default=5000, show_default=True, help="Keys deleted per transaction.")
+def purge_idempotency_keys_command(batch_size):
+    """Delete Idempotency-Key responses past their TTL and abandoned claims."""
+    purged = purge_expired_keys(batch_size=batch_size)
+    print(f"Purged {purged} idempotency keys.")
+
+@admin_bp.cli.command("export-orders")
+@click.argument("output", type=click.File("wb"))
+@click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output with gzip.")
+@click.option("--status", default=None, help="Only orders with this status.")
+@click.option("--date-from", default=None, help="First day to include (YYYY-MM-DD).")
+@click.option("--date-to", default=None, help="Last day to include (YYYY-MM-DD).")
+def export_orders_command(output, fmt, compress, status, date_from, date_to):
+    """Stream orders, items and payments to OUTPUT (a path, or - for stdout)."""
+    filters = AdminListingService.parse_order_filters({"status": status, "date_from": date_from, "date_to": date_to})
+    for chunk in OrderExport.stream(filters, fmt, compress, current_app.config.get("EXPORT_YIELD_PER", 2000)):
+        output.write(chunk if compress else chunk.encode("utf-8"))
+
+@admin_bp.cli.command("rebuild-sales-rollups")
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+              help="Only recompute days from this one on (YYYY-MM-DD); all days by default.")
+def rebuild_sales_rollups_command(since):
+    """Recompute the dashboard's daily sales rollups from completed orders."""
+    counted = SalesRollup.rebuild(since.date() if since else None)
+    db.session.commit()
+    print(f"Rolled up {counted} completed orders.")
+
+@admin_bp.cli.command("simulate-replica")
+@click.option("--lag", default=1.0, show_default=True, help="Seconds the replica trails the primary.")
+@click.option("--interval", default=0.25, show_default=True, help="Seconds between snapshots of the primary.")
+def simulate_replica_command(lag, interval):
+    """Keep the SQLite read replica a lagging copy of the primary (local testing)."""
+    simulator = ReplicationLagSimulator.from_config(current_app.config, lag, interval)
+    print(f"Replicating {simulator.primary_path} -> {simulator.replica_path} with {lag}s lag.")
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        print("Replication stopped.")
@@ -0,0 +1,186 @@
+import re
+import unicodedata
+from flask import current_app
+from sqlalchemy import text, or_
+from models import db, Game
+
+SEARCH_TABLE = "game_search"
+# bm25 weights for (name, description, category, game_type)
+SEARCH_WEIGHTS = (10.0, 1.0, 2.0, 2.0)
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+_TATWEEL = "\u0640"
+_ARABIC_LETTER_MAP = str.maketrans({
+    "\u0623": "\u0627", # أ -> ا
+    "\u0625": "\u0627", # إ -> ا
+    "\u0622": "\u0627", # آ -> ا
+    "\u0671": "\u0627", # ٱ -> ا
+    "\u0649": "\u064A", # ى -> ي
+    "\u06CC": "\u064A", # ی (Persian yeh) -> ي
+    "\u0626": "\u064A", # ئ -> ي
+    "\u0624": "\u0648", # ؤ -> و
+    "\u0629": "\u0647", # ة -> ه
+    "\u06A9": "\u0643", # ک (keheh) -> ك
+})
+# Arabic-Indic and extended Arabic-Indic digits -> ASCII
+_DIGIT_MAP = str.maketrans("\u0660\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669"
+                           "\u06F0\u06F1\u06F2\u06F3\u06F4\u06F5\u06F6\u06F7\u06F8\u06F9",
+                           "01234567890123456789")
+# A switch between Arabic and Latin/digit runs inside one token, e.g. "pubgشدات" or "شدات60"
+_SCRIPT_BOUNDARY = re.compile(r"(?<=[\u0600-\u06FF])(?=[A-Za-z0-9])|(?<=[A-Za-z0-9])(?=[\u0600-\u06FF])")
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def normalize_arabic(value):
+    """Normalize text for indexing and querying.
+
+    Strips diacritics and tatweel, unifies alef/yaa/taa marbuta variants,
+    converts Arabic digits, case-folds Latin and splits mixed Arabic/Latin tokens.
+    """
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKC", value)
+    value = _ARABIC_DIACRITICS.sub("", value).replace(_TATWEEL, "")
+    value = value.translate(_ARABIC_LETTER_MAP).translate(_DIGIT_MAP)
+    value = _SCRIPT_BOUNDARY.sub(" ", value)
+    return value.casefold()
+
+def _match_expression(query):
+    """FTS5 MATCH expression: every normalized token must match as a prefix"""
+    tokens = _TOKEN.findall(normalize_arabic(query).replace("_", " "))
+    return " AND ".join(f'"{token}"*' for token in tokens)
+
+class GameSearchIndex:
+    """Full-text index over the catalog, backed by SQLite FTS5.
+
+    Rows hold the normalized text of each active game keyed by game id; admin
+    writes keep it in sync through index_games/remove_games. The index is
+    built by a migration or `flask admin rebuild-search-index`, never by a
+    request: until it exists, and on other databases, search falls back to
+    LIKE matching.
+    """
+
+    @staticmethod
+    def _uses_fts():
+        return db.engine.dialect.name == "sqlite"
+
+    @staticmethod
+    def is_ready():
+        """Whether the FTS table exists; only a positive answer is remembered, so a build elsewhere is picked up"""
+        if not GameSearchIndex._uses_fts():
+            return False
+        if current_app.extensions.get("game_search_ready"):
+            return True
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SEARCH_TABLE}).first() is not None
+        if exists:
+            current_app.extensions["game_search_ready"] = True
+        return exists
+
+    @staticmethod
+    def _create():
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "name, description, category, game_type, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"))
+
+    @staticmethod
+    def _document(game):
+        return {
+            "rowid": game.id,
+            "name": normalize_arabic(game.name),
+            "description": normalize_arabic(game.description),
+            "category": normalize_arabic(game.category),
+            "game_type": normalize_arabic((game.game_type or "").replace("_", " ")),
+        }
+
+    @staticmethod
+    def _write(games, replace=True):
+        """Index active games; inactive ones are dropped so ranking never has to skip them"""
+        if replace:
+            db.session.execute(
+                text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"),
+                [{"rowid": game.id} for game in games])
+        documents = [GameSearchIndex._document(game) for game in games if game.is_active]
+        if documents:
+            db.session.execute(
+                text(f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, category, game_type) "
+                     "VALUES (:rowid, :name, :description, :category, :game_type)"),
+                documents)
+
+    @staticmethod
+    def _rebuild(batch_size=1000):
+        db.session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+        last_id = 0
+        while True:
+            # Plain rows rather than ORM objects keep memory flat on large catalogs
+            games = (db.session.query(Game.id, Game.name, Game.description, Game.category,
+                                      Game.game_type, Game.is_active)
+                     .filter(Game.id > last_id).order_by(Game.id).limit(batch_size).all())
+            if not games:
+                break
+            GameSearchIndex._write(games, replace=False)
+            last_id = games[-1].id
+
+    @staticmethod
+    def rebuild():
+        """Create the index if needed and re-index the whole catalog.
+
+        The table is created and filled in one transaction, so searches keep
+        using LIKE until it is complete.
+        """
+        if not GameSearchIndex._uses_fts():
+            return
+        GameSearchIndex._create()
+        GameSearchIndex._rebuild()
+        db.session.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+        db.session.commit()
+
+    @staticmethod
+    def index_games(games):
+        """Insert or refresh the index rows for the given games"""
+        if not GameSearchIndex.is_ready():
+            return # The next rebuild indexes them
+        GameSearchIndex._write(games)
+        db.session.commit()
+
+    @staticmethod
+    def remove_games(game_ids):
+        if not game_ids or not GameSearchIndex.is_ready():
+            return
+        db.session.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"),
+            [{"rowid": game_id} for game_id in game_ids])
+        db.session.commit()
+
+    @staticmethod
+    def search(query, limit=20, offset=0):
+        """Active games matching `query`, best matches first"""
+        if not GameSearchIndex.is_ready():
+            return GameSearchIndex._search_like(query, limit, offset)
+        expression = _match_expression(query)
+        if not expression:
+            return []
+        weights = ", ".join(str(w) for w in SEARCH_WEIGHTS)
+        # Only active games are indexed, so ranking and paging happen inside FTS5
+        game_ids = db.session.execute(
+            text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :expression "
+                 f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT :limit OFFSET :offset"),
+            {"expression": expression, "limit": limit, "offset": offset}).scalars().all()
+        if not game_ids:
+            return []
+        games = {game.id: game for game in Game.query.filter(Game.id.in_(game_ids), Game.is_active.is_(True))}
+        return [games[game_id] for game_id in game_ids if game_id in games]
+
+    @staticmethod
+    def _search_like(query, limit, offset):
+        tokens = _TOKEN.findall(query or "")
+        if not tokens:
+            return []
+        games = Game.query.filter(Game.is_active.is_(True))
+        for token in tokens:
+            pattern = f"%{token}%"
+            games = games.filter(or_(Game.name.ilike(pattern), Game.description.ilike(pattern),
+                                     Game.category.ilike(pattern), Game.game_type.ilike(pattern)))
+        return games.order_by(Game.id).offset(offset).limit(limit).all()
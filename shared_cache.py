@@ -0,0 +1,226 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from flask import current_app
+from db_routing import primary_reads
+
+try:
+    import fcntl # POSIX only; gunicorn workers run on Linux
+except ImportError: # pragma: no cover
+    fcntl = None
+
+LOCK_STRIPES = 256
+LOCAL_MEMO_SIZE = 1024
+# Entries stored by this process between two prunes of the SQLite file
+PRUNE_EVERY = 256
+
+class SharedCache:
+    """Versioned key/value cache shared by every worker process on one host.
+
+    Entries live in a small SQLite file next to the application instance, so
+    gunicorn workers reuse each other's work. Each namespace has a version
+    counter; bumping it invalidates every entry built under the old version.
+    Rebuilds are single-flight: concurrent misses for the same key (from any
+    thread or worker) wait for the first builder instead of all hitting the DB.
+
+    At most `max_entries` entries are kept. In memory the least recently
+    used go first; in the SQLite file, where recording every hit would turn
+    reads into writes, entries older than `ttl` seconds and then the oldest
+    built are pruned every PRUNE_EVERY stores.
+
+    With path=None the cache is kept in process memory only (used in tests).
+    """
+
+    def __init__(self, path=None, max_entries=50000, ttl=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stores = 0
+        self._thread_local = threading.local()
+        self._thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._memo = {} # key -> (version, value), skips JSON decoding on hot keys
+        self._memory_versions = {}
+        self._version_lock = threading.Lock()
+        self._memory_entries = OrderedDict()
+        self._lock_file = None
+        self._lock_file_pid = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = self._connection()
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+            if columns and "stored_at" not in columns: # A cache file from before entries were pruned
+                conn.execute("DROP TABLE entries")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+                         "payload TEXT NOT NULL, stored_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_stored_at ON entries (stored_at)")
+
+    # --- Storage ---
+
+    def _connection(self):
+        # One connection per thread, reopened after fork
+        conn = getattr(self._thread_local, "conn", None)
+        if conn is None or self._thread_local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._thread_local.conn = conn
+            self._thread_local.pid = os.getpid()
+        return conn
+
+    def get_version(self, namespace):
+        if not self.path:
+            return self._memory_versions.get(namespace, 0)
+        row = self._connection().execute(
+            "SELECT value FROM versions WHERE name = ?", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def get_versions(self, namespaces):
+        """get_version() of several namespaces with one lookup, in the same order"""
+        if not self.path:
+            return [self._memory_versions.get(namespace, 0) for namespace in namespaces]
+        found = dict(self._connection().execute(
+            f"SELECT name, value FROM versions WHERE name IN ({','.join('?' * len(namespaces))})", namespaces))
+        return [found.get(namespace, 0) for namespace in namespaces]
+
+    def bump_version(self, namespace):
+        """Invalidate every entry in `namespace`; returns the new version"""
+        if not self.path:
+            with self._version_lock:
+                version = self._memory_versions.get(namespace, 0) + 1
+                self._memory_versions[namespace] = version
+            return version
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO versions (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1", (namespace,))
+            version = conn.execute("SELECT value FROM versions WHERE name = ?", (namespace,)).fetchone()[0]
+            # Entries built under older versions can never be served again
+            conn.execute("DELETE FROM entries WHERE key LIKE ? AND version < ?", (f"{namespace}:%", version))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def _load(self, key, version):
+        memo = self._memo.get(key)
+        if memo is not None and memo[0] == version:
+            if not self.path and key in self._memory_entries:
+                self._memory_entries.move_to_end(key)
+            return True, memo[1]
+        if not self.path:
+            entry = self._memory_entries.get(key)
+            if entry is None or entry[0] != version:
+                return False, None
+            self._memory_entries.move_to_end(key)
+            payload = entry[1]
+        else:
+            row = self._connection().execute(
+                "SELECT payload FROM entries WHERE key = ? AND version = ?", (key, version)).fetchone()
+            if row is None:
+                return False, None
+            payload = row[0]
+        value = json.loads(payload)
+        self._remember(key, version, value)
+        return True, value
+
+    def _store(self, key, version, value):
+        payload = json.dumps(value, separators=(",", ":"))
+        if not self.path:
+            self._memory_entries[key] = (version, payload)
+            self._memory_entries.move_to_end(key)
+            while len(self._memory_entries) > self.max_entries:
+                self._memory_entries.popitem(last=False)
+        else:
+            self._connection().execute(
+                "INSERT INTO entries (key, version, payload, stored_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET version = excluded.version, payload = excluded.payload, "
+                "stored_at = excluded.stored_at",
+                (key, version, payload, time.time()))
+            self._stores += 1
+            if self._stores % PRUNE_EVERY == 0:
+                self.prune()
+        self._remember(key, version, value)
+
+    def prune(self):
+        """Delete file entries older than the TTL, then the oldest past max_entries; returns the number deleted"""
+        if not self.path:
+            return 0
+        conn = self._connection()
+        deleted = conn.execute("DELETE FROM entries WHERE stored_at < ?", (time.time() - self.ttl,)).rowcount
+        deleted += conn.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        return deleted
+
+    def _remember(self, key, version, value):
+        if len(self._memo) >= LOCAL_MEMO_SIZE:
+            self._memo.clear()
+        self._memo[key] = (version, value)
+
+    # --- Single-flight ---
+
+    def _stripe(self, key):
+        return zlib.crc32(key.encode("utf-8")) % LOCK_STRIPES
+
+    def _file_lock(self):
+        if self._lock_file is None or self._lock_file_pid != os.getpid():
+            self._lock_file = open(self.path + ".lock", "a+b")
+            self._lock_file_pid = os.getpid()
+        return self._lock_file
+
+    def _acquire(self, stripe):
+        self._thread_locks[stripe].acquire()
+        if self.path and fcntl is not None:
+            # Byte-range lock on one byte per stripe: excludes other worker processes
+            fcntl.lockf(self._file_lock(), fcntl.LOCK_EX, 1, stripe)
+
+    def _release(self, stripe):
+        try:
+            if self.path and fcntl is not None:
+                fcntl.lockf(self._file_lock(), fcntl.LOCK_UN, 1, stripe)
+        finally:
+            self._thread_locks[stripe].release()
+
+    def get_or_build(self, namespace, key, builder):
+        """Return the cached value for `key`, building it at most once per version.
+
+        `builder` must return a JSON-serializable value.
+        """
+        full_key = f"{namespace}:{key}"
+        version = self.get_version(namespace)
+        found, value = self._load(full_key, version)
+        if found:
+            return value
+
+        stripe = self._stripe(full_key)
+        self._acquire(stripe)
+        try:
+            # Another thread or worker may have built it while we waited
+            found, value = self._load(full_key, version)
+            if found:
+                return value
+            # Built from the primary: a lagging replica would pin stale rows under the new version
+            with primary_reads():
+                value = builder()
+            self._store(full_key, version, value)
+            return value
+        finally:
+            self._release(stripe)
+
+def get_shared_cache():
+    """The SharedCache for the current app, created on first use"""
+    cache = current_app.extensions.get("shared_cache")
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "shared_cache", SharedCache(current_app.config.get("SHARED_CACHE_PATH"),
+                                        current_app.config.get("SHARED_CACHE_MAX_ENTRIES", 50000),
+                                        current_app.config.get("SHARED_CACHE_TTL", 3600)))
+    return cache
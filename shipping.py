@@ -1,92 +1,136 @@
-import random
-import string
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
-from models import OrderItem, Order, User, db, Game # Import Game
+from email.utils import make_msgid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from uuid import uuid4
+from sqlalchemy import update, or_, func
+from models import OrderItem, Order, User, Payment, db, Game # Import Game
 from flask import current_app, render_template
+from inventory import InventoryService
+from jobs import JobQueue
+from mailer import get_mailer, build_order_confirmation, load_order_items, MailBackpressure
+from codes import get_code_generator, code_prefix
+from vault import CodeVault
+from rollups import SalesRollup
+
+# Order statuses a fulfillment run may (re)work; anything else is finished or cancelled
+FULFILLABLE_STATUSES = ("pending", "processing", "failed_fulfillment")
 
 class GameShippingService:
     """Service for handling game shipping functionality"""
     
     @staticmethod
-    def generate_digital_code(game_type, length=16):
-        """Generate a random digital code for game items"""
-        prefix = "CODE-"
-        if game_type:
-            prefix = game_type.upper()[:4] + "-"
-        
-        chars = string.ascii_uppercase + string.digits
-        code_part = "".join(random.choice(chars) for _ in range(length))
-        # Ensure 4 groups of 4 characters
-        formatted_code = f"{code_part[:4]}-{code_part[4:8]}-{code_part[8:12]}-{code_part[12:16]}"
-        timestamp = datetime.now().strftime("%y%m%d%H%M") # Add time for more uniqueness
-        return f"{prefix}{timestamp}-{formatted_code}"
-    
+    def generate_digital_code(game_type):
+        """Generate a unique digital code for game items, e.g. PUBG-7K2M-Q9XD-4RTA-H3WB"""
+        return GameShippingService.generate_digital_codes(game_type, 1)[0]
+
+    @staticmethod
+    def generate_digital_codes(game_type, count):
+        """Generate `count` unique digital codes in one batch"""
+        return get_code_generator().generate(code_prefix(game_type), count)
+
+    @staticmethod
+    def _reserve_codes(code_counts):
+        """Lease code blocks for {game_type: number of codes} before any row is written"""
+        generator = get_code_generator()
+        prefixes = defaultdict(int)
+        for game_type, count in code_counts.items():
+            prefixes[code_prefix(game_type)] += count
+        for prefix, count in prefixes.items():
+            generator.reserve(prefix, count)
+
     @staticmethod
     def send_order_confirmation_email(order_id):
-        """Send order confirmation email to customer (Simulated)"""
-        order = Order.query.get(order_id)
+        """Send the confirmation email for one order right away (manual resend)"""
+        order = db.session.get(Order, order_id)
         if not order or not order.customer:
-            print(f"Error: Order {order_id} or customer not found for email.")
+            current_app.logger.error("Order %s or its customer not found for email", order_id)
             return False, "Order or customer not found"
-        
-        user = order.customer
-        subject = f"تأكيد الطلب وشحن الأكواد - الطلب #{order.id}"
-        sender = current_app.config.get("MAIL_DEFAULT_SENDER", "noreply@example.com")
-        recipient = user.email
-
-        # Build email content with codes
-        email_body = f"<h1>شكراً لطلبك #{order.id}!</h1>"
-        email_body += "<p>لقد تم شحن طلبك بنجاح. إليك تفاصيل المنتجات والأكواد الرقمية:</p>"
-        email_body += "<ul>"
-        for item in order.items:
-            email_body += f"<li><strong>{item.game.name}</strong> (الكمية: {item.quantity})"
-            if item.code:
-                email_body += f" - الكود: <code>{item.code}</code>"
-            elif item.game_account_id:
-                 email_body += f" - تم الشحن إلى معرف اللاعب: {item.game_account_id}"
-            else:
-                 email_body += " - (لا يتطلب كود)"
-            email_body += "</li>"
-        email_body += "</ul>"
-        email_body += "<p>يمكنك أيضاً مراجعة تفاصيل طلبك في حسابك على موقعنا.</p>"
-
-        # Simulate sending
-        print(f"--- محاكاة إرسال بريد إلكتروني ---")
-        print(f"إلى: {recipient}")
-        print(f"من: {sender}")
-        print(f"الموضوع: {subject}")
-        print(f"المحتوى (HTML):\n{email_body}")
-        # In a real app, use smtplib or a mail service library here
-        # Example using smtplib (requires mail server config):
-        # try:
-        #     msg = MIMEMultipart("alternative")
-        #     msg["Subject"] = subject
-        #     msg["From"] = sender
-        #     msg["To"] = recipient
-        #     msg.attach(MIMEText(email_body, "html"))
-        #     with smtplib.SMTP(current_app.config["MAIL_SERVER"], current_app.config["MAIL_PORT"]) as server:
-        #         if current_app.config["MAIL_USE_TLS"]:
-        #             server.starttls()
-        #         if current_app.config["MAIL_USERNAME"] and current_app.config["MAIL_PASSWORD"]:
-        #             server.login(current_app.config["MAIL_USERNAME"], current_app.config["MAIL_PASSWORD"])
-        #         server.sendmail(sender, recipient, msg.as_string())
-        #     print("Email sent successfully (simulated).")
-        # except Exception as e:
-        #     print(f"Email sending failed: {e}")
-        #     return False, f"Email sending failed: {e}"
-        print(f"--- نهاية محاكاة البريد الإلكتروني ---")
-        
-        return True, "Email simulation complete"
+
+        message = build_order_confirmation(order.customer, [order])
+        error = get_mailer().send_many([message])[0]
+        if error is not None:
+            current_app.logger.error("Email sending failed for order %s: %s", order_id, error)
+            return False, f"Email sending failed: {error}"
+        if order.confirmation_email_id is None:
+            order.confirmation_email_id = message["Message-ID"]
+            db.session.commit()
+        return True, "Email sent"
+
+    @staticmethod
+    def send_order_confirmations(order_ids):
+        """Send confirmation emails for fulfilled orders, one message per customer.
+
+        Every unconfirmed fulfilled order of the same customers is folded into
+        that customer's message, so orders placed within the coalescing window
+        arrive as one email. Orders are stamped with the Message-ID before
+        sending (and unstamped if it fails) so concurrent workers never mail them twice.
+        Returns None or an error message for each of `order_ids`.
+        """
+        user_ids = [row.user_id for row in db.session.query(Order.user_id).filter(
+            Order.id.in_(order_ids)).distinct()]
+        unconfirmed = db.session.query(Order.id, Order.user_id).filter(
+            Order.user_id.in_(user_ids),
+            Order.status.in_(["completed", "processing"]),
+            Order.confirmation_email_id.is_(None),
+        ).order_by(Order.id).all()
+        by_user = defaultdict(list)
+        for row in unconfirmed:
+            by_user[row.user_id].append(row.id)
+
+        message_ids = {}
+        for user_id, user_order_ids in by_user.items():
+            message_id = make_msgid(domain="gameshipping.com")
+            db.session.execute(
+                update(Order)
+                .where(Order.id.in_(user_order_ids), Order.confirmation_email_id.is_(None))
+                .values(confirmation_email_id=message_id)
+                .execution_options(synchronize_session=False)
+            )
+            message_ids[user_id] = message_id
+        db.session.commit()
+
+        orders = Order.query.filter(Order.confirmation_email_id.in_(message_ids.values())).order_by(Order.id).all()
+        if not orders:
+            return [None] * len(order_ids)
+        users = {user.id: user for user in User.query.filter(User.id.in_(message_ids.keys()))}
+        items = load_order_items([order.id for order in orders])
+        orders_by_message = defaultdict(list)
+        for order in orders:
+            orders_by_message[order.confirmation_email_id].append(order)
+
+        mailer = get_mailer()
+        timeout = current_app.config.get("MAIL_SUBMIT_TIMEOUT", 10)
+        futures = {}
+        for message_id, message_orders in orders_by_message.items():
+            message = build_order_confirmation(users[message_orders[0].user_id], message_orders, items, message_id)
+            try:
+                futures[message_id] = mailer.submit(message, timeout=timeout)
+            except MailBackpressure as e:
+                futures[message_id] = e # Left for the job's retry
+        failed = {}
+        for message_id, future in futures.items():
+            error = future if isinstance(future, Exception) else future.result()
+            if error is not None:
+                failed[message_id] = str(error)
+        if failed:
+            db.session.execute(
+                update(Order)
+                .where(Order.confirmation_email_id.in_(failed.keys()))
+                .values(confirmation_email_id=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            current_app.logger.error("Failed to send %d confirmation emails: %s", len(failed), list(failed.values()))
+        failed_orders = {order.id: failed[order.confirmation_email_id]
+                         for order in orders if order.confirmation_email_id in failed}
+        return [failed_orders.get(order_id) for order_id in order_ids]
 
     @staticmethod
     def fulfill_order(order_id):
         """Process order fulfillment"""
         order = Order.query.get(order_id)
         if not order:
-            print(f"Fulfillment Error: Order {order_id} not found.")
+            current_app.logger.error("Fulfillment: order %s not found", order_id)
             return False, "Order not found"
 
         # Ensure payment is completed before fulfillment (important in real app)
@@ -94,42 +138,58 @@ class GameShippingService:
         #     print(f"Fulfillment Error: Payment for order {order_id} not completed.")
         #     return False, "Payment not completed"
 
-        if order.status not in ["pending", "processing", "failed_fulfillment"]: # Allow re-fulfillment attempt
-             print(f"Fulfillment Info: Order {order_id} status is {order.status}, skipping fulfillment.")
+        if order.status not in FULFILLABLE_STATUSES: # Allow re-fulfillment attempt
+             current_app.logger.info("Fulfillment: order %s is %s, skipped", order_id, order.status)
              return True, f"Order status is {order.status}, fulfillment skipped"
 
-        print(f"Fulfilling order {order_id}...")
+        # Keep a concurrent batch run or job worker off this order while we work on it
+        if not GameShippingService.claim_orders([order_id], uuid4().hex):
+            if order.status not in FULFILLABLE_STATUSES: # Finished by another run since the read above
+                current_app.logger.info("Fulfillment: order %s is %s, skipped", order_id, order.status)
+                return True, f"Order status is {order.status}, fulfillment skipped"
+            current_app.logger.info("Fulfillment: order %s is being fulfilled by another worker", order_id)
+            return False, "Order is being fulfilled by another worker"
+
+        GameShippingService._reserve_codes(dict(
+            db.session.query(Game.game_type, func.count(OrderItem.id)).join(OrderItem)
+            .filter(OrderItem.order_id == order_id, OrderItem.status != "fulfilled",
+                    OrderItem.game_account_id.is_(None), Game.uses_code_vault.isnot(True))
+            .group_by(Game.game_type)))
+
+        current_app.logger.debug("Fulfilling order %s", order_id)
         order.status = "processing"
         all_fulfilled = True
         fulfillment_errors = []
+        newly_fulfilled = []
+        vault_allocated = defaultdict(int)
         
         try:
+            # Stock held at checkout; anything not covered (expired or legacy orders) is taken below
+            held = InventoryService.consume(order.id)
             for item in order.items:
                 if item.status == "fulfilled":
                     continue # Skip already fulfilled items
 
-                print(f"  Processing item {item.id} (Game: {item.game.name})...")
+                current_app.logger.debug("Fulfilling item %s of order %s (game %s)", item.id, order_id, item.game_id)
+                from_hold = min(held.get(item.game_id, 0), item.quantity)
+                held[item.game_id] = held.get(item.game_id, 0) - from_hold
+                taken = 0
                 try:
-                    # Check stock before fulfillment
-                    if item.game.stock < item.quantity:
-                         raise ValueError(f"Insufficient stock for {item.game.name} (Required: {item.quantity}, Available: {item.game.stock})")
-                         
-                    if not item.game_account_id: # Needs a digital code
-                        item.code = GameShippingService.generate_digital_code(item.game.game_type)
-                        item.status = "fulfilled"
-                        print(f"    Generated code: {item.code}")
-                    else: # Needs direct account credit (simulate for now)
-                        # In a real app, call game API here
-                        print(f"    Simulating credit for account: {item.game_account_id}")
-                        item.status = "fulfilled"
-                    
-                    # Decrease stock count
-                    item.game.stock -= item.quantity
-                    db.session.add(item.game) # Add game to session as stock is modified
-                    print(f"    Stock updated for {item.game.name}: {item.game.stock}")
+                    # Atomic decrement of whatever the hold does not cover
+                    if from_hold < item.quantity:
+                        if not InventoryService.take(item.game_id, item.quantity - from_hold):
+                            raise ValueError(f"Insufficient stock for {item.game.name} (Required: {item.quantity})")
+                        taken = item.quantity - from_hold
+
+                    vault_allocated[item.game_id] += GameShippingService._deliver_item(
+                        item, item.game.game_type, item.game.uses_code_vault)
+                    newly_fulfilled.append(item.id)
 
                 except Exception as item_error:
-                    print(f"    Error fulfilling item {item.id}: {item_error}")
+                    current_app.logger.warning("Fulfillment: item %s of order %s failed: %s", item.id, order_id, item_error)
+                    # Give back the stock this item was holding or had already taken
+                    if from_hold + taken:
+                        InventoryService.restock(item.game_id, from_hold + taken)
                     item.status = "failed"
                     all_fulfilled = False
                     fulfillment_errors.append(f"Item {item.id} ({item.game.name}): {item_error}")
@@ -137,60 +197,256 @@ class GameShippingService:
             # Update overall order status
             if all_fulfilled:
                 order.status = "completed"
-                print(f"Order {order_id} status updated to completed.")
             elif any(i.status == "fulfilled" for i in order.items): # Partially fulfilled
                  order.status = "processing" # Or a custom status like "partially_fulfilled"
-                 print(f"Order {order_id} status remains processing (partially fulfilled).")
             else: # All items failed
                  order.status = "failed_fulfillment"
-                 print(f"Order {order_id} status updated to failed_fulfillment.")
 
-            db.session.commit()
-            print(f"Order {order_id} fulfillment processed.")
+            # One confirmation per run that delivered something; a retry that delivers nothing new sends none
+            if newly_fulfilled:
+                GameShippingService._queue_confirmations({order.id: newly_fulfilled})
+            CodeVault.queue_low_stock_alerts(vault_allocated)
+            if order.status == "completed":
+                SalesRollup.record_completed([order.id])
 
-            # Send confirmation email only if at least partially successful
-            if order.status in ["completed", "processing"]:
-                email_sent, email_message = GameShippingService.send_order_confirmation_email(order.id)
-                if not email_sent:
-                     print(f"Warning: Failed to send confirmation email for order {order.id}: {email_message}")
+            order.claim_token = None
+            db.session.commit()
+            current_app.logger.info("Fulfillment: order %s is %s", order_id, order.status)
 
             return all_fulfilled, f"Order fulfillment complete. Errors: {fulfillment_errors}" if fulfillment_errors else "Order fulfilled successfully"
 
         except Exception as e:
             db.session.rollback()
-            print(f"Critical Error during fulfillment for order {order_id}: {e}")
+            current_app.logger.exception("Fulfillment of order %s failed", order_id)
             # Mark order as failed or requires attention
             order.status = "failed_fulfillment"
+            order.claim_token = None
             db.session.commit()
             return False, f"Critical fulfillment failed: {str(e)}"
 
     @staticmethod
-    def process_pending_orders():
-        """Process all orders that are ready for fulfillment (e.g., payment completed)"""
-        # In a real scenario, filter by orders with completed payments
-        # For now, let"s assume "pending" orders are ready after checkout simulation
-        # Also process orders that previously failed fulfillment
-        orders_to_process = Order.query.filter(Order.status.in_(["pending", "failed_fulfillment"])).all()
-        print(f"Found {len(orders_to_process)} orders to process.")
-        
-        results = []
-        for order in orders_to_process:
-            print(f"Processing order {order.id}...")
-            # Ensure payment is completed (simulated check)
-            if order.payment and order.payment.status == "completed":
-                success, message = GameShippingService.fulfill_order(order.id)
-                results.append({
-                    "order_id": order.id,
-                    "success": success,
-                    "message": message
-                })
+    def _queue_confirmations(newly_fulfilled):
+        """Queue confirmation emails for {order_id: [ids of the items this run fulfilled]}.
+
+        Each run fulfills items no earlier run did, so the first of them keys
+        the job: the same delivery is never mailed twice, even if the run is
+        retried. An order confirmed before this run is unstamped, so its
+        customer gets the updated order with the new codes.
+        """
+        order_ids = sorted(newly_fulfilled)
+        db.session.execute(
+            update(Order)
+            .where(Order.id.in_(order_ids), Order.confirmation_email_id.isnot(None))
+            .values(confirmation_email_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        JobQueue.enqueue_many(
+            "send_order_email", [{"order_id": order_id} for order_id in order_ids],
+            delay=current_app.config.get("MAIL_COALESCE_WINDOW", 60),
+            dedupe_keys=[f"send_order_email:{order_id}:{min(newly_fulfilled[order_id])}" for order_id in order_ids])
+
+    @staticmethod
+    def _deliver_item(item, game_type, uses_vault=False):
+        """Hand out the item's code(s), or credit the player account, and mark it fulfilled.
+
+        Games stocked with supplier codes take one vault code per unit; returns
+        the number of vault codes allocated.
+        """
+        allocated = 0
+        if not item.game_account_id: # Needs a digital code
+            if uses_vault:
+                # Listed through item.vault_codes only: supplier codes are unique per game, not across
+                # games, so they cannot go in the globally unique order_item.code
+                allocated = len(CodeVault.allocate(item.game_id, item.id, item.quantity))
             else:
-                 print(f"Skipping order {order.id}, payment not completed.")
-                 results.append({
-                    "order_id": order.id,
-                    "success": False,
-                    "message": "Payment not completed"
-                })
-        
-        print(f"Finished processing orders.")
-        return results
+                item.code = GameShippingService.generate_digital_code(game_type)
+        # else: direct account credit; in a real app, call the game API here
+        item.status = "fulfilled"
+        return allocated
+
+    @staticmethod
+    def _claimable(now=None):
+        """Orders nobody is fulfilling, or whose fulfiller stopped without releasing them"""
+        now = now or datetime.utcnow()
+        stale = now - timedelta(seconds=current_app.config.get("FULFILLMENT_CLAIM_TIMEOUT", 600))
+        return or_(Order.claim_token.is_(None), Order.claimed_at < stale)
+
+    @staticmethod
+    def claim_orders(order_ids, token):
+        """Atomically mark orders as being fulfilled under `token`.
+
+        Commits and returns the ids this token won; orders claimed by another
+        run, or no longer fulfillable because one finished them since the
+        caller read them, are left out.
+        """
+        db.session.execute(
+            update(Order)
+            .where(Order.id.in_(order_ids), Order.status.in_(FULFILLABLE_STATUSES),
+                   GameShippingService._claimable())
+            .values(claim_token=token, claimed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return [row.id for row in db.session.query(Order.id).filter(
+            Order.id.in_(order_ids), Order.claim_token == token).order_by(Order.id)]
+
+    @staticmethod
+    def release_orders(token):
+        db.session.execute(
+            update(Order)
+            .where(Order.claim_token == token)
+            .values(claim_token=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    @staticmethod
+    def process_pending_orders(chunk_size=None, limit=None):
+        """Fulfill paid pending/failed orders chunk by chunk, yielding a progress dict per chunk.
+
+        Each chunk is claimed through Order.claim_token before any work starts,
+        so several runs (CLI workers or HTTP requests) can drain the backlog side
+        by side without fulfilling an order twice. Orders whose payment is not
+        completed are left alone. The last dict yielded has "done": True and the totals.
+        """
+        chunk_size = chunk_size or current_app.config.get("FULFILLMENT_CHUNK_SIZE", 200)
+        token = uuid4().hex
+        totals = {"chunks": 0, "orders": 0, "completed": 0, "processing": 0, "failed_fulfillment": 0, "errors": 0}
+        last_id = 0
+        while limit is None or totals["orders"] < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - totals["orders"])
+            # Keyset over id: every order is looked at once per run, even if it fails again
+            candidate_ids = [row.id for row in db.session.query(Order.id).join(Payment).filter(
+                Order.id > last_id,
+                Order.status.in_(["pending", "failed_fulfillment"]),
+                Payment.status == "completed",
+                GameShippingService._claimable(),
+            ).order_by(Order.id).limit(size)]
+            if not candidate_ids:
+                break
+            last_id = candidate_ids[-1]
+            order_ids = GameShippingService.claim_orders(candidate_ids, token)
+            if not order_ids:
+                continue
+
+            totals["chunks"] += 1
+            totals["orders"] += len(order_ids)
+            try:
+                statuses = GameShippingService._fulfill_chunk(order_ids, token)
+            except Exception as e:
+                db.session.rollback()
+                GameShippingService.release_orders(token)
+                current_app.logger.exception("Fulfillment of orders %s-%s failed", order_ids[0], order_ids[-1])
+                totals["errors"] += 1
+                yield {"chunk": totals["chunks"], "orders": len(order_ids), "last_order_id": last_id, "error": str(e)}
+                continue
+
+            counts = defaultdict(int)
+            for status in statuses.values():
+                counts[status] += 1
+                totals[status] += 1
+            yield {"chunk": totals["chunks"], "orders": len(order_ids), "last_order_id": last_id, **counts}
+
+        yield {"done": True, **totals}
+
+    @staticmethod
+    def _fulfill_chunk(order_ids, token):
+        """Fulfill a batch of claimed orders in one transaction; returns {order_id: new status}.
+
+        Stock is taken with one conditional UPDATE per game for the whole chunk,
+        falling back to item by item only for a game that cannot cover it all.
+        Confirmation emails are queued as jobs.
+        """
+        unfulfilled = []
+        fulfilled_before = set()
+        code_counts = defaultdict(int)
+        items = (db.session.query(OrderItem, Game.game_type, Game.uses_code_vault).join(Game)
+                 .filter(OrderItem.order_id.in_(order_ids))
+                 .order_by(OrderItem.order_id, OrderItem.id)
+                 .yield_per(500))
+        for item, game_type, uses_vault in items:
+            if item.status == "fulfilled":
+                fulfilled_before.add(item.order_id)
+                continue
+            unfulfilled.append((item, game_type, uses_vault))
+            if not item.game_account_id and not uses_vault:
+                code_counts[game_type] += 1
+        GameShippingService._reserve_codes(code_counts)
+
+        held = InventoryService.consume_many(order_ids)
+        pending_items = []
+        demand = defaultdict(int)
+        for item, game_type, uses_vault in unfulfilled:
+            key = (item.order_id, item.game_id)
+            from_hold = min(held.get(key, 0), item.quantity)
+            held[key] = held.get(key, 0) - from_hold
+            pending_items.append((item, game_type, uses_vault, from_hold))
+            demand[item.game_id] += item.quantity - from_hold
+
+        # Games whose aggregate demand could not be met are retried item by item
+        short_games = {game_id for game_id, quantity in demand.items()
+                       if quantity and not InventoryService.take(game_id, quantity)}
+
+        fulfilled_orders, failed_orders = set(fulfilled_before), set()
+        newly_fulfilled = defaultdict(list)
+        vault_allocated = defaultdict(int)
+        for item, game_type, uses_vault, from_hold in pending_items:
+            uncovered = item.quantity - from_hold
+            taken = uncovered if item.game_id not in short_games else 0
+            try:
+                if item.game_id in short_games and uncovered:
+                    if not InventoryService.take(item.game_id, uncovered):
+                        raise ValueError(f"Insufficient stock for game {item.game_id} (Required: {item.quantity})")
+                    taken = uncovered
+                vault_allocated[item.game_id] += GameShippingService._deliver_item(item, game_type, uses_vault)
+                fulfilled_orders.add(item.order_id)
+                newly_fulfilled[item.order_id].append(item.id)
+            except Exception as item_error:
+                current_app.logger.warning("Fulfillment: item %s of order %s failed: %s",
+                                           item.id, item.order_id, item_error)
+                if from_hold + taken:
+                    InventoryService.restock(item.game_id, from_hold + taken)
+                item.status = "failed"
+                failed_orders.add(item.order_id)
+
+        statuses = {}
+        for order_id in order_ids:
+            if order_id not in failed_orders:
+                statuses[order_id] = "completed"
+            elif order_id in fulfilled_orders:
+                statuses[order_id] = "processing" # Partially fulfilled
+            else:
+                statuses[order_id] = "failed_fulfillment"
+        completed = []
+        for status in set(statuses.values()):
+            updated = db.session.execute(
+                update(Order)
+                .where(Order.id.in_([o for o, s in statuses.items() if s == status]), Order.claim_token == token)
+                .values(status=status, claim_token=None)
+                .returning(Order.id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            if status == "completed":
+                completed = updated # Only orders this run still held the claim on
+        if newly_fulfilled:
+            GameShippingService._queue_confirmations(newly_fulfilled)
+        CodeVault.queue_low_stock_alerts(vault_allocated)
+        SalesRollup.record_completed(completed)
+        db.session.commit()
+        return statuses
+
+@JobQueue.handler("fulfill_order")
+def fulfill_order_job(payload):
+    """Job handler: fulfill an order queued at checkout.
+
+    Failures are retried by the queue. A retry only works on the items still
+    unfulfilled, and only mails a confirmation if it delivers some of them.
+    """
+    success, message = GameShippingService.fulfill_order(payload["order_id"])
+    if not success:
+        raise RuntimeError(message)
+
+@JobQueue.handler("send_order_email", batch=True)
+def send_order_email_jobs(payloads):
+    """Job handler: confirmation emails, coalesced per customer across the claimed batch"""
+    return GameShippingService.send_order_confirmations([payload["order_id"] for payload in payloads])
@@ -1,7 +1,13 @@
-from flask import Blueprint, jsonify, request
+import json
+import os
+import click
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_login import login_required, current_user
-from models import Order, OrderItem, db
+from models import Order, OrderItem, Game, db
 from shipping import GameShippingService
+from inventory import InventoryService
+from jobs import JobQueue
+from vault import CodeVault, read_codes_csv
 from routes import admin_required # Import admin_required decorator
 
 shipping_bp = Blueprint("shipping", __name__, url_prefix="/shipping")
@@ -23,27 +29,42 @@ def fulfill_order_route(order_id):
 @shipping_bp.route("/process_pending", methods=["POST"])
 @admin_required
 def process_pending_orders_route():
-    """API endpoint to trigger processing of all pending orders."""
-    try:
-        results = GameShippingService.process_pending_orders()
-        return jsonify({
-            "success": True,
-            "message": f"تمت معالجة {len(results)} طلبات معلقة.",
-            "data": results
-        })
-    except Exception as e:
-        print(f"Error in process_pending_orders_route: {e}")
-        return jsonify({"success": False, "message": "حدث خطأ داخلي أثناء معالجة الطلبات المعلقة."}), 500
+    """API endpoint to trigger processing of pending orders.
+
+    Streams one NDJSON progress line per chunk. At most `limit` orders
+    (FULFILLMENT_HTTP_LIMIT by default) are handled per request so it stays
+    inside the gunicorn timeout; large backlogs belong to `flask shipping process-pending`.
+    """
+    chunk_size = request.args.get("chunk_size", type=int)
+    limit = request.args.get("limit", type=int) or current_app.config.get("FULFILLMENT_HTTP_LIMIT", 1000)
+
+    def generate():
+        try:
+            for progress in GameShippingService.process_pending_orders(chunk_size=chunk_size, limit=limit):
+                yield json.dumps(progress) + "\n"
+        except Exception as e:
+            print(f"Error in process_pending_orders_route: {e}")
+            yield json.dumps({"success": False, "message": "حدث خطأ داخلي أثناء معالجة الطلبات المعلقة."},
+                             ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @shipping_bp.route("/generate_code", methods=["POST"])
 @admin_required
 def generate_code_route():
-    """API endpoint to generate a sample digital code."""
-    data = request.get_json()
+    """API endpoint to generate digital codes; `count` (default 1) issues a batch."""
+    data = request.get_json() or {}
     game_type = data.get("game_type", "generic") # Get game_type from request or default
     try:
-        code = GameShippingService.generate_digital_code(game_type)
-        return jsonify({"success": True, "data": {"code": code}})
+        count = int(data.get("count", 1))
+    except (TypeError, ValueError):
+        count = 0
+    max_count = current_app.config.get("CODE_BULK_MAX", 10000)
+    if not 1 <= count <= max_count:
+        return jsonify({"success": False, "message": f"عدد الأكواد يجب أن يكون بين 1 و {max_count}."}), 400
+    try:
+        codes = GameShippingService.generate_digital_codes(game_type, count)
+        return jsonify({"success": True, "data": {"code": codes[0], "codes": codes}})
     except Exception as e:
         print(f"Error in generate_code_route: {e}")
         return jsonify({"success": False, "message": "حدث خطأ أثناء توليد الكود."}), 500
@@ -63,3 +84,55 @@ def send_email_route(order_id):
     except Exception as e:
         print(f"Error in send_email_route for order {order_id}: {e}")
         return jsonify({"success": False, "message": "حدث خطأ داخلي أثناء إرسال البريد الإلكتروني."}), 500
+
+@shipping_bp.cli.command("release-expired-holds")
+def release_expired_holds_command():
+    """Return the stock held for unpaid orders whose hold TTL has passed."""
+    released = InventoryService.release_expired()
+    print(f"Released {released} expired stock holds.")
+
+@shipping_bp.cli.command("worker")
+@click.option("--batch-size", default=10, show_default=True, help="Jobs claimed per round trip.")
+@click.option("--poll-interval", default=1.0, show_default=True, help="Seconds to sleep when the queue is empty.")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty instead of polling.")
+def worker_command(batch_size, poll_interval, once):
+    """Run queued background jobs (order fulfillment)."""
+    worker_id = JobQueue.worker_id()
+    print(f"Worker {worker_id} started.")
+    try:
+        processed = JobQueue.work(worker_id, batch_size=batch_size, poll_interval=poll_interval, once=once)
+        print(f"Worker {worker_id} processed {processed} jobs.")
+    except KeyboardInterrupt:
+        # Claimed jobs that did not finish become visible again after the timeout
+        print(f"Worker {worker_id} stopped.")
+
+@shipping_bp.cli.command("process-pending")
+@click.option("--chunk-size", type=int, default=None, help="Orders claimed and committed together.")
+@click.option("--limit", type=int, default=None, help="Stop after this many orders.")
+def process_pending_command(chunk_size, limit):
+    """Fulfill paid pending orders in chunks; safe to run several at once."""
+    for progress in GameShippingService.process_pending_orders(chunk_size=chunk_size, limit=limit):
+        print(json.dumps(progress))
+
+@shipping_bp.cli.command("import-codes")
+@click.argument("game_id", type=int)
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--column", default="code", show_default=True, help="Header of the code column (first column if absent).")
+@click.option("--delimiter", default=",", show_default=True)
+@click.option("--batch-size", type=int, default=None, help="Codes inserted and committed together.")
+def import_codes_command(game_id, path, column, delimiter, batch_size):
+    """Stream supplier codes from a CSV file into a game's code vault."""
+    batch_size = batch_size or current_app.config.get("VAULT_IMPORT_BATCH_SIZE", 5000)
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        codes = read_codes_csv(stream, column=column, delimiter=delimiter)
+        for progress in CodeVault.import_codes(game_id, codes, source=os.path.basename(path), batch_size=batch_size):
+            print(json.dumps(progress))
+
+@shipping_bp.cli.command("vault-status")
+def vault_status_command():
+    """Show the available codes of every game stocked from the code vault."""
+    threshold = current_app.config.get("VAULT_LOW_STOCK_THRESHOLD", 100)
+    available = CodeVault.available_counts()
+    for game in Game.query.filter(Game.uses_code_vault.is_(True)).order_by(Game.id):
+        count = available.get(game.id, 0)
+        print(f"{game.id}\t{game.name}\t{count}{'  LOW' if count < threshold else ''}")
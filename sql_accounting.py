@@ -0,0 +1,126 @@
+import json
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# A parenthesised list of bound parameters: IN lists and multi-row VALUES vary in length with the data
+_PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_VALUES_ROWS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+
+class RepeatedStatementError(Exception):
+    """Raised after a request that ran the same statement shape more than SQL_REPEAT_LIMIT times (an N+1 loop)"""
+    def __init__(self, endpoint, shape, count):
+        super().__init__(f"{endpoint} ran this statement {count} times in one request: {shape}")
+        self.endpoint = endpoint
+        self.shape = shape
+        self.count = count
+
+def statement_shape(statement):
+    """The statement with its whitespace and parameter lists collapsed, so each run of a lazy load looks the same"""
+    return _VALUES_ROWS.sub("(?)", _PARAMETER_LIST.sub("(?)", " ".join(statement.split())))
+
+class RequestSqlStats:
+    """Statements one request sent to the database: how many, how long they took, and each shape's count"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.duration = 0.0 # Seconds
+        self.shapes = Counter()
+        self.deliberate = 0 # Depth of deliberate_repeats() blocks
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if not self.deliberate:
+            self.shapes[statement_shape(statement)] += 1
+
+    def most_repeated(self):
+        """(shape, count) of the statement run most often, or (None, 0)"""
+        return self.shapes.most_common(1)[0] if self.shapes else (None, 0)
+
+    def server_timing(self):
+        total = (time.perf_counter() - self.started) * 1000
+        return f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries", app;dur={total:.2f}'
+
+@contextmanager
+def deliberate_repeats():
+    """Leave the statements of a loop that repeats them on purpose (polling, batches) out of the repeat check.
+
+    They are still counted and timed.
+    """
+    stats = _request_stats()
+    if stats is None:
+        yield
+        return
+    stats.deliberate += 1
+    try:
+        yield
+    finally:
+        stats.deliberate -= 1
+
+def _request_stats():
+    return g.get("sql_stats") if has_request_context() else None
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats() is not None:
+        conn.info.setdefault("sql_accounting_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    started = conn.info.get("sql_accounting_started")
+    if stats is not None and started:
+        stats.record(statement, time.perf_counter() - started.pop())
+
+def _setting(name):
+    """A boolean accounting setting; unset means on only in debug and testing"""
+    value = current_app.config.get(name)
+    return (current_app.debug or current_app.testing) if value is None else value
+
+def _start_request():
+    if _setting("SQL_ACCOUNTING_ENABLED"):
+        g.sql_stats = RequestSqlStats()
+
+def _finish_request(response):
+    stats = g.pop("sql_stats", None)
+    if stats is None:
+        return response
+    # Streamed bodies run their queries after this point; only the view's own are counted
+    response.headers.add("Server-Timing", stats.server_timing())
+    shape, repeats = stats.most_repeated()
+    if _setting("SQL_ACCOUNTING_LOG"):
+        current_app.logger.info(json.dumps({
+            "event": "request_sql",
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": stats.count,
+            "db_ms": round(stats.duration * 1000, 2),
+            "total_ms": round((time.perf_counter() - stats.started) * 1000, 2),
+            "max_repeats": repeats,
+        }, ensure_ascii=False))
+    limit = current_app.config.get("SQL_REPEAT_LIMIT")
+    if limit is not None and repeats > limit:
+        raise RepeatedStatementError(request.endpoint, shape, repeats)
+    return response
+
+def init_sql_accounting(app):
+    """Count and time every request's statements; see RequestSqlStats.
+
+    With SQL_ACCOUNTING_ENABLED, each response gets a Server-Timing header
+    (database time and query count, and the whole request's time) and, with
+    SQL_ACCOUNTING_LOG, one JSON line on the app logger. Both default to on
+    only in debug and testing. With SQL_REPEAT_LIMIT set (the tests set it), a request
+    that runs one statement shape more often than that raises
+    RepeatedStatementError once its response is built, so N+1 loops fail
+    loudly instead of just running slowly.
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -1,17 +1,88 @@
 import unittest
 import os
-from datetime import datetime
+import re
+import gzip
+import csv
+import io
+import base64
+import json
+import socket
+import asyncio
+from email import message_from_bytes
+from email.policy import default as email_policy
+from email.message import EmailMessage
+import tempfile
+import sqlite3
+import time
+import multiprocessing
+import threading
+import contextlib
+from datetime import date, datetime, timedelta
+from flask import g, jsonify
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.security import generate_password_hash
 from app import create_app, db
 # Explicitly import all models needed for testing *before* test classes
-from models import User, Game, Order, OrderItem, Payment, Cart, CartItem 
+from models import User, Game, Order, OrderItem, Payment, Cart, CartItem, StockReservation, Job, CodeSequence, VaultCode, IdempotencyKey, SalesDaily, SalesDailyGame
 from config import Config
 from shipping import GameShippingService
+from catalog import CatalogService, CatalogCache, _cache_key
+from shared_cache import SharedCache
+from search import GameSearchIndex, SEARCH_TABLE, normalize_arabic
+from inventory import InventoryService
+from jobs import JobQueue
+from benchmarks import hot_sku_reservations, seed_dataset, load_test, compare_to_baseline
+from mailer import Mailer, MailBackpressure, build_order_confirmation
+from codes import CodeGenerator, FeistelPermutation, get_code_generator
+from vault import CodeVault, VaultExhausted, read_codes_csv
+from hashing import PasswordHasher
+from identity import IdentityCache, invalidate_identity
+from db_routing import ReplicationLagSimulator
+from idempotency import purge_expired_keys, request_fingerprint, commit_with_response
+from admin_service import AdminListingService, ADMIN_ORDER_SORTS
+from export import OrderExport
+from rollups import SalesRollup
+from catalog_import import CatalogImport, read_feed_csv, read_feed_json
+from sql_accounting import RepeatedStatementError, deliberate_repeats, statement_shape
+try:
+    from aiosmtpd.controller import Controller
+except ImportError: # Optional: only the SMTP delivery tests need a local server
+    Controller = None
 
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:" # Use in-memory SQLite for tests
     WTF_CSRF_ENABLED = False # Disable CSRF for testing forms
     SECRET_KEY = "test-secret-key"
+    SHARED_CACHE_PATH = None # Keep the catalog cache in memory, per app
+    SQL_ACCOUNTING_LOG = False
+    SQL_REPEAT_LIMIT = 5 # Every request of every test doubles as an N+1 check
+
+class QueryCounter:
+    """Context manager counting the SQL statements sent to the engine"""
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.executions = [] # (statement, parameters) of single executions, for EXPLAIN
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        if not executemany:
+            self.executions.append((statement, parameters))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._record)
 
 class UserModelCase(unittest.TestCase):
     def setUp(self):
@@ -173,12 +244,17 @@ class IntegrationTestCase(unittest.TestCase):
         self.assertIn("order_id", json_response)
         order_id = json_response["order_id"]
 
-        # Verify order exists
+        # Verify order exists; fulfillment is queued, not run inside the request
         order = Order.query.get(order_id)
         self.assertIsNotNone(order)
         self.assertEqual(order.user_id, self.test_user.id)  # Changed from customer_id to user_id to match model
         self.assertEqual(order.total_amount, 5.00)
-        self.assertEqual(order.status, "completed") # Status after fulfillment (changed from pending as fulfillment happens immediately)
+        self.assertEqual(order.status, "pending")
+
+        # Run the background worker until the queue is empty
+        self.assertEqual(JobQueue.work(once=True), 1)
+        db.session.refresh(order)
+        self.assertEqual(order.status, "completed")
         
         # Check order items
         items = OrderItem.query.filter_by(order_id=order_id).all()
@@ -192,5 +268,2016 @@ class IntegrationTestCase(unittest.TestCase):
 
     # Add more tests for admin functions, order fulfillment, etc.
 
+class CartReadModelCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        u = User(username="cartuser", email="cart@example.com")
+        u.set_password("password")
+        db.session.add(u)
+        db.session.add(Cart(customer=u))
+        self.games = [Game(name=f"Game {i}", price=1.50, game_type="test", stock=100) for i in range(30)]
+        db.session.add_all(self.games)
+        db.session.commit()
+        self.client.post("/auth/login", data={"email": "cart@example.com", "password": "password"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _cart_queries(self):
+        with QueryCounter(db.engine) as counter:
+            response = self.client.get("/api/cart")
+        self.assertEqual(response.status_code, 200)
+        return counter.count, response.get_json()["data"]
+
+    def test_cart_query_count_does_not_grow_with_cart_size(self):
+        self.client.post("/api/cart/add", json={"game_id": self.games[0].id, "quantity": 2})
+        small_count, small_data = self._cart_queries()
+        self.assertEqual(len(small_data["items"]), 1)
+        self.assertEqual(small_data["total"], 3.00)
+
+        for game in self.games[1:]:
+            self.client.post("/api/cart/add", json={"game_id": game.id, "quantity": 1})
+        large_count, large_data = self._cart_queries()
+        self.assertEqual(len(large_data["items"]), 30)
+        self.assertEqual(large_data["total"], 46.50)
+        self.assertEqual(large_count, small_count)
+
+    def test_empty_cart_summary(self):
+        count, data = self._cart_queries()
+        self.assertEqual(data["items"], [])
+        self.assertEqual(data["total"], 0)
+
+    def _count(self):
+        return self.client.get("/api/cart/count").get_json()["data"]
+
+    def test_counters_follow_cart_changes(self):
+        self.assertEqual(self._count(), {"item_count": 0, "subtotal": 0.0})
+        self.client.post("/api/cart/add", json={"game_id": self.games[0].id, "quantity": 2})
+        self.client.post("/api/cart/add", json={"game_id": self.games[1].id, "quantity": 1})
+        self.client.post("/api/cart/add", json={"game_id": self.games[0].id, "quantity": 1})
+        self.assertEqual(self._count(), {"item_count": 4, "subtotal": 6.0})
+        items = {item["game_id"]: item["item_id"] for item in self.client.get("/api/cart").get_json()["data"]["items"]}
+        self.client.put(f"/api/cart/update/{items[self.games[0].id]}", json={"quantity": 1})
+        self.assertEqual(self._count(), {"item_count": 2, "subtotal": 3.0})
+        self.client.delete(f"/api/cart/remove/{items[self.games[1].id]}")
+        self.assertEqual(self._count(), {"item_count": 1, "subtotal": 1.5})
+        self.client.delete("/api/cart/clear")
+        self.assertEqual(self._count(), {"item_count": 0, "subtotal": 0.0})
+
+    def test_count_endpoint_reads_one_row(self):
+        self.client.post("/api/cart/add", json={"game_id": self.games[0].id, "quantity": 2})
+        engine = db.engine
+        self.app_context.pop() # Own app context, as in a real request
+        try:
+            with QueryCounter(engine) as counter:
+                self.assertEqual(self.client.get("/api/cart/count").get_json()["data"]["item_count"], 2)
+        finally:
+            self.app_context.push()
+        self.assertEqual([s for s in counter.statements if "FROM cart_item" in s or "JOIN cart_item" in s], [])
+        self.assertEqual(len([s for s in counter.statements if "FROM cart \n" in s]), 1)
+
+    def test_rebuild_repairs_drifted_counters(self):
+        self.client.post("/api/cart/add", json={"game_id": self.games[0].id, "quantity": 2})
+        cart = Cart.query.one()
+        cart.item_count, cart.subtotal = 99, 0.0
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=["admin", "rebuild-cart-counters"])
+        self.assertIn("Rebuilt counters of 1 carts.", result.output)
+        self.assertEqual(self._count(), {"item_count": 2, "subtotal": 3.0})
+        self.assertIn("of 0 carts", self.app.test_cli_runner().invoke(args=["admin", "rebuild-cart-counters"]).output)
+
+class OrderHistoryCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        u = User(username="historyuser", email="history@example.com")
+        u.set_password("password")
+        g = Game(name="History Game", price=2.00, game_type="test", stock=100)
+        db.session.add_all([u, g])
+        db.session.flush()
+        # Several orders share a created_at so the id tie-breaker is exercised
+        base = datetime(2025, 1, 1)
+        self.orders = []
+        for i in range(45):
+            order = Order(user_id=u.id, total_amount=2.00 * (i % 3 + 1), status="completed",
+                          created_at=base.replace(day=1 + i // 3))
+            db.session.add(order)
+            db.session.flush()
+            for _ in range(i % 3 + 1):
+                db.session.add(OrderItem(order_id=order.id, game_id=g.id, quantity=1, price=2.00))
+            self.orders.append(order)
+        db.session.commit()
+        self.client.post("/auth/login", data={"email": "history@example.com", "password": "password"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_keyset_pages_cover_history_once_in_order(self):
+        expected = sorted(self.orders, key=lambda o: (o.created_at, o.id), reverse=True)
+        seen = []
+        query_counts = []
+        cursor = None
+        while True:
+            params = {"limit": 20}
+            if cursor:
+                params["cursor"] = cursor
+            with QueryCounter(db.engine) as counter:
+                response = self.client.get("/api/orders", query_string=params)
+            query_counts.append(counter.count)
+            data = response.get_json()
+            self.assertTrue(data["success"])
+            seen.extend(data["data"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual([o["id"] for o in seen], [o.id for o in expected])
+        self.assertEqual([o["items_count"] for o in seen], [o.items.count() for o in expected])
+        self.assertEqual(len(query_counts), 3)
+        self.assertEqual(len(set(query_counts)), 1)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/orders?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_of_the_wrong_shape_is_rejected(self):
+        def token(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+        for value in (7, {"a": 1, "b": 2}, [{"dt": 5}, 1], [[1], 2], "ab"):
+            response = self.client.get("/api/games", query_string={"cursor": token(value)})
+            self.assertEqual(response.status_code, 400, value)
+
+    def test_orders_page_renders_first_page(self):
+        response = self.client.get("/orders")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'"id": {self.orders[-1].id}'.encode("utf-8"), response.data)
+
+class CatalogApiCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        games = []
+        for i in range(50):
+            games.append(Game(name=f"Catalog {i:02d}", price=float(i % 10), stock=5,
+                              game_type="pubg" if i % 2 else "free_fire",
+                              category="currency", region="global" if i % 5 else "EU",
+                              is_active=i != 0))
+        db.session.add_all(games)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _all_pages(self, **params):
+        results = []
+        cursor = None
+        while True:
+            query = dict(params, limit=7)
+            if cursor:
+                query["cursor"] = cursor
+            data = self.client.get("/api/games", query_string=query).get_json()
+            self.assertTrue(data["success"])
+            results.extend(data["data"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                return results, data["total"]
+
+    def test_filters_and_sorting(self):
+        games, total = self._all_pages(game_type="pubg", min_price=3, max_price=7, sort="price_asc")
+        expected = sorted(
+            (g for g in Game.query.all()
+             if g.is_active and g.game_type == "pubg" and 3 <= g.price <= 7),
+            key=lambda g: (g.price, g.id))
+        self.assertEqual([g["id"] for g in games], [g.id for g in expected])
+        self.assertEqual(total, len(expected))
+
+    def test_default_sort_lists_every_active_game_once(self):
+        games, total = self._all_pages()
+        self.assertEqual(len(games), 49)
+        self.assertEqual(len({g["id"] for g in games}), 49)
+        self.assertEqual(total, 49)
+
+    def test_total_count_is_cached(self):
+        self.assertEqual(self.client.get("/api/games?region=EU").get_json()["total"], 9)
+        db.session.add(Game(name="Late", price=1, game_type="pubg", region="EU"))
+        db.session.commit()
+        with QueryCounter(db.engine) as counter:
+            data = self.client.get("/api/games?region=EU").get_json()
+        self.assertEqual(data["total"], 9)
+        self.assertFalse(any("count(" in s.lower() for s in counter.statements))
+
+    def test_unknown_sort_is_rejected(self):
+        self.assertEqual(self.client.get("/api/games?sort=random").status_code, 400)
+
+    def test_filters_are_normalised_before_keying_the_cache(self):
+        filters = CatalogService.parse_filters(MultiDict({
+            "min_price": "2.499999", "max_price": "nan", "region": "x" * 65, "category": " RPG "}))
+        self.assertEqual(filters, {"min_price": 2.5, "category": "RPG"})
+        self.assertTrue(_cache_key("api_page", {}, "newest", "c" * 500, 20).startswith("sha1:"))
+
+def _build_in_worker(path, marker_path):
+    def builder():
+        with open(marker_path, "a") as marker:
+            marker.write("built\n")
+        import time
+        time.sleep(0.3)
+        return {"answer": 42}
+    return SharedCache(path).get_or_build("catalog", "hot", builder)
+
+class SharedCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_entries_are_shared_and_invalidated_by_version(self):
+        worker_a = SharedCache(self.path)
+        worker_b = SharedCache(self.path)
+        self.assertEqual(worker_a.get_or_build("catalog", "k", lambda: [1]), [1])
+        self.assertEqual(worker_b.get_or_build("catalog", "k", lambda: self.fail("rebuilt")), [1])
+        worker_b.bump_version("catalog")
+        self.assertEqual(worker_a.get_or_build("catalog", "k", lambda: [2]), [2])
+
+    def test_entries_are_capped(self):
+        memory = SharedCache(max_entries=3)
+        for key in "abc":
+            memory.get_or_build("catalog", key, lambda: key)
+        memory.get_or_build("catalog", "a", lambda: self.fail("rebuilt")) # Used again: "b" is now the oldest
+        memory.get_or_build("catalog", "d", lambda: "d")
+        self.assertEqual(list(memory._memory_entries), ["catalog:c", "catalog:a", "catalog:d"])
+
+        shared = SharedCache(self.path, max_entries=3, ttl=60)
+        for key in "abcde":
+            shared.get_or_build("catalog", key, lambda: key)
+        self.assertEqual(shared.prune(), 2)
+        count = sqlite3.connect(self.path).execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self.assertEqual(count, 3)
+        shared.ttl = -1 # Everything is past its TTL
+        self.assertEqual(shared.prune(), 3)
+
+    def test_concurrent_misses_build_once_across_processes(self):
+        marker = os.path.join(self.tmpdir.name, "builds.txt")
+        SharedCache(self.path) # create the schema before the workers race
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(4) as pool:
+            results = pool.starmap(_build_in_worker, [(self.path, marker)] * 4)
+        self.assertEqual(results, [{"answer": 42}] * 4)
+        with open(marker) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+class CatalogCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        admin = User(username="admin", email="admin@example.com", is_admin=True)
+        admin.set_password("admin123")
+        self.game = Game(name="Cached Game", price=3.0, game_type="pubg", stock=5, description="")
+        db.session.add_all([admin, self.game])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_reads_are_served_from_snapshot(self):
+        self.client.get(f"/api/games/{self.game.id}")
+        with QueryCounter(db.engine) as counter:
+            response = self.client.get(f"/api/games/{self.game.id}")
+        self.assertEqual(response.get_json()["data"]["name"], "Cached Game")
+        self.assertEqual(counter.count, 1) # The live stock lookup
+
+    def test_stock_is_read_live(self):
+        self.assertEqual(self.client.get(f"/api/games/{self.game.id}").get_json()["data"]["stock"], 5)
+        self.assertTrue(InventoryService.take(self.game.id, 2))
+        db.session.commit()
+        self.assertEqual(self.client.get(f"/api/games/{self.game.id}").get_json()["data"]["stock"], 3)
+
+    def test_admin_edit_bumps_catalog_version(self):
+        self.assertEqual(self.client.get(f"/api/games/{self.game.id}").get_json()["data"]["price"], 3.0)
+        self.client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        response = self.client.post(f"/admin/games/edit/{self.game.id}", data={
+            "name": "Cached Game", "price": 4.5, "game_type": "pubg", "stock": 5, "is_active": "y"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get(f"/api/games/{self.game.id}").get_json()["data"]["price"], 4.5)
+
+    def test_admin_delete_bumps_catalog_version(self):
+        self.assertEqual(self.client.get("/api/games").get_json()["total"], 1)
+        self.client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        self.client.post(f"/admin/games/delete/{self.game.id}")
+        self.assertEqual(self.client.get("/api/games").get_json()["total"], 0)
+        self.assertEqual(self.client.get(f"/api/games/{self.game.id}").status_code, 404)
+
+class ConditionalRequestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        u = User(username="poller", email="poller@example.com")
+        u.set_password("password")
+        self.game = Game(name="Polled Game", price=2.0, game_type="pubg", stock=5)
+        db.session.add_all([u, self.game])
+        db.session.flush()
+        self.order = Order(user_id=u.id, total_amount=2.0, status="pending")
+        db.session.add(self.order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=self.order.id, game_id=self.game.id, quantity=1, price=2.0))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _revalidate(self, url, etag):
+        return self.client.get(url, headers={"If-None-Match": etag})
+
+    def test_game_list_returns_304_until_catalog_changes(self):
+        url = "/api/games?sort=name"
+        etag = self.client.get(url).headers["ETag"]
+        with QueryCounter(db.engine) as counter:
+            second = self._revalidate(url, etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b"")
+        self.assertEqual(counter.count, 0)
+
+        CatalogCache.bump()
+        self.assertEqual(self._revalidate(url, etag).status_code, 200)
+
+    def test_game_detail_returns_304_until_the_game_changes(self):
+        url = f"/api/games/{self.game.id}"
+        etag = self.client.get(url).headers["ETag"]
+        with QueryCounter(db.engine) as counter:
+            second = self._revalidate(url, etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(counter.count, 1) # The updated_at lookup
+
+        self.assertTrue(InventoryService.take(self.game.id, 1))
+        db.session.commit()
+        response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.get_json()["data"]["stock"], 4)
+
+    def test_game_detail_honours_if_modified_since(self):
+        first = self.client.get(f"/api/games/{self.game.id}")
+        last_modified = first.headers["Last-Modified"]
+        response = self.client.get(f"/api/games/{self.game.id}", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_order_detail_etag_follows_updated_at(self):
+        self.client.post("/auth/login", data={"email": "poller@example.com", "password": "password"})
+        url = f"/api/orders/{self.order.id}"
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self._revalidate(url, etag).status_code, 304)
+
+        self.order.status = "completed"
+        self.order.updated_at = datetime(2030, 1, 1)
+        db.session.commit()
+        response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["data"]["status"], "completed")
+
+    def test_order_detail_of_another_user_is_not_found(self):
+        self.client.post("/auth/login", data={"email": "poller@example.com", "password": "password"})
+        self.assertEqual(self.client.get("/api/orders/9999").status_code, 404)
+
+class GameSearchCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.uc = Game(name="شدات ببجي موبايل 60", description="شحن فوري", price=1.0,
+                       game_type="pubg", category="عملة")
+        self.diamonds = Game(name="جواهر فري فاير", description="الماسة الأولى", price=2.0,
+                             game_type="free_fire", category="عملة")
+        self.hidden = Game(name="شدات قديمة", price=1.0, game_type="pubg", is_active=False)
+        self.pass_ = Game(name="Royale Pass", description="موسم جديد مع شدات إضافية", price=9.0,
+                          game_type="pubg", category="pass")
+        db.session.add_all([self.uc, self.diamonds, self.hidden, self.pass_])
+        db.session.commit()
+        GameSearchIndex.rebuild()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_normalize_arabic(self):
+        self.assertEqual(normalize_arabic("شَدّات"), "شدات")
+        self.assertEqual(normalize_arabic("إصدار أولى"), "اصدار اولي")
+        self.assertEqual(normalize_arabic("مجانيّة"), "مجانيه")
+        self.assertEqual(normalize_arabic("PUBGشدات٦٠"), "pubg شدات 60")
+
+    def test_search_ranks_name_matches_first_and_skips_inactive(self):
+        results = GameSearchIndex.search("شَدّات")
+        self.assertEqual([g.id for g in results], [self.uc.id, self.pass_.id])
+
+    def test_search_normalizes_alef_yaa_and_mixed_tokens(self):
+        self.assertEqual([g.id for g in GameSearchIndex.search("الماسة الاولى")], [self.diamonds.id])
+        self.assertEqual([g.id for g in GameSearchIndex.search("pubgشدات")], [self.uc.id, self.pass_.id])
+        self.assertEqual([g.id for g in GameSearchIndex.search("free fire")], [self.diamonds.id])
+
+    def test_admin_writes_update_index_incrementally(self):
+        admin = User(username="admin", email="admin@example.com", is_admin=True)
+        admin.set_password("admin123")
+        db.session.add(admin)
+        db.session.commit()
+        self.client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        self.client.post("/admin/games", data={
+            "name": "بطاقة ستيم", "price": 5, "game_type": "steam", "stock": 3, "is_active": "y"})
+        steam = Game.query.filter_by(game_type="steam").one()
+        self.assertEqual([g.id for g in GameSearchIndex.search("ستيم")], [steam.id])
+
+        self.client.post(f"/admin/games/edit/{steam.id}", data={
+            "name": "بطاقة بلايستيشن", "price": 5, "game_type": "steam", "stock": 3, "is_active": "y"})
+        self.assertEqual(GameSearchIndex.search("ستيم"), [])
+        self.assertEqual(len(GameSearchIndex.search("بلايستيشن")), 1)
+
+        self.client.post(f"/admin/games/delete/{steam.id}")
+        self.assertEqual(GameSearchIndex.search("بلايستيشن"), [])
+
+    def test_requests_search_with_like_until_the_index_is_built(self):
+        db.session.execute(text(f"DROP TABLE {SEARCH_TABLE}"))
+        db.session.commit()
+        self.app.extensions.pop("game_search_ready", None)
+        GameSearchIndex.index_games([self.uc]) # Left to the next rebuild
+        data = self.client.get("/api/games/search", query_string={"q": "جواهر"}).get_json()
+        self.assertEqual([g["id"] for g in data["data"]], [self.diamonds.id])
+        self.assertFalse(GameSearchIndex.is_ready())
+
+        GameSearchIndex.rebuild()
+        self.assertTrue(GameSearchIndex.is_ready())
+        self.assertEqual([g.id for g in GameSearchIndex.search("شَدّات")], [self.uc.id, self.pass_.id])
+
+    def test_search_endpoints(self):
+        data = self.client.get("/api/games/search", query_string={"q": "جواهر"}).get_json()
+        self.assertEqual([g["id"] for g in data["data"]], [self.diamonds.id])
+        self.assertEqual(self.client.get("/api/games/search").status_code, 400)
+        response = self.client.get("/search", query_string={"query": "جواهر"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("جواهر فري فاير".encode("utf-8"), response.data)
+
+_job_calls = []
+
+@JobQueue.handler("test_flaky")
+def _flaky_job(payload):
+    _job_calls.append(payload["n"])
+    if payload.get("fail"):
+        raise RuntimeError("boom")
+
+class JobQueueCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        del _job_calls[:]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_claim_is_exclusive_until_visibility_timeout(self):
+        job = JobQueue.enqueue("test_flaky", {"n": 1})
+        db.session.commit()
+        self.assertEqual(JobQueue.claim("worker-a", visibility_timeout=60), [job.id])
+        self.assertEqual(JobQueue.claim("worker-b"), [])
+        # worker-a dies; once its claim times out the job is handed to worker-b
+        later = datetime.utcnow() + timedelta(seconds=61)
+        self.assertEqual(JobQueue.claim("worker-b", now=later), [job.id])
+        self.assertFalse(JobQueue.complete(job.id, "worker-a"))
+        self.assertTrue(JobQueue.run_job(job.id, "worker-b"))
+        job = db.session.get(Job, job.id, populate_existing=True)
+        self.assertEqual((job.status, job.attempts), ("done", 2))
+        self.assertEqual(_job_calls, [1])
+
+    def test_failed_jobs_are_retried_then_parked(self):
+        job = JobQueue.enqueue("test_flaky", {"n": 2, "fail": True}, max_attempts=2)
+        db.session.commit()
+        with self.assertLogs(self.app.logger, "ERROR") as logs:
+            self.assertEqual(JobQueue.work("w", once=True), 1)
+        self.assertIn("Traceback", logs.output[0]) # Logged with its traceback
+        job = db.session.get(Job, job.id, populate_existing=True)
+        self.assertEqual(job.status, "queued")
+        self.assertIn("boom", job.last_error)
+        self.assertEqual(JobQueue.claim("w", now=job.run_at), [job.id])
+        JobQueue.run_job(job.id, "w")
+        job = db.session.get(Job, job.id, populate_existing=True)
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertEqual(JobQueue.work("w", once=True), 0)
+
+    def test_dedupe_key_queues_a_job_once(self):
+        JobQueue.enqueue("test_flaky", {"n": 4}, dedupe_key="once")
+        db.session.commit()
+        JobQueue.work("w", once=True)
+        JobQueue.enqueue("test_flaky", {"n": 4}, dedupe_key="once") # Even after it ran
+        JobQueue.enqueue_many("test_flaky", [{"n": 5}, {"n": 4}], dedupe_keys=["other", "once"])
+        db.session.commit()
+        JobQueue.work("w", once=True)
+        self.assertEqual(_job_calls, [4, 5])
+
+    def test_rolled_back_enqueue_leaves_no_job(self):
+        JobQueue.enqueue("test_flaky", {"n": 3})
+        db.session.rollback()
+        self.assertEqual(Job.query.count(), 0)
+
+class StockReservationCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.user = User(username="buyer", email="buyer@example.com")
+        self.user.set_password("password")
+        self.game = Game(name="Limited Game", price=2.0, game_type="test", stock=3)
+        db.session.add_all([self.user, self.game])
+        db.session.commit()
+        self.client.post("/auth/login", data={"email": "buyer@example.com", "password": "password"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _stock(self):
+        return db.session.query(Game.stock).filter_by(id=self.game.id).scalar()
+
+    def test_checkout_holds_stock_and_fulfillment_consumes_it_once(self):
+        self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 2})
+        response = self.client.post("/api/checkout", json={"payment_method": "simulated_credit_card"})
+        self.assertEqual(response.status_code, 200)
+        order_id = response.get_json()["order_id"]
+        self.assertEqual(self._stock(), 1)
+        JobQueue.work(once=True)
+        self.assertEqual(self._stock(), 1)
+        reservation = StockReservation.query.filter_by(order_id=order_id).one()
+        self.assertEqual((reservation.quantity, reservation.status), (2, "consumed"))
+        self.assertEqual(db.session.get(Order, order_id).status, "completed")
+
+    def test_checkout_refuses_more_than_available(self):
+        self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 4})
+        response = self.client.post("/api/checkout", json={"payment_method": "simulated_credit_card"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.query.count(), 0)
+        self.assertEqual(StockReservation.query.count(), 0)
+        self.assertEqual(self._stock(), 3)
+
+    def test_checkout_names_the_short_game_of_a_multi_game_cart(self):
+        other = Game(name="Plenty Game", price=1.0, game_type="test", stock=10)
+        db.session.add(other)
+        db.session.commit()
+        self.client.post("/api/cart/add", json={"game_id": other.id, "quantity": 2})
+        self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 4})
+        response = self.client.post("/api/checkout", json={"payment_method": "simulated_credit_card"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Limited Game", response.get_json()["message"])
+        self.assertEqual(db.session.query(Game.stock).filter_by(id=other.id).scalar(), 10)
+        self.assertEqual(self._stock(), 3)
+        self.assertEqual(Order.query.count(), 0)
+
+    def test_checkout_statements_do_not_grow_with_the_cart(self):
+        def checkout_statements(games):
+            for game in games:
+                self.client.post("/api/cart/add", json={"game_id": game.id, "quantity": 1})
+            with QueryCounter(db.engine) as counter:
+                response = self.client.post("/api/checkout", json={"payment_method": "simulated_credit_card"})
+            self.assertEqual(response.status_code, 200)
+            return counter.count
+
+        games = [Game(name=f"Game {i}", price=1.5, game_type="test", stock=5) for i in range(10)]
+        db.session.add_all(games)
+        db.session.commit()
+        self.assertEqual(checkout_statements(games[:2]), checkout_statements(games))
+        order = Order.query.order_by(Order.id.desc()).first()
+        self.assertEqual(OrderItem.query.filter_by(order_id=order.id).count(), 10)
+        self.assertEqual(order.total_amount, 15.0)
+        self.assertEqual(CartItem.query.count(), 0)
+
+    def test_sweeper_releases_only_expired_holds(self):
+        InventoryService.reserve(None, {self.game.id: 1}, ttl=-1)
+        InventoryService.reserve(None, {self.game.id: 1})
+        db.session.commit()
+        self.assertEqual(self._stock(), 1)
+        self.assertEqual(InventoryService.release_expired(), 1)
+        self.assertEqual(self._stock(), 2)
+        self.assertEqual(InventoryService.release_expired(datetime.utcnow() + timedelta(days=1)), 1)
+        self.assertEqual(self._stock(), 3)
+
+    def test_sweeper_keeps_holds_of_paid_orders_queued_for_fulfillment(self):
+        self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 3})
+        order_id = self.client.post("/api/checkout", json={"payment_method": "simulated_credit_card"}).get_json()["order_id"]
+        later = datetime.utcnow() + timedelta(days=1) # The fulfillment job is still queued
+        self.assertEqual(InventoryService.release_expired(later), 0)
+        self.assertEqual(self._stock(), 0)
+        self.assertTrue(GameShippingService.fulfill_order(order_id)[0])
+        self.assertEqual(self._stock(), 0)
+        self.assertEqual(StockReservation.query.filter_by(order_id=order_id).one().status, "consumed")
+
+class HotSkuStressCase(unittest.TestCase):
+    def test_concurrent_reservations_never_oversell(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result = hot_sku_reservations(os.path.join(tmpdir, "stress.db"), workers=4, stock=60)
+        self.assertEqual(result["reserved"], 60)
+        self.assertEqual(result["held"], 60)
+        self.assertEqual(result["final_stock"], 0)
+        self.assertEqual(result["oversold"], 0)
+
+class LoadBenchmarkCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database_url = "sqlite:///" + os.path.join(self.tmpdir.name, "bench.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _read(self, sql):
+        connection = sqlite3.connect(self.database_url[len("sqlite:///"):])
+        try:
+            return connection.execute(sql).fetchall()
+        finally:
+            connection.close()
+
+    def test_seeded_dataset_is_reproducible_and_consistent(self):
+        counts = seed_dataset(self.database_url, games=50, users=40, orders=300, seed=7, batch_size=64)
+        self.assertEqual(self._read("SELECT COUNT(*) FROM \"order\"")[0][0], 300)
+        self.assertEqual(self._read("SELECT COUNT(*) FROM order_item")[0][0], counts["items"])
+        self.assertEqual(self._read("SELECT COUNT(*) FROM cart")[0][0], 40)
+        # Totals add up, completed items carry codes and the rollups count every completed order
+        self.assertEqual(self._read(
+            "SELECT COUNT(*) FROM \"order\" o WHERE ABS(o.total_amount - (SELECT SUM(quantity * price) "
+            "FROM order_item WHERE order_id = o.id)) > 0.01")[0][0], 0)
+        self.assertEqual(self._read(
+            "SELECT COUNT(*) FROM order_item i JOIN \"order\" o ON o.id = i.order_id "
+            "WHERE o.status = 'completed' AND i.code IS NULL")[0][0], 0)
+        self.assertEqual(self._read("SELECT SUM(order_count) FROM sales_daily")[0][0],
+                         self._read("SELECT COUNT(*) FROM \"order\" WHERE status = 'completed'")[0][0])
+        first = self._read("SELECT * FROM order_item ORDER BY id")
+
+        self.tmpdir.cleanup()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database_url = "sqlite:///" + os.path.join(self.tmpdir.name, "bench.db")
+        seed_dataset(self.database_url, games=50, users=40, orders=300, seed=7, batch_size=128)
+        self.assertEqual(self._read("SELECT * FROM order_item ORDER BY id"), first)
+
+    def test_load_test_reports_every_step_of_the_flow(self):
+        seed_dataset(self.database_url, games=50, users=40, orders=100)
+        report = load_test(self.database_url, clients=2, duration=1.5, warmup=0)
+        for endpoint in ["GET /api/games", "GET /api/games/<id>", "POST /api/cart/add", "GET /api/cart",
+                         "POST /api/checkout", "GET /api/orders", "GET /api/orders/<id>"]:
+            result = report["endpoints"][endpoint]
+            self.assertGreater(result["requests"], 0)
+            self.assertEqual(result["errors"], 0)
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+            self.assertIsNotNone(result["queries"]) # Read from the Server-Timing header
+        self.assertEqual(compare_to_baseline(report, report), [])
+
+    def test_baseline_comparison_flags_regressions(self):
+        def report(p95, throughput, queries, errors=0):
+            return {"clients": 4, "duration": 10.0, "endpoints": {"GET /api/orders": {
+                "requests": 50, "errors": errors, "p50_ms": 5.0, "p95_ms": p95, "p99_ms": p95 * 3,
+                "throughput": throughput, "db_ms": 1.0, "queries": queries}}}
+
+        baseline = report(10.0, 100.0, 2.0)
+        self.assertEqual(compare_to_baseline(report(11.0, 90.0, 2.0), baseline), []) # Within 20%, p99 too few to compare
+        regressions = compare_to_baseline(report(13.0, 70.0, 12.0, errors=3), baseline)
+        self.assertEqual(len(regressions), 4)
+        self.assertIn("GET /api/orders: p95_ms 10.0 -> 13.0", regressions)
+
+class BatchFulfillmentCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username="batch", email="batch@example.com")
+        self.user.set_password("password")
+        self.game = Game(name="Batch Game", price=1.0, game_type="pubg", stock=100)
+        db.session.add_all([self.user, self.game])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _paid_orders(self, count, quantity=1, payment_status="completed"):
+        for _ in range(count):
+            order = Order(user_id=self.user.id, total_amount=quantity, status="pending")
+            order.items.append(OrderItem(game_id=self.game.id, quantity=quantity, price=1.0))
+            order.payment = Payment(payment_method="card", amount=quantity, status=payment_status)
+            db.session.add(order)
+        db.session.commit()
+
+    def _stock(self):
+        return db.session.query(Game.stock).filter_by(id=self.game.id).scalar()
+
+    def test_side_by_side_runs_fulfill_each_order_once(self):
+        self._paid_orders(23)
+        self._paid_orders(2, payment_status="pending")
+        run_a = GameShippingService.process_pending_orders(chunk_size=5)
+        run_b = GameShippingService.process_pending_orders(chunk_size=5)
+        progress, runs = [], [run_a, run_b]
+        while runs: # Interleave the two runs chunk by chunk
+            run = runs.pop(0)
+            step = next(run, None)
+            if step is not None:
+                progress.append(step)
+                runs.append(run)
+        done = [p for p in progress if p.get("done")]
+        self.assertEqual(sum(p["orders"] for p in done), 23)
+        self.assertEqual(sum(p["completed"] for p in done), 23)
+        self.assertEqual(self._stock(), 77)
+        self.assertEqual(Order.query.filter_by(status="completed").count(), 23)
+        self.assertEqual(OrderItem.query.filter(OrderItem.code.isnot(None)).count(), 23)
+        self.assertEqual(Order.query.filter(Order.claim_token.isnot(None)).count(), 0)
+        self.assertEqual(Job.query.filter_by(kind="send_order_email").count(), 23)
+
+    def test_orders_claimed_elsewhere_are_skipped(self):
+        self._paid_orders(3)
+        first = Order.query.order_by(Order.id).first()
+        GameShippingService.claim_orders([first.id], "other-run")
+        summary = list(GameShippingService.process_pending_orders())[-1]
+        self.assertEqual(summary["orders"], 2)
+        self.assertEqual(db.session.get(Order, first.id, populate_existing=True).status, "pending")
+
+    def test_redelivered_fulfillment_job_takes_over_a_dead_workers_claim(self):
+        self._paid_orders(1)
+        order = Order.query.one()
+        # worker-a claimed the job and the order, then died mid-fulfillment
+        started = datetime.utcnow() - timedelta(seconds=self.app.config["JOB_VISIBILITY_TIMEOUT"] + 1)
+        JobQueue.enqueue("fulfill_order", {"order_id": order.id}).run_at = started
+        db.session.commit()
+        [job_id] = JobQueue.claim("worker-a", now=started)
+        order.claim_token, order.claimed_at = "worker-a", started
+        db.session.commit()
+        # Its job comes back only once the order claim is stale too, so the first redelivery succeeds
+        self.assertEqual(JobQueue.claim("worker-b"), [job_id])
+        self.assertTrue(JobQueue.run_job(job_id, "worker-b"))
+        self.assertEqual(db.session.get(Order, order.id, populate_existing=True).status, "completed")
+        self.assertEqual(db.session.get(Job, job_id).attempts, 2)
+
+    def test_short_stock_falls_back_to_item_by_item(self):
+        self.game.stock = 3
+        db.session.commit()
+        self._paid_orders(5)
+        summary = list(GameShippingService.process_pending_orders(chunk_size=10))[-1]
+        self.assertEqual((summary["completed"], summary["failed_fulfillment"]), (3, 2))
+        self.assertEqual(self._stock(), 0)
+
+    def test_chunk_statement_count_does_not_grow_with_chunk(self):
+        self._paid_orders(10)
+        get_code_generator().reserve("PUBG", 100) # Block leases are amortized; keep them out of the count
+        with QueryCounter(db.engine) as small:
+            list(GameShippingService.process_pending_orders(chunk_size=10))
+        self._paid_orders(50)
+        with QueryCounter(db.engine) as large:
+            list(GameShippingService.process_pending_orders(chunk_size=50))
+        self.assertEqual(small.count, large.count)
+
+    def test_partial_fulfillment_retries_only_the_rest_and_mails_each_delivery_once(self):
+        scarce = Game(name="Scarce Game", price=1.0, game_type="pubg", stock=0)
+        db.session.add(scarce)
+        db.session.commit()
+        order = Order(user_id=self.user.id, total_amount=2.0, status="pending")
+        order.items.append(OrderItem(game_id=self.game.id, quantity=1, price=1.0))
+        order.items.append(OrderItem(game_id=scarce.id, quantity=1, price=1.0))
+        db.session.add(order)
+        db.session.commit()
+
+        def email_jobs():
+            return Job.query.filter_by(kind="send_order_email").count()
+        self.assertFalse(GameShippingService.fulfill_order(order.id)[0]) # The job would be retried
+        self.assertEqual((db.session.get(Order, order.id).status, email_jobs()), ("processing", 1))
+        self.assertFalse(GameShippingService.fulfill_order(order.id)[0]) # Nothing new delivered: no email
+        self.assertEqual((self._stock(), email_jobs()), (99, 1))
+
+        db.session.get(Order, order.id).confirmation_email_id = "<first@example.com>"
+        scarce.stock = 1
+        db.session.commit()
+        self.assertTrue(GameShippingService.fulfill_order(order.id)[0])
+        self.assertEqual((self._stock(), email_jobs()), (99, 2)) # The first item was not delivered again
+        self.assertIsNone(db.session.get(Order, order.id).confirmation_email_id) # Mailed again with the new code
+
+    def test_route_streams_ndjson_progress(self):
+        admin = User(username="admin", email="admin@example.com", is_admin=True)
+        admin.set_password("admin123")
+        db.session.add(admin)
+        db.session.commit()
+        self._paid_orders(4)
+        client = self.app.test_client()
+        client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        response = client.post("/shipping/process_pending?chunk_size=3")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([line["orders"] for line in lines], [3, 1, 4])
+        self.assertTrue(lines[-1]["done"])
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class _RecordingSMTPHandler:
+    """aiosmtpd handler keeping every message and the connection it arrived on"""
+    def __init__(self, delay=0):
+        self.messages = []
+        self.sessions = set()
+        self.delay = delay
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sessions.add(id(session))
+        self.messages.append(message_from_bytes(envelope.content, policy=email_policy))
+        return "250 OK"
+
+class OrderConfirmationCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.users = [User(username=f"mail{i}", email=f"mail{i}@example.com") for i in range(2)]
+        for user in self.users:
+            user.set_password("password")
+        self.game = Game(name="Mail Game", price=1.0, game_type="pubg", stock=100)
+        db.session.add_all(self.users + [self.game])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _fulfilled_order(self, user, code=None):
+        code = code or GameShippingService.generate_digital_code("pubg")
+        order = Order(user_id=user.id, total_amount=1.0, status="completed")
+        order.items.append(OrderItem(game_id=self.game.id, quantity=1, price=1.0, code=code, status="fulfilled"))
+        db.session.add(order)
+        db.session.commit()
+        return order.id
+
+    def test_orders_of_one_customer_share_a_message(self):
+        first = self._fulfilled_order(self.users[0])
+        second = self._fulfilled_order(self.users[0])
+        other = self._fulfilled_order(self.users[1])
+        self.assertEqual(GameShippingService.send_order_confirmations([first, other]), [None, None])
+        stamps = dict(db.session.query(Order.id, Order.confirmation_email_id))
+        self.assertEqual(stamps[first], stamps[second])
+        self.assertNotEqual(stamps[first], stamps[other])
+        # The later job for the second order finds it already confirmed
+        self.assertEqual(GameShippingService.send_order_confirmations([second]), [None])
+        self.assertEqual(dict(db.session.query(Order.id, Order.confirmation_email_id)), stamps)
+
+    def test_email_template_lists_codes(self):
+        order_id = self._fulfilled_order(self.users[0], code="PUBG-1234-WXYZ")
+        message = build_order_confirmation(self.users[0], [db.session.get(Order, order_id)])
+        self.assertIn(f"#{order_id}", message["Subject"])
+        self.assertIn("PUBG-1234-WXYZ", message.get_body(("html",)).get_content())
+
+@unittest.skipUnless(Controller, "aiosmtpd is not installed")
+class SMTPDeliveryCase(OrderConfirmationCase):
+    def setUp(self):
+        self.handler = _RecordingSMTPHandler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=_free_port())
+        self.controller.start()
+        self.app_config = {"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": self.controller.port}
+        super().setUp()
+        self.app.config.update(self.app_config)
+
+    def tearDown(self):
+        mailer = self.app.extensions.get("mailer")
+        if mailer:
+            mailer.close()
+        super().tearDown()
+        self.controller.stop()
+
+    def test_coalesced_messages_are_delivered(self):
+        ids = [self._fulfilled_order(self.users[0]) for _ in range(3)] + [self._fulfilled_order(self.users[1])]
+        self.assertEqual(GameShippingService.send_order_confirmations(ids), [None] * 4)
+        self.assertEqual(sorted(m["To"] for m in self.handler.messages),
+                         ["mail0@example.com", "mail1@example.com"])
+        combined = next(m for m in self.handler.messages if m["To"] == "mail0@example.com")
+        html = combined.get_body(("html",)).get_content()
+        self.assertTrue(all(f"#{order_id}" in html for order_id in ids[:3]))
+
+    def test_batch_reuses_one_connection(self):
+        mailer = Mailer(self.app.config)
+        messages = []
+        for i in range(20):
+            message = EmailMessage()
+            message["To"], message["From"], message["Subject"] = "a@example.com", "b@example.com", str(i)
+            message.set_content("x")
+            messages.append(message)
+        self.assertEqual(mailer.send_many(messages), [None] * 20)
+        self.assertEqual(mailer.send_many(messages[:5]), [None] * 5)
+        mailer.close()
+        self.assertEqual(len(self.handler.messages), 25)
+        self.assertEqual(len(self.handler.sessions), 1)
+
+    def test_full_outbox_pushes_back(self):
+        self.handler.delay = 0.5
+        config = dict(self.app.config, MAIL_QUEUE_SIZE=1, MAIL_POOL_SIZE=1)
+        mailer = Mailer(config)
+        message = EmailMessage()
+        message["To"], message["From"], message["Subject"] = "a@example.com", "b@example.com", "slow"
+        message.set_content("x")
+        futures = []
+        with self.assertRaises(MailBackpressure):
+            for _ in range(3):
+                futures.append(mailer.submit(message, timeout=0.05))
+        self.assertTrue(all(future.result(timeout=5) is None for future in futures))
+        mailer.close()
+
+class CodeGeneratorCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_permutation_is_a_bijection(self):
+        permutation = FeistelPermutation(b"k" * 32)
+        values = permutation.permute_many(range(20000))
+        self.assertEqual(len(set(values)), 20000)
+        self.assertTrue(all(0 <= value < 2 ** 80 for value in values))
+        self.assertNotEqual(values[:10], list(range(10)))
+
+    def test_codes_use_unambiguous_alphabet(self):
+        for code in GameShippingService.generate_digital_codes("pubg_mobile", 200):
+            prefix, *groups = code.split("-")
+            self.assertEqual(prefix, "PUBG")
+            self.assertEqual([len(group) for group in groups], [4, 4, 4, 4])
+            self.assertFalse(set("".join(groups)) & set("ILOU"))
+
+    def test_workers_leasing_blocks_never_collide(self):
+        key = b"shared-key" * 3
+        workers = [CodeGenerator(key, block_size=1000) for _ in range(3)]
+        codes = []
+        for _ in range(4):
+            for worker in workers:
+                codes += worker.generate("PUBG", 700)
+        self.assertEqual(len(codes), len(set(codes)))
+        # Each worker leased a fresh block whenever fewer than 700 values were left in its own
+        self.assertEqual(db.session.get(CodeSequence, "PUBG").next_value, 12000)
+
+    def test_bulk_issuance_endpoint(self):
+        admin = User(username="admin", email="admin@example.com", is_admin=True)
+        admin.set_password("admin123")
+        db.session.add(admin)
+        db.session.commit()
+        client = self.app.test_client()
+        client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        data = client.post("/shipping/generate_code", json={"game_type": "pubg", "count": 500}).get_json()
+        self.assertEqual(len(set(data["data"]["codes"])), 500)
+        self.assertEqual(client.post("/shipping/generate_code", json={"count": 0}).status_code, 400)
+
+class CodeVaultCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config["VAULT_LOW_STOCK_THRESHOLD"] = 4
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username="vault", email="vault@example.com")
+        self.user.set_password("password")
+        self.game = Game(name="Vault Game", price=5.0, game_type="itunes", stock=0)
+        db.session.add_all([self.user, self.game])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _import(self, codes, batch_size=5000):
+        return list(CodeVault.import_codes(self.game.id, codes, source="test.csv", batch_size=batch_size))
+
+    def _paid_order(self, quantity):
+        order = Order(user_id=self.user.id, total_amount=5.0 * quantity, status="pending")
+        order.items.append(OrderItem(game_id=self.game.id, quantity=quantity, price=5.0))
+        order.payment = Payment(payment_method="card", amount=5.0 * quantity, status="completed")
+        db.session.add(order)
+        db.session.commit()
+        return order
+
+    def _stock(self):
+        return db.session.query(Game.stock).filter_by(id=self.game.id).scalar()
+
+    def test_csv_reader_finds_code_column(self):
+        with tempfile.TemporaryFile("w+", newline="") as stream:
+            stream.write("serial,code\n1, AAA \n2,\n3,BBB\n")
+            stream.seek(0)
+            self.assertEqual(list(read_codes_csv(stream)), ["AAA", "BBB"])
+        with tempfile.TemporaryFile("w+", newline="") as stream:
+            stream.write("AAA\nBBB\n") # No header: first column
+            stream.seek(0)
+            self.assertEqual(list(read_codes_csv(stream)), ["AAA", "BBB"])
+
+    def test_import_streams_in_batches_and_skips_duplicates(self):
+        codes = (f"SUP-{i % 2500:05d}" for i in range(3000)) # 500 repeats, generated lazily
+        progress = self._import(codes, batch_size=1000)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual((progress[-1]["read"], progress[-1]["inserted"], progress[-1]["duplicates"]),
+                         (3000, 2500, 500))
+        self.assertEqual(self._stock(), 2500)
+        self.assertTrue(db.session.get(Game, self.game.id, populate_existing=True).uses_code_vault)
+        # Re-importing the same file changes nothing
+        self.assertEqual(self._import(f"SUP-{i:05d}" for i in range(2500))[-1]["inserted"], 0)
+        self.assertEqual(self._stock(), 2500)
+
+    def test_allocation_is_all_or_nothing(self):
+        self._import(["A1", "A2", "A3"])
+        order = self._paid_order(2)
+        item = order.items[0]
+        self.assertEqual(CodeVault.allocate(self.game.id, item.id, 2), ["A1", "A2"])
+        with self.assertRaises(VaultExhausted):
+            CodeVault.allocate(self.game.id, item.id + 1, 2)
+        db.session.commit()
+        self.assertEqual(CodeVault.available_counts(), {self.game.id: 1})
+
+    def test_fulfillment_delivers_vault_codes(self):
+        self._import([f"V{i}" for i in range(6)])
+        first, second = self._paid_order(2), self._paid_order(1)
+        self.assertTrue(GameShippingService.fulfill_order(first.id)[0])
+        summary = list(GameShippingService.process_pending_orders())[-1]
+        self.assertEqual(summary["completed"], 1)
+        self.assertEqual([code.code for code in first.items[0].vault_codes], ["V0", "V1"])
+        second_item = db.session.get(OrderItem, second.items[0].id)
+        self.assertEqual(([code.code for code in second_item.vault_codes], second_item.code), (["V2"], None))
+        self.assertEqual(self._stock(), 3)
+        # Only the allocation that dropped the vault below 4 queued an alert
+        alerts = Job.query.filter_by(kind="vault_low_stock").all()
+        self.assertEqual([json.loads(job.payload) for job in alerts], [{"game_id": self.game.id, "available": 3}])
+        html = build_order_confirmation(self.user, [first]).get_body(("html",)).get_content()
+        self.assertIn("V0", html)
+        self.assertIn("V1", html)
+
+    def test_same_supplier_code_for_two_games_is_delivered(self):
+        other = Game(name="Other Vault Game", price=5.0, game_type="itunes", stock=0)
+        db.session.add(other)
+        db.session.commit()
+        self._import(["SHARED-1"])
+        list(CodeVault.import_codes(other.id, ["SHARED-1"]))
+        first = self._paid_order(1)
+        second = Order(user_id=self.user.id, total_amount=5.0, status="pending")
+        second.items.append(OrderItem(game_id=other.id, quantity=1, price=5.0))
+        db.session.add(second)
+        db.session.commit()
+        self.assertTrue(GameShippingService.fulfill_order(first.id)[0])
+        self.assertTrue(GameShippingService.fulfill_order(second.id)[0])
+        client = self.app.test_client()
+        client.post("/auth/login", data={"email": "vault@example.com", "password": "password"})
+        response = client.get(f"/api/orders/{second.id}").get_json()
+        self.assertEqual(response["data"]["items"][0]["codes"], ["SHARED-1"])
+        self.assertIn("SHARED-1", client.get(f"/order/{second.id}").get_data(as_text=True))
+
+    def test_exhausted_vault_fails_item_and_restocks(self):
+        self._import(["ONLY"])
+        order = self._paid_order(2)
+        self.game.stock = 2 # Stock out of step with the vault
+        db.session.commit()
+        success, _ = GameShippingService.fulfill_order(order.id)
+        self.assertFalse(success)
+        self.assertEqual(self._stock(), 2)
+        self.assertEqual(CodeVault.available_counts(), {self.game.id: 1})
+
+class PasswordHashingCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_pool_hashes_and_verifies(self):
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=1)
+        password_hash = hasher.hash("secret")
+        self.assertTrue(password_hash.startswith("pbkdf2:sha256:1000$"))
+        self.assertTrue(hasher.verify(password_hash, "secret"))
+        self.assertFalse(hasher.verify(password_hash, "wrong"))
+        self.assertFalse(hasher.verify(None, "secret"))
+
+    def test_works_without_app_context(self):
+        self.app_context.pop()
+        try:
+            user = User(username="script", email="script@example.com")
+            user.set_password("secret")
+            self.assertTrue(user.check_password("secret"))
+        finally:
+            self.app_context.push()
+
+    def test_needs_rehash_compares_cost_parameters(self):
+        hasher = PasswordHasher(method="scrypt")
+        self.assertFalse(hasher.needs_rehash(generate_password_hash("x", "scrypt:32768:8:1")))
+        self.assertTrue(hasher.needs_rehash(generate_password_hash("x", "scrypt:16384:8:1")))
+        self.assertTrue(hasher.needs_rehash(generate_password_hash("x", "pbkdf2:sha256:1000")))
+
+    def test_login_upgrades_outdated_hash(self):
+        user = User(username="old", email="old@example.com",
+                    password_hash=generate_password_hash("password123", "pbkdf2:sha256:1000"))
+        db.session.add(user)
+        db.session.commit()
+        response = self.app.test_client().post("/auth/login", data={"email": "old@example.com", "password": "password123"})
+        self.assertEqual(response.status_code, 302)
+        upgraded = db.session.get(User, user.id, populate_existing=True).password_hash
+        self.assertTrue(upgraded.startswith("scrypt:32768:8:1$"))
+        self.assertTrue(user.check_password("password123"))
+
+    def test_saturated_hasher_turns_logins_away(self):
+        user = User(username="busy", email="busy@example.com")
+        user.set_password("password123")
+        db.session.add(user)
+        db.session.commit()
+        hasher = self.app.extensions["password_hasher"] = PasswordHasher(
+            method="scrypt:131072:8:1", workers=0, max_pending=1, admission_timeout=0.05)
+        slow = threading.Thread(target=hasher.hash, args=("occupies the only slot",))
+        slow.start()
+        time.sleep(0.1)
+        response = self.app.test_client().post("/auth/login", data={"email": "busy@example.com", "password": "password123"})
+        slow.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "2")
+
+class IdentityCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username="cached", email="cached@example.com")
+        self.user.set_password("password123")
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+        self.client = self.app.test_client()
+        self.client.post("/auth/login", data={"email": "cached@example.com", "password": "password123"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _request(self, method="GET", path="/api/cart", **kwargs):
+        """A request of its own (not sharing this test's app context and g); returns the status and user lookups"""
+        engine = db.engine
+        self.app_context.pop()
+        try:
+            with QueryCounter(engine) as counter:
+                status = self.client.open(path, method=method, **kwargs).status_code
+        finally:
+            self.app_context.push()
+        return status, [s for s in counter.statements if "FROM user \nWHERE user.id = ?" in s]
+
+    def test_cached_requests_skip_user_lookup(self):
+        self.assertEqual(len(self._request()[1]), 1) # First request of this worker fills the cache
+        self.assertEqual(self._request(), (200, []))
+
+    def test_admin_grant_reaches_cached_session(self):
+        generate = {"method": "POST", "path": "/shipping/generate_code", "json": {"game_type": "pubg"}}
+        self.assertEqual(self._request(**generate)[0], 302) # Sent away: not an admin yet
+        self.assertEqual(self._request(**generate)[1], [])
+        user = db.session.get(User, self.user_id)
+        user.is_admin = True
+        db.session.commit()
+        status, lookups = self._request(**generate)
+        self.assertEqual((status, len(lookups)), (200, 1))
+
+    def test_password_change_invalidates(self):
+        self._request()
+        user = db.session.get(User, self.user_id)
+        user.password_hash = generate_password_hash("changed", "pbkdf2:sha256:1000")
+        db.session.commit()
+        self.assertEqual(len(self._request()[1]), 1)
+
+    def test_one_users_change_keeps_the_others_cached(self):
+        other = User(username="bystander", email="bystander@example.com")
+        other.set_password("password123")
+        db.session.add(other)
+        db.session.commit()
+        own_client, other_client = self.client, self.app.test_client()
+        other_client.post("/auth/login", data={"email": "bystander@example.com", "password": "password123"})
+        self._request()
+        self.client = other_client
+        self._request()
+        user = db.session.get(User, self.user_id)
+        user.password_hash = generate_password_hash("rehashed", "pbkdf2:sha256:1000")
+        db.session.commit()
+        self.assertEqual(self._request()[1], []) # Still served from the cache
+        self.client = own_client
+        self.assertEqual(len(self._request()[1]), 1)
+
+    def test_other_workers_follow_shared_version(self):
+        self._request()
+        invalidate_identity() # What grant_admin.py does from its own process
+        self.assertEqual(len(self._request()[1]), 1)
+
+    def test_entries_expire_and_evict(self):
+        cache = IdentityCache(size=2, ttl=60)
+        for user_id in (1, 2, 3):
+            cache.put(user_id, 0, {"id": user_id})
+        self.assertIsNone(cache.get(1, 0)) # Least recently used
+        self.assertEqual(cache.get(3, 0), {"id": 3})
+        self.assertIsNone(cache.get(3, 1)) # Version moved on
+        cache = IdentityCache(ttl=-1)
+        cache.put(1, 0, {"id": 1})
+        self.assertIsNone(cache.get(1, 0))
+
+class ReadReplicaCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        primary, replica = (os.path.join(self.tmpdir.name, name) for name in ("primary.db", "replica.db"))
+        config = type("ReplicaConfig", (TestConfig,), {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + primary,
+            "SQLALCHEMY_REPLICA_URIS": ["sqlite:///" + replica],
+        })
+        self.app = create_app(config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user = User(username="reader", email="reader@example.com")
+        user.set_password("password123")
+        self.game = Game(name="Replica Game", price=1.0, game_type="pubg", stock=10)
+        db.session.add_all([user, self.game])
+        db.session.commit()
+        self.user_id, self.game_id = user.id, self.game.id
+        self.replication = ReplicationLagSimulator(primary, replica)
+        self.replication.sync()
+        self.client = self.app.test_client()
+        self.client.post("/auth/login", data={"email": "reader@example.com", "password": "password123"})
+        self.app_context.pop() # Requests below get app contexts (and sessions) of their own
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+            for engine in self.app.extensions["read_replicas"]:
+                engine.dispose()
+        self.tmpdir.cleanup()
+
+    def _place_order(self):
+        with self.app.app_context():
+            order = Order(user_id=self.user_id, total_amount=1.0, status="completed")
+            order.items.append(OrderItem(game_id=self.game_id, quantity=1, price=1.0))
+            db.session.add(order)
+            db.session.commit()
+            return order.id
+
+    def _order_ids(self):
+        return [order["id"] for order in self.client.get("/api/orders").get_json()["data"]]
+
+    def test_history_reads_lag_behind_until_replicated(self):
+        order_id = self._place_order()
+        self.assertEqual(self._order_ids(), []) # Replica has not caught up
+        self.assertEqual(self.client.get(f"/api/orders/{order_id}").status_code, 404)
+        self.replication.sync()
+        self.assertEqual(self._order_ids(), [order_id])
+
+    def test_writer_reads_own_writes(self):
+        order_id = self._place_order()
+        self.assertEqual(self.client.post("/api/cart/add", json={"game_id": self.game_id, "quantity": 1}).status_code, 200)
+        self.assertEqual(self._order_ids(), [order_id]) # Sticky: back on the primary after writing
+        with self.client.session_transaction() as session:
+            session["_db_primary_until"] = 0 # Sticky window over
+        self.assertEqual(self._order_ids(), [])
+
+    def test_writes_go_to_primary(self):
+        response = self.client.post("/api/cart/add", json={"game_id": self.game_id, "quantity": 2})
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(CartItem.query.count(), 1)
+        replica = sqlite3.connect(self.replication.replica_path)
+        self.assertEqual(replica.execute("SELECT COUNT(*) FROM cart_item").fetchone()[0], 0)
+        replica.close()
+
+    def test_lag_simulator_trails_primary(self):
+        replica = self.replication.replica_path
+        stop = threading.Event()
+        simulator = ReplicationLagSimulator(self.replication.primary_path, replica, lag=0.3, interval=0.05)
+        worker = threading.Thread(target=simulator.run, args=(stop,))
+        worker.start()
+        try:
+            order_id = self._place_order()
+            time.sleep(0.1)
+            self.assertEqual(self._order_ids(), [])
+            time.sleep(0.6)
+            self.assertEqual(self._order_ids(), [order_id])
+        finally:
+            stop.set()
+            worker.join()
+
+class IdempotencyCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = type("IdempotencyConfig", (TestConfig,), {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(self.tmpdir.name, "shop.db"), # Shared by threads
+            "IDEMPOTENCY_WAIT_TIMEOUT": 5.0,
+        })
+        self.app = create_app(config)
+        with self.app.app_context():
+            db.create_all()
+            user = User(username="retrier", email="retrier@example.com")
+            user.set_password("password123")
+            game = Game(name="Retry Game", price=2.5, game_type="pubg", stock=10)
+            db.session.add_all([user, game])
+            db.session.commit()
+            self.user_id, self.game_id = user.id, game.id
+        self.client = self._login()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def _login(self):
+        client = self.app.test_client()
+        client.post("/auth/login", data={"email": "retrier@example.com", "password": "password123"})
+        return client
+
+    def _add(self, key, quantity=1, client=None):
+        return (client or self.client).post("/api/cart/add", json={"game_id": self.game_id, "quantity": quantity},
+                                            headers={"Idempotency-Key": key})
+
+    def _checkout(self, key, client=None):
+        return (client or self.client).post("/api/checkout", json={"payment_method": "simulated_credit_card"},
+                                            headers={"Idempotency-Key": key})
+
+    def test_retried_cart_add_counts_once(self):
+        first, retry = self._add("add-1", 2), self._add("add-1", 2)
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers.get("Idempotent-Replayed"), "true")
+        self._add("add-2", 2) # A new key is a new request
+        with self.app.app_context():
+            self.assertEqual(db.session.query(CartItem.quantity).scalar(), 4)
+
+    def test_retried_checkout_creates_one_order(self):
+        self._add("add-1", 2)
+        first, retry = self._checkout("checkout-1"), self._checkout("checkout-1")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((retry.status_code, retry.get_json()), (200, first.get_json()))
+        with self.app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+            self.assertEqual(db.session.query(Game.stock).scalar(), 8)
+
+    def test_reused_key_with_other_body_is_rejected(self):
+        self._add("add-1", 1)
+        self.assertEqual(self._add("add-1", 3).status_code, 422)
+
+    def test_concurrent_duplicates_wait_for_the_first(self):
+        self._add("add-1", 2)
+        clients = [self._login() for _ in range(3)]
+        responses = [None] * len(clients)
+        def checkout(index):
+            responses[index] = self._checkout("checkout-1", clients[index])
+        threads = [threading.Thread(target=checkout, args=(index,)) for index in range(len(clients))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.get_json()["order_id"] for response in responses}), 1)
+        with self.app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+
+    def test_duplicate_of_a_stuck_request_gets_409(self):
+        with self.app.test_request_context("/api/cart/add", method="POST", json={"game_id": self.game_id, "quantity": 1}):
+            fingerprint = request_fingerprint()
+        with self.app.app_context():
+            db.session.add(IdempotencyKey(user_id=self.user_id, key="slow", fingerprint=fingerprint,
+                                          expires_at=datetime.utcnow() + timedelta(minutes=1)))
+            db.session.commit()
+        self.app.config["IDEMPOTENCY_WAIT_TIMEOUT"] = 0.2
+        started = time.monotonic()
+        response = self._add("slow")
+        self.assertEqual((response.status_code, response.headers["Retry-After"]), (409, "1"))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        with self.app.app_context():
+            self.assertEqual(CartItem.query.count(), 0)
+
+    def test_expired_keys_are_purged_or_taken_over(self):
+        self._add("old", 1)
+        self._add("fresh", 1)
+        with self.app.app_context():
+            db.session.query(IdempotencyKey).filter_by(key="old").update(
+                {"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+            self.assertEqual(purge_expired_keys(batch_size=1), 1)
+            self.assertEqual([key for (key,) in db.session.query(IdempotencyKey.key)], ["fresh"])
+        self.assertIsNone(self._add("old", 1).headers.get("Idempotent-Replayed")) # Runs again
+        with self.app.app_context():
+            self.assertEqual(db.session.query(CartItem.quantity).scalar(), 3)
+
+    def test_view_that_lost_its_claim_changes_nothing(self):
+        self._add("add-1", 2)
+        with self.app.test_request_context("/api/checkout", method="POST"):
+            claim_id = db.session.query(IdempotencyKey.id).filter_by(key="add-1").scalar()
+            # The claim expired mid-request and a retry took the key over (deleted and re-inserted it)
+            db.session.query(IdempotencyKey).filter_by(id=claim_id).delete()
+            db.session.commit()
+            g.idempotency_claim = claim_id
+            db.session.add(Order(user_id=self.user_id, total_amount=5.0, status="pending"))
+            response, status = commit_with_response(jsonify({"success": True}))
+            self.assertEqual(status, 409)
+            self.assertEqual(Order.query.count(), 0)
+
+class AdminListingCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        admin = User(username="admin", email="admin@example.com", is_admin=True)
+        admin.set_password("admin123")
+        db.session.add(admin)
+        self.users = [User(username=f"player{i}", email=f"player{i}@example.com") for i in range(5)]
+        self.games = [Game(name=f"Game {i:02d}", price=1.0 + i, game_type="pubg" if i % 2 else "free_fire",
+                           stock=i, is_active=i % 3 != 0) for i in range(30)]
+        db.session.add_all(self.users + self.games)
+        db.session.flush()
+        start = datetime(2026, 1, 1)
+        for i in range(40):
+            order = Order(user_id=self.users[i % 5].id, total_amount=float(i), created_at=start + timedelta(days=i),
+                          status="completed" if i % 4 else "pending")
+            order.items.append(OrderItem(game_id=self.games[0].id, quantity=1, price=1.0))
+            order.payment = Payment(payment_method="card", amount=float(i), status="completed")
+            db.session.add(order)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_order_filters_and_sorting(self):
+        filters = AdminListingService.parse_order_filters(
+            {"status": "completed", "date_from": "2026-01-05", "date_to": "2026-01-20", "bogus": "x"})
+        pagination, _ = AdminListingService.list_orders(filters, "total_asc", page=1, per_page=5)
+        self.assertEqual(pagination.total, 12) # Days 4..19, less the pending ones (4, 8, 12, 16)
+        self.assertEqual([order.total_amount for order in pagination.items], [5.0, 6.0, 7.0, 9.0, 10.0])
+        self.assertEqual(AdminListingService.parse_order_filters({"date_from": "not-a-date"}), {})
+
+    def test_order_page_is_a_fixed_number_of_queries(self):
+        def render(per_page):
+            db.session.expunge_all()
+            with QueryCounter(db.engine) as counter:
+                pagination, items_counts = AdminListingService.list_orders({}, page=2, per_page=per_page)
+                rows = [(order.customer.username, order.payment.status, items_counts[order.id])
+                        for order in pagination.items]
+            self.assertEqual(len(rows), per_page)
+            return counter.count
+        self.assertEqual(render(5), render(20))
+        self.assertEqual(render(5), 3) # Count, page with customer and payment, item counts
+
+    def test_counts_are_capped(self):
+        self.assertEqual(AdminListingService.capped_count(db.session.query(Order), cap=10), 11)
+        self.assertEqual(AdminListingService.capped_count(db.session.query(Order)), 40)
+
+    def test_pages_past_the_count_cap_stay_reachable(self):
+        query = db.session.query(Order)
+        total = AdminListingService.capped_count(query, cap=10)
+        def page(number):
+            return AdminListingService._paginate(query, ADMIN_ORDER_SORTS, "oldest", number, 5, total, Order.id, cap=10)
+        self.assertEqual((page(1).total, page(1).has_next), (11, True))
+        middle = page(4) # Rows 16-20, past the 10 counted
+        self.assertEqual([order.total_amount for order in middle.items], [15.0, 16.0, 17.0, 18.0, 19.0])
+        self.assertTrue(middle.has_next)
+        last = page(8)
+        self.assertEqual((len(last.items), last.total, last.has_next), (5, 40, False))
+        self.assertEqual(page(9).items, [])
+
+    def test_user_search(self):
+        self.users[3].email = "Special_one@example.com"
+        db.session.commit()
+        pagination = AdminListingService.list_users(AdminListingService.parse_user_filters({"q": "special_"}))
+        self.assertEqual([user.username for user in pagination.items], ["player3"])
+        self.assertEqual(AdminListingService.list_users({"q": "%"}).total, 0) # Wildcards are literal
+
+    def test_games_page_renders_one_page(self):
+        self.client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        response = self.client.get("/admin/games?game_type=pubg&is_active=1&sort=name&per_page=4&page=2")
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        pubg_active = sorted(game.name for game in self.games if game.game_type == "pubg" and game.is_active)
+        self.assertEqual([name for name in pubg_active if name in html], pubg_active[4:8])
+        self.assertIn("page=3", html)
+
+    def test_orders_and_users_pages_render_with_pagination(self):
+        self.client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        response = self.client.get("/admin/orders?status=completed&sort=total_asc&per_page=5&page=2")
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertIn("player", html)
+        self.assertIn("page=3", html)
+        self.assertIn("status=completed", html)
+        response = self.client.get("/admin/users?sort=username&per_page=2&page=2")
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertIn("player1@example.com", html)
+        self.assertIn("page=3", html)
+
+class OrderExportCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "export.db")
+        self.app = create_app(type("ExportConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + self.db_path}))
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username="admin", email="admin@example.com", is_admin=True)
+        self.admin.set_password("admin123")
+        self.game = Game(name="شدات ببجي", price=2.5, game_type="pubg", stock=10)
+        db.session.add_all([self.admin, self.game])
+        db.session.flush()
+        for day, status in ((1, "completed"), (2, "pending"), (3, "completed")):
+            order = Order(user_id=self.admin.id, total_amount=5.0, status=status, created_at=datetime(2026, 3, day))
+            order.items.append(OrderItem(game_id=self.game.id, quantity=1, price=2.5))
+            order.items.append(OrderItem(game_id=self.game.id, quantity=1, price=2.5, game_account_id="acc-1"))
+            order.payment = Payment(payment_method="card", amount=5.0, status="completed")
+            db.session.add(order)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.tmpdir.cleanup()
+
+    def test_csv_has_one_row_per_item(self):
+        text = "".join(OrderExport.stream(fmt="csv", yield_per=2))
+        rows = list(csv.DictReader(io.StringIO(text.lstrip("\ufeff"))))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual((rows[1]["game_name"], rows[1]["game_account_id"], rows[1]["payment_method"]),
+                         ("شدات ببجي", "acc-1", "card"))
+        self.assertEqual(rows[0]["order_created_at"], "2026-03-01T00:00:00")
+
+    def test_cli_filters_and_gzips_ndjson(self):
+        path = os.path.join(self.tmpdir.name, "orders.ndjson.gz")
+        result = self.app.test_cli_runner().invoke(args=[
+            "admin", "export-orders", path, "--format", "ndjson", "--gzip",
+            "--status", "completed", "--date-from", "2026-03-02", "--date-to", "2026-03-03"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with gzip.open(path, "rt", encoding="utf-8") as stream:
+            rows = [json.loads(line) for line in stream]
+        self.assertEqual({row["order_status"] for row in rows}, {"completed"})
+        self.assertEqual({row["order_created_at"] for row in rows}, {"2026-03-03T00:00:00"})
+        self.assertEqual(len(rows), 2)
+
+    def test_admin_download(self):
+        client = self.app.test_client()
+        client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        response = client.get("/admin/orders/export?format=csv&gzip=1&status=pending")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(".csv.gz", response.headers["Content-Disposition"])
+        lines = gzip.decompress(response.get_data()).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 3) # Header and the two items of the pending order
+        self.assertEqual(client.get("/admin/orders/export?format=xml").status_code, 400)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "needs Linux /proc to read the RSS")
+    def test_million_rows_in_constant_memory(self):
+        def rss():
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+        orders, items_per_order = 250000, 4
+        user_id, game_id = self.admin.id, self.game.id
+        connection = sqlite3.connect(self.db_path)
+        with connection:
+            connection.executemany(
+                "INSERT INTO \"order\" (id, user_id, status, total_amount, created_at) VALUES (?, ?, 'completed', 10.0, ?)",
+                ((order_id, user_id, "2026-04-01 12:00:00.000000") for order_id in range(1000, 1000 + orders)))
+            connection.executemany(
+                "INSERT INTO order_item (order_id, game_id, quantity, price, status) VALUES (?, ?, 1, 2.5, 'fulfilled')",
+                ((1000 + i // items_per_order, game_id) for i in range(orders * items_per_order)))
+        connection.close()
+
+        baseline = peak = rss()
+        exported = 0
+        for chunk in OrderExport.stream({"date_from": "2026-04-01"}, fmt="csv"):
+            exported += chunk.count("\n")
+            peak = max(peak, rss())
+        self.assertEqual(exported, 1 + orders * items_per_order) # Header and a million rows
+        self.assertLess(peak - baseline, 50 * 1024 * 1024)
+
+class SalesRollupCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.admin = User(username="admin", email="admin@example.com", is_admin=True)
+        self.admin.set_password("admin123")
+        self.pubg = Game(name="UC", price=2.0, game_type="pubg", region="EU", stock=100)
+        self.fire = Game(name="Diamonds", price=5.0, game_type="free_fire", region="NA", stock=100)
+        db.session.add_all([self.admin, self.pubg, self.fire])
+        db.session.commit()
+        self.today = date.today()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _paid_order(self, days_ago, *lines):
+        order = Order(user_id=self.admin.id, total_amount=0, status="pending",
+                      created_at=datetime.combine(self.today - timedelta(days=days_ago), datetime.min.time()))
+        for game, quantity in lines:
+            order.items.append(OrderItem(game_id=game.id, quantity=quantity, price=game.price, game_account_id="acc"))
+        order.payment = Payment(payment_method="card", amount=0, status="completed")
+        db.session.add(order)
+        db.session.commit()
+        return order.id
+
+    def _rollups(self):
+        return ([(row.day, row.order_count, row.units, row.revenue) for row in SalesDaily.query.order_by(SalesDaily.day)],
+                [(row.day, row.game_id, row.order_count, row.units, row.revenue)
+                 for row in SalesDailyGame.query.order_by(SalesDailyGame.day, SalesDailyGame.game_id)])
+
+    def test_fulfillment_adds_each_order_once(self):
+        single = self._paid_order(1, (self.pubg, 2), (self.fire, 1))
+        self._paid_order(0, (self.pubg, 1))
+        self._paid_order(0, (self.pubg, 3), (self.fire, 2))
+        GameShippingService.fulfill_order(single)
+        list(GameShippingService.process_pending_orders(chunk_size=1))
+        GameShippingService.fulfill_order(single) # Already completed: skipped
+        daily, per_game = self._rollups()
+        yesterday = self.today - timedelta(days=1)
+        self.assertEqual(daily, [(yesterday, 1, 3, 9.0), (self.today, 2, 6, 18.0)])
+        self.assertIn((self.today, self.pubg.id, 2, 4, 8.0), per_game)
+        self.assertIn((self.today, self.fire.id, 1, 2, 10.0), per_game)
+
+    def test_order_finished_after_the_status_read_is_not_fulfilled_again(self):
+        order_id = self._paid_order(0, (self.pubg, 1))
+        order = db.session.get(Order, order_id)
+        self.assertTrue(GameShippingService.fulfill_order(order_id)[0]) # Another worker finishes it first
+        set_committed_value(order, "status", "pending") # As this run read it before that worker committed
+        self.assertEqual(GameShippingService.fulfill_order(order_id),
+                         (True, "Order status is completed, fulfillment skipped"))
+        self.assertEqual(GameShippingService.claim_orders([order_id], "late-run"), [])
+        self.assertEqual(self._rollups()[0], [(self.today, 1, 1, 2.0)])
+        self.assertEqual(self.pubg.stock, 99)
+
+    def test_rebuild_matches_incremental_updates(self):
+        for days_ago in (0, 0, 3, 10):
+            self._paid_order(days_ago, (self.pubg, 1), (self.fire, days_ago + 1))
+        list(GameShippingService.process_pending_orders())
+        incremental = self._rollups()
+        self.assertEqual(SalesRollup.rebuild(), 4)
+        db.session.commit()
+        self.assertEqual(self._rollups(), incremental)
+        self.assertEqual(SalesRollup.rebuild(since=self.today - timedelta(days=3)), 3)
+        self.assertEqual(self._rollups(), incremental)
+        result = self.app.test_cli_runner().invoke(args=["admin", "rebuild-sales-rollups", "--since", "2000-01-01"])
+        self.assertIn("Rolled up 4 completed orders", result.output)
+
+    def test_dashboard_reads_only_rollups(self):
+        self._paid_order(0, (self.pubg, 1))
+        self._paid_order(40, (self.fire, 1)) # Outside the 30 day window
+        list(GameShippingService.process_pending_orders())
+        with QueryCounter(db.engine) as counter:
+            stats = SalesRollup.dashboard(30)
+        self.assertFalse([statement for statement in counter.statements
+                          if 'FROM "order"' in statement or "order_item" in statement])
+        self.assertEqual(stats["totals"], {"orders": 1, "units": 1, "revenue": 2.0})
+        self.assertEqual([row["name"] for row in stats["by_game_type"]], ["pubg"])
+        self.assertEqual([game["name"] for game in stats["top_games"]], ["UC"])
+        self.client = self.app.test_client()
+        self.client.post("/auth/login", data={"email": "admin@example.com", "password": "admin123"})
+        response = self.client.get("/admin/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("UC", response.get_data(as_text=True))
+
+class QueryPlanCase(unittest.TestCase):
+    """Runs the hot request paths and fails if SQLite plans any of their statements as a full table scan"""
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        user = User(username="planner", email="planner@example.com")
+        user.set_password("password")
+        self.game = Game(name="Plan Game", price=1.5, game_type="pubg", stock=50)
+        db.session.add_all([user, self.game])
+        db.session.commit()
+        self.client.post("/auth/login", data={"email": "planner@example.com", "password": "password"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertNoFullScans(self, counter):
+        tables = set(db.metadata.tables)
+        scans = []
+        with db.engine.connect() as connection:
+            for statement, parameters in counter.executions:
+                if not re.match(r"\s*(SELECT|UPDATE|DELETE)", statement, re.IGNORECASE):
+                    continue
+                for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters):
+                    match = re.match(r"SCAN (\w+)", row[-1])
+                    if match and match.group(1) in tables: # Subqueries show up as anon_N
+                        scans.append(f"{row[-1]}: {statement}")
+        self.assertFalse(scans, "\n\n".join(scans))
+
+    def _checkout(self):
+        self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 2})
+        return self.client.post("/api/checkout", json={"payment_method": "simulated_credit_card"}).get_json()["order_id"]
+
+    def test_cart_paths(self):
+        with QueryCounter(db.engine) as counter:
+            self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 1})
+            self.client.post("/api/cart/add", json={"game_id": self.game.id, "quantity": 2, "game_account_id": "p-1"})
+            self.client.get("/api/cart/count")
+            self.client.get("/api/cart")
+        self.assertNoFullScans(counter)
+        item = CartItem.query.one() # Unique (cart_id, game_id): the second add landed on the same line
+        self.assertEqual((item.quantity, item.game_account_id), (3, "p-1"))
+
+    def test_checkout_and_order_history(self):
+        with QueryCounter(db.engine) as counter:
+            order_id = self._checkout()
+            self.client.get("/api/orders")
+            self.client.get(f"/api/orders/{order_id}")
+        self.assertNoFullScans(counter)
+
+    def test_fulfillment_and_admin_listing(self):
+        self._checkout()
+        with QueryCounter(db.engine) as counter:
+            list(GameShippingService.process_pending_orders())
+            JobQueue.work(once=True)
+            AdminListingService.list_orders({"status": "completed"})
+        self.assertNoFullScans(counter)
+
+    def test_cart_item_is_unique_per_game(self):
+        cart = Cart(user_id=User.query.one().id)
+        db.session.add(cart)
+        db.session.flush()
+        db.session.add_all([CartItem(cart_id=cart.id, game_id=self.game.id, quantity=1),
+                            CartItem(cart_id=cart.id, game_id=self.game.id, quantity=1)])
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+class SqlAccountingCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+
+        @self.app.route("/test/lazy-names")
+        def lazy_names():
+            # One query per game: the loop the repeat check exists to catch
+            return jsonify([db.session.query(Game.name).filter(Game.id == game.id).scalar()
+                            for game in Game.query.order_by(Game.id).all()])
+
+        @self.app.route("/test/polled-names")
+        def polled_names():
+            with deliberate_repeats():
+                return lazy_names()
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.user = User(username="timed", email="timed@example.com")
+        self.user.set_password("password")
+        self.games = [Game(name=f"Vault Game {i}", price=1.0, game_type="pubg", stock=100, uses_code_vault=True)
+                      for i in range(8)]
+        db.session.add(self.user)
+        db.session.add_all(self.games)
+        db.session.flush()
+        self.order = Order(user_id=self.user.id, total_amount=16.0, status="completed")
+        db.session.add(self.order)
+        db.session.flush()
+        for game in self.games:
+            item = OrderItem(order_id=self.order.id, game_id=game.id, quantity=2, price=1.0,
+                             status="fulfilled", code=f"{game.id}-0")
+            db.session.add(item)
+            db.session.flush()
+            db.session.add_all([VaultCode(game_id=game.id, code=f"{game.id}-{n}", status="allocated",
+                                          order_item_id=item.id) for n in range(2)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_statement_shape_collapses_parameter_lists(self):
+        self.assertEqual(statement_shape("SELECT x FROM t\n WHERE id IN (?, ?, ?)"),
+                         statement_shape("SELECT x FROM t WHERE id IN (?)"))
+        self.assertEqual(statement_shape("INSERT INTO t (a, b) VALUES (?, ?), (?, ?)"),
+                         "INSERT INTO t (a, b) VALUES (?)")
+
+    def test_response_carries_server_timing_and_log_line(self):
+        self.app.config["SQL_ACCOUNTING_LOG"] = True
+        with self.assertLogs(self.app.logger, "INFO") as logs:
+            response = self.client.get("/api/games")
+        self.assertRegex(response.headers["Server-Timing"], r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", app;dur=[0-9.]+$')
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line["event"], "request_sql")
+        self.assertEqual(line["endpoint"], "api.get_games")
+        self.assertEqual(line["status"], 200)
+        self.assertGreater(line["queries"], 0)
+
+    def test_accounting_is_off_by_default_outside_debug_and_testing(self):
+        self.app.testing = False
+        self.app.config["SQL_ACCOUNTING_LOG"] = None
+        with self.assertNoLogs(self.app.logger, "INFO"):
+            response = self.client.get("/api/games")
+        self.assertNotIn("Server-Timing", response.headers)
+        self.app.config["SQL_ACCOUNTING_ENABLED"] = True
+        self.assertIn("Server-Timing", self.client.get("/api/games").headers)
+
+    def test_repeated_statement_fails_the_request(self):
+        with self.assertRaises(RepeatedStatementError) as caught:
+            self.client.get("/test/lazy-names")
+        self.assertEqual(caught.exception.count, len(self.games))
+        self.assertIn("FROM game WHERE game.id = ?", caught.exception.shape)
+        self.assertEqual(self.client.get("/test/polled-names").status_code, 200)
+
+    def test_order_detail_queries_do_not_grow_with_items(self):
+        self.client.post("/auth/login", data={"email": "timed@example.com", "password": "password"})
+        for url in [f"/order/{self.order.id}", f"/api/orders/{self.order.id}"]:
+            with QueryCounter(db.engine) as counter:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLess(counter.count, len(self.games))
+        codes = [item["codes"] for item in response.get_json()["data"]["items"]]
+        self.assertEqual(codes, [[f"{game.id}-0", f"{game.id}-1"] for game in self.games])
+        self.assertIn(f"{self.games[-1].id}-1", self.client.get(f"/order/{self.order.id}").get_data(as_text=True))
+
+class CatalogImportCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        admin = User(username="feeder", email="feeder@example.com", is_admin=True)
+        admin.set_password("password")
+        self.games = [Game(sku=f"SKU-{i}", name=f"Feed Game {i}", price=10.0, game_type="pubg", stock=5)
+                      for i in range(6)]
+        db.session.add(admin)
+        db.session.add_all(self.games)
+        db.session.flush()
+        self.cart = Cart(user_id=admin.id, item_count=1, subtotal=10.0)
+        db.session.add(self.cart)
+        db.session.flush()
+        db.session.add(CartItem(cart_id=self.cart.id, game_id=self.games[0].id, quantity=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _run(self, rows, **kwargs):
+        return list(CatalogImport.run(rows, **kwargs))
+
+    def test_applies_only_changed_rows_and_invalidates_once(self):
+        feed = io.StringIO(
+            "SKU,price,stock,name,game_type\n"
+            "SKU-0,12.5,,,\n"                # Price change
+            "SKU-1,,40,,\n"                  # Stock change
+            "SKU-2,10,5,,\n"                 # Same as stored
+            "SKU-3,abc,,,\n"                 # Invalid
+            "SKU-NEW,3.25,7,شدات جديدة,pubg\n" # New game
+            "SKU-MISSING,1,,,\n"             # New SKU without the fields a game needs
+            "SKU-1,,41,,\n")                 # Repeated key: the last row wins
+        version = CatalogCache.version()
+        progress = self._run(read_feed_csv(feed), batch_size=100)
+        report = progress[-1]
+        self.assertEqual({name: report[name] for name in
+                          ("read", "created", "updated", "unchanged", "unknown", "duplicates", "invalid")},
+                         {"read": 7, "created": 1, "updated": 2, "unchanged": 1, "unknown": 1, "duplicates": 1,
+                          "invalid": 1})
+        self.assertEqual(report["errors"], ["row 4: price must be a number"])
+        self.assertIn("elapsed", report)
+        self.assertEqual(CatalogCache.version(), version + 1)
+
+        db.session.expire_all()
+        self.assertEqual(self.games[0].price, 12.5)
+        self.assertEqual(self.games[1].stock, 41)
+        self.assertEqual(db.session.get(Cart, self.cart.id).subtotal, 12.5) # Cart counters follow the price
+        new_game = Game.query.filter_by(sku="SKU-NEW").one()
+        self.assertEqual((new_game.price, new_game.stock, new_game.is_active), (3.25, 7, True))
+        self.assertEqual([game.id for game in GameSearchIndex.search("شدات جديدة")], [new_game.id])
+
+    def test_unchanged_feed_writes_nothing(self):
+        version = CatalogCache.version()
+        rows = [{"sku": game.sku, "price": "10.00", "stock": "5"} for game in self.games]
+        with QueryCounter(db.engine) as counter:
+            report = self._run(rows)[-1]
+        self.assertEqual(report["unchanged"], len(self.games))
+        self.assertFalse([statement for statement in counter.statements if not statement.startswith("SELECT")])
+        self.assertEqual(CatalogCache.version(), version)
+
+    def test_statements_per_batch_do_not_grow_with_rows(self):
+        db.session.add_all([Game(sku=f"BULK-{i}", name=f"Bulk {i}", price=1.0, game_type="psn", stock=0)
+                            for i in range(2000)])
+        db.session.commit()
+        rows = [{"sku": f"BULK-{i}", "price": 2.0, "stock": i % 7} for i in range(2000)]
+        with QueryCounter(db.engine) as counter:
+            progress = self._run(rows, batch_size=500)
+        self.assertEqual(progress[-1]["updated"], 2000)
+        self.assertEqual(progress[-1]["batches"], 4)
+        self.assertLess(counter.count, 60)
+        self.assertEqual(Game.query.filter(Game.price == 2.0).count(), 2000)
+
+    def test_feed_stock_leaves_active_holds_and_vault_counts_alone(self):
+        order = Order(user_id=self.cart.user_id, total_amount=20.0, status="pending")
+        db.session.add(order)
+        db.session.flush()
+        InventoryService.reserve(order.id, {self.games[2].id: 2}) # Stock 5 -> 3, 2 held
+        self.games[3].uses_code_vault = True
+        db.session.commit()
+        report = self._run([{"sku": "SKU-2", "stock": 10}, {"sku": "SKU-3", "stock": 50}])[-1]
+        self.assertEqual((report["updated"], report["unchanged"], report["vault_stock"]), (1, 1, 1))
+        db.session.expire_all()
+        self.assertEqual((self.games[2].stock, self.games[3].stock), (8, 5)) # 10 on hand, 2 of them held
+
+        InventoryService.consume(order.id)
+        db.session.commit()
+        self.assertEqual(self._run([{"sku": "SKU-2", "stock": 8}])[-1]["unchanged"], 1)
+
+    def test_stock_changed_since_the_read_is_retried(self):
+        game_id = self.games[1].id
+        # The batch "saw" stock 9; a checkout has since left it at 5
+        conflicts = CatalogImport._set_stock({game_id: 20}, {game_id: (9, 0)}, datetime.utcnow())
+        db.session.commit()
+        self.assertEqual(conflicts, 0)
+        db.session.expire_all()
+        self.assertEqual(self.games[1].stock, 20)
+
+    def test_id_keyed_feed_links_skus_and_never_creates_games(self):
+        report = self._run([{"id": self.games[4].id, "sku": "SUPPLIER-4"}, {"id": 999999, "name": "x", "price": 1,
+                                                                           "game_type": "pubg"}], key="id")[-1]
+        self.assertEqual((report["updated"], report["unknown"], report["created"]), (1, 1, 0))
+        self.assertEqual(Game.query.filter_by(sku="SUPPLIER-4").one().id, self.games[4].id)
+
+    def test_json_feed_is_read_incrementally(self):
+        objects = [{"sku": f"SKU-{i}", "price": i + 0.5, "name": "قيمة, [بأقواس]"} for i in range(50)]
+        array = json.dumps(objects, ensure_ascii=False)
+        self.assertEqual(list(read_feed_json(io.StringIO(array), chunk_size=7)), objects)
+        lines = "\n".join(json.dumps(item) for item in objects) + "\n"
+        self.assertEqual(list(read_feed_json(io.StringIO(lines), chunk_size=5)), objects)
+        with self.assertRaises(ValueError):
+            list(read_feed_json(io.StringIO('[{"sku": "SKU-1"}, {"sku": ')))
+
+    def test_admin_upload_returns_the_report(self):
+        self.client.post("/auth/login", data={"email": "feeder@example.com", "password": "password"})
+        self.app.config["CATALOG_IMPORT_BATCH_SIZE"] = 1 # One batch per row: more repeats than SQL_REPEAT_LIMIT
+        feed = json.dumps([{"sku": game.sku, "price": 7.5, "is_active": game is not self.games[5]}
+                           for game in self.games]).encode()
+        response = self.client.post("/admin/games/import", data={"feed": (io.BytesIO(feed), "feed.json")},
+                                    content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["data"]["updated"], len(self.games))
+        db.session.expire_all()
+        self.assertEqual((self.games[5].price, self.games[5].is_active), (7.5, False))
+        self.assertEqual(self.client.post("/admin/games/import", data={}).status_code, 400)
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,180 @@
+import csv
+from datetime import datetime
+from email.message import EmailMessage
+from flask import current_app
+from sqlalchemy import insert, update, select, func
+from models import db, Game, User, VaultCode
+from jobs import JobQueue
+from mailer import get_mailer
+
+class VaultExhausted(Exception):
+    """Raised when a game's vault holds fewer available codes than an item needs"""
+    def __init__(self, game_id, quantity):
+        super().__init__(f"Code vault for game {game_id} cannot cover {quantity} codes")
+        self.game_id = game_id
+        self.quantity = quantity
+
+def read_codes_csv(stream, column="code", delimiter=","):
+    """Yield codes from a supplier CSV one row at a time.
+
+    If the first row names `column` it is treated as a header and that column is
+    read; otherwise the file is taken to have no header and the first column is used.
+    """
+    reader = csv.reader(stream, delimiter=delimiter)
+    first = next(reader, None)
+    if first is None:
+        return
+    header = [cell.strip().lower() for cell in first]
+    if column.lower() in header:
+        index = header.index(column.lower())
+    else:
+        index = 0
+        reader = _chain_row(first, reader)
+    for row in reader:
+        if len(row) > index:
+            code = row[index].strip()
+            if code:
+                yield code
+
+def _chain_row(first, reader):
+    yield first
+    yield from reader
+
+def _insert_ignoring_duplicates():
+    """INSERT into vault_code that skips codes the game already has"""
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(VaultCode).prefix_with("IGNORE")
+    return dialect_insert(VaultCode).on_conflict_do_nothing(index_elements=["game_id", "code"])
+
+class CodeVault:
+    """Supplier voucher codes held per game and handed out at fulfillment.
+
+    Game.stock of a vault game counts its available codes: imports add the
+    newly stored codes to it, and allocation runs behind the usual stock hold.
+    """
+
+    @staticmethod
+    def import_codes(game_id, codes, source=None, batch_size=5000):
+        """Store codes in batches, one commit each; yields progress after every batch.
+
+        Memory stays bounded by `batch_size` whatever the length of `codes`, and
+        codes already in the vault (or repeated in the input) are skipped.
+        """
+        game = db.session.get(Game, game_id)
+        if game is None:
+            raise ValueError(f"Game {game_id} not found")
+        if not game.uses_code_vault:
+            game.uses_code_vault = True
+            db.session.commit()
+
+        totals = {"batches": 0, "read": 0, "inserted": 0, "duplicates": 0}
+        batch = []
+
+        def flush(batch):
+            now = datetime.utcnow()
+            rows = [{"game_id": game_id, "code": code, "status": "available", "source": source, "imported_at": now}
+                    for code in dict.fromkeys(batch)] # dict keeps order and drops in-batch repeats
+            inserted = len(db.session.execute(
+                _insert_ignoring_duplicates().returning(VaultCode.id), rows).all())
+            if inserted:
+                db.session.execute(
+                    update(Game).where(Game.id == game_id).values(stock=Game.stock + inserted)
+                    .execution_options(synchronize_session=False))
+            db.session.commit()
+            totals["batches"] += 1
+            totals["read"] += len(batch)
+            totals["inserted"] += inserted
+            totals["duplicates"] += len(batch) - inserted
+            return dict(totals)
+
+        for code in codes:
+            batch.append(code)
+            if len(batch) >= batch_size:
+                yield flush(batch)
+                batch = []
+        if batch:
+            yield flush(batch)
+
+    @staticmethod
+    def allocate(game_id, order_item_id, quantity):
+        """Atomically take `quantity` available codes of a game for an order item; returns the codes.
+
+        One UPDATE picks and marks the codes. On PostgreSQL the inner SELECT skips
+        rows other workers have locked, so concurrent fulfillments never wait on
+        each other; SQLite serializes writers anyway. The caller commits.
+        """
+        candidates = (select(VaultCode.id)
+                      .where(VaultCode.game_id == game_id, VaultCode.status == "available")
+                      .order_by(VaultCode.id)
+                      .limit(quantity)
+                      .with_for_update(skip_locked=True))
+        codes = db.session.execute(
+            update(VaultCode)
+            .where(VaultCode.id.in_(candidates), VaultCode.status == "available")
+            .values(status="allocated", order_item_id=order_item_id, allocated_at=datetime.utcnow())
+            .returning(VaultCode.code)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        if len(codes) < quantity:
+            CodeVault.release(order_item_id)
+            raise VaultExhausted(game_id, quantity)
+        return codes
+
+    @staticmethod
+    def release(order_item_id):
+        """Put an item's codes back into the vault"""
+        db.session.execute(
+            update(VaultCode)
+            .where(VaultCode.order_item_id == order_item_id, VaultCode.status == "allocated")
+            .values(status="available", order_item_id=None, allocated_at=None)
+            .execution_options(synchronize_session=False))
+
+    @staticmethod
+    def available_counts(game_ids=None):
+        """{game_id: available codes}, for the given vault games or all of them"""
+        query = db.session.query(VaultCode.game_id, func.count(VaultCode.id)).filter(VaultCode.status == "available")
+        if game_ids is not None:
+            query = query.filter(VaultCode.game_id.in_(game_ids))
+        return dict(query.group_by(VaultCode.game_id).all())
+
+    @staticmethod
+    def queue_low_stock_alerts(allocated):
+        """Queue an alert for each game whose vault dropped below the threshold in this transaction.
+
+        `allocated` maps game_id to the number of codes just allocated; only the
+        allocation that crosses the threshold raises an alert.
+        """
+        if not allocated:
+            return
+        threshold = current_app.config.get("VAULT_LOW_STOCK_THRESHOLD", 100)
+        available = CodeVault.available_counts(list(allocated))
+        for game_id, count in allocated.items():
+            left = available.get(game_id, 0)
+            if left < threshold <= left + count:
+                JobQueue.enqueue("vault_low_stock", {"game_id": game_id, "available": left})
+
+    @staticmethod
+    def send_low_stock_alert(game_id, available):
+        game = db.session.get(Game, game_id)
+        recipients = [current_app.config["VAULT_ALERT_EMAIL"]] if current_app.config.get("VAULT_ALERT_EMAIL") else \
+            [email for (email,) in db.session.query(User.email).filter(User.is_admin.is_(True))]
+        if not recipients:
+            print(f"Vault low stock: game {game_id} has {available} codes left (no alert recipient)")
+            return
+        message = EmailMessage()
+        message["Subject"] = f"تنبيه: مخزون الأكواد منخفض - {game.name if game else game_id}"
+        message["From"] = current_app.config.get("MAIL_DEFAULT_SENDER", "noreply@example.com")
+        message["To"] = ", ".join(recipients)
+        message.set_content(f"بقي {available} كود فقط للعبة '{game.name if game else game_id}'. يرجى استيراد أكواد جديدة.")
+        error = get_mailer().send_many([message])[0]
+        if error is not None:
+            raise RuntimeError(f"Low stock alert for game {game_id} failed: {error}")
+
+@JobQueue.handler("vault_low_stock")
+def vault_low_stock_job(payload):
+    CodeVault.send_low_stock_alert(payload["game_id"], payload["available"])